@@ -0,0 +1,379 @@
+import gc
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+# src/utils 以外 (リポジトリ直下など) から読み込まれた場合も、同じディレクトリの最適化モジュールを参照できるようにする
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+if _MODULE_DIR not in sys.path:
+    sys.path.insert(0, _MODULE_DIR)
+
+from multi_channel_listing_optimizer import (
+    SKU_MASTER,
+    USER_STRATEGY_SETTINGS,
+    MALL_REGULATIONS,
+    ALL_CHANNELS,
+    ListingOptimizer,
+    BatchListingOptimizer,
+    evaluate_sku,
+    build_final_list,
+    np,
+)
+
+# --- multi_channel_listing_optimizer.py のベンチマーク ---
+
+# 合成カタログで使うカテゴリと出現比率 (既定値)
+DEFAULT_CATEGORY_WEIGHTS: Dict[str, float] = {
+    "Figure": 0.35,
+    "TradingCard": 0.30,
+    "Apparel": 0.20,
+    "Watch": 0.10,
+    "Camera": 0.05,
+}
+
+# 計測対象の処理パス
+BENCHMARK_PATHS = ("single", "batch", "bitmask", "vectorized")
+
+
+def generate_benchmark_scenario(sku_count: int,
+                                category_weights: Optional[Dict[str, float]] = None,
+                                hts_codes_per_category: int = 3,
+                                mall_count: int = 4,
+                                accounts_per_mall: int = 2,
+                                rule_density: float = 0.3,
+                                listed_ratio: float = 0.2,
+                                out_of_stock_ratio: float = 0.1,
+                                seed: int = 0) -> Dict[str, Any]:
+    """
+    ベンチマーク用の合成シナリオ (カタログ・戦略設定・チャンネル・モール規約) を生成する。
+
+    :param sku_count: SKU数。
+    :param category_weights: カテゴリごとの出現比率 (省略時は DEFAULT_CATEGORY_WEIGHTS)。
+    :param hts_codes_per_category: カテゴリごとのHTSコードの種類数 (カテゴリ内では均等に出現)。
+    :param mall_count: モール数。チャンネル数は mall_count × accounts_per_mall。
+    :param accounts_per_mall: モールごとのアカウント数。
+    :param rule_density: 各ルール (ホワイトリスト・専門化・モール別スコア下限・モール規約) を設定する確率。
+    :param listed_ratio: 既に出品済み (Listing_Info あり) のSKUの比率。
+    :param out_of_stock_ratio: 在庫ゼロのSKUの比率。
+    :param seed: 乱数シード。
+    :return: {"catalogue", "settings", "channels", "regulations"}
+    """
+    rng = random.Random(seed)
+    category_weights = category_weights or DEFAULT_CATEGORY_WEIGHTS
+    categories = list(category_weights)
+    weights = list(category_weights.values())
+    hts_codes = {
+        category: [f"{9000 + index * 10 + n}.00.00" for n in range(hts_codes_per_category)]
+        for index, category in enumerate(categories)
+    }
+
+    malls = [f"Mall{m:02d}" for m in range(mall_count)]
+    channels = [f"{mall}_ACC-{a}" for mall in malls for a in range(accounts_per_mall)]
+
+    # モール規約: カテゴリ除外 / カテゴリ限定 / HTS除外 のいずれかを rule_density の確率で設定
+    regulations: Dict[str, Any] = {}
+    for mall in malls:
+        if rng.random() >= rule_density:
+            continue
+        kind = rng.choice(["Category_Exclusion", "Category_Inclusion", "HTS_Exclusion"])
+        if kind == "HTS_Exclusion":
+            regulations[mall] = {kind: [rng.choice(hts_codes[rng.choice(categories)])]}
+        else:
+            regulations[mall] = {kind: [rng.choice(categories)]}
+
+    settings: Dict[str, Any] = {
+        "System_Min_Ui_Score": 0,
+        "Category_Whitelist": {
+            category: rng.sample(channels, max(1, len(channels) // 2))
+            for category in categories if rng.random() < rule_density
+        },
+        "Account_Specialization": {
+            channel: rng.sample(categories, max(1, len(categories) // 2))
+            for channel in channels if rng.random() < rule_density
+        },
+        "Mall_Min_Ui_Score": {
+            channel: rng.randrange(0, 40000, 1000) for channel in channels if rng.random() < rule_density
+        },
+        "Mall_Boost_Factor": {channel: rng.choice([0.8, 1.0, 1.0, 1.1, 1.2, 1.5]) for channel in channels},
+    }
+
+    catalogue: Dict[str, Any] = {}
+    for i, category in enumerate(rng.choices(categories, weights=weights, k=sku_count)):
+        listing_info = None
+        if rng.random() < listed_ratio:
+            mall, account = rng.choice(channels).split("_")
+            listing_info = f"{mall}_{account}_LID{rng.randint(1000, 9999)}"
+        catalogue[f"SKU{i:07d}"] = {
+            "Item_ID": f"ITM{i:07d}",
+            "Category": category,
+            "Condition": "New",
+            "HTS_Code": rng.choice(hts_codes[category]),
+            "Stock": 0 if rng.random() < out_of_stock_ratio else rng.randint(1, 10),
+            "Ui_Score": rng.randint(-20000, 80000),
+            "Listing_Info": listing_info,
+        }
+    return {"catalogue": catalogue, "settings": settings, "channels": channels, "regulations": regulations}
+
+
+def generate_synthetic_catalogue(sku_count: int, seed: int = 0) -> Dict[str, Any]:
+    """SKU_MASTER のカテゴリ/HTS分布を基にした合成カタログを生成する (既定の戦略設定・チャンネル・モール規約で計測する場合に使用)"""
+    rng = random.Random(seed)
+    templates = list(SKU_MASTER.values())
+    catalogue = {}
+    for i in range(sku_count):
+        template = rng.choice(templates)
+        catalogue[f"SKU{i:07d}"] = {
+            **template,
+            "Item_ID": f"ITM{i:07d}",
+            "Stock": rng.choice([0, 1, 2, 5, 10]),
+            "Ui_Score": rng.randint(-20000, 80000),
+            "Listing_Info": rng.choice([None, None, None, "eBay_ACC-B_EID789", "Amazon_ACC-A_EID123"]),
+        }
+    return catalogue
+
+
+def _run_single(scenario: Dict[str, Any], phase_times: Dict[str, float]) -> Dict[str, Optional[str]]:
+    """ListingOptimizer.process_sku と同じ順序でフェーズを実行し、フェーズごとの所要時間を加算する"""
+    settings, channels, regulations = scenario["settings"], scenario["channels"], scenario["regulations"]
+    clock = time.perf_counter
+    winners = {}
+    for sku_id, sku_data in scenario["catalogue"].items():
+        optimizer = ListingOptimizer(sku_data.copy(), settings, verbose=False,
+                                     channels=channels, regulations=regulations)
+        t0 = clock()
+        optimizer.phase_1_system_constraints()
+        t1 = clock()
+        if optimizer.listing_candidates:
+            optimizer.phase_2_user_strategy()
+        t2 = clock()
+        winner, _ = optimizer.phase_3_optimization_and_execution(include_final_list=False)
+        t3 = clock()
+        optimizer._generate_final_list(winner)
+        t4 = clock()
+        phase_times["phase_1"] += t1 - t0
+        phase_times["phase_2"] += t2 - t1
+        phase_times["phase_3"] += t3 - t2
+        phase_times["final_list"] += t4 - t3
+        winners[sku_id] = winner
+    return winners
+
+
+def _run_batch(scenario: Dict[str, Any], phase_times: Dict[str, float]) -> Dict[str, Optional[str]]:
+    """CompiledRules + evaluate_sku + build_final_list (BatchListingOptimizer.process_skus の既定パス)"""
+    clock = time.perf_counter
+    t0 = clock()
+    rules = BatchListingOptimizer(scenario["settings"], scenario["channels"], scenario["regulations"]).rules
+    phase_times["compile"] += clock() - t0
+    winners = {}
+    for sku_id, sku_data in scenario["catalogue"].items():
+        t1 = clock()
+        winner, _, exclusion_log = evaluate_sku(sku_data, rules)
+        t2 = clock()
+        build_final_list(rules.channels, winner, exclusion_log)
+        t3 = clock()
+        phase_times["evaluate"] += t2 - t1
+        phase_times["final_list"] += t3 - t2
+        winners[sku_id] = winner
+    return winners
+
+
+def _run_bitmask(scenario: Dict[str, Any], phase_times: Dict[str, float]) -> Dict[str, Optional[str]]:
+    """CompiledRules のビットマスク表による決定のみのパス (process_skus(include_final_list=False))"""
+    clock = time.perf_counter
+    t0 = clock()
+    rules = BatchListingOptimizer(scenario["settings"], scenario["channels"], scenario["regulations"]).rules
+    t1 = clock()
+    masks = [(sku_id, rules.eligibility_mask(sku_data), sku_data["Ui_Score"])
+             for sku_id, sku_data in scenario["catalogue"].items()]
+    t2 = clock()
+    winners = {sku_id: rules.pick_winner(mask, ui_score) for sku_id, mask, ui_score in masks}
+    t3 = clock()
+    phase_times["compile"] += t1 - t0
+    phase_times["eligibility"] += t2 - t1
+    phase_times["pick_winner"] += t3 - t2
+    return winners
+
+
+def _run_vectorized(scenario: Dict[str, Any], phase_times: Dict[str, float]) -> Dict[str, Optional[str]]:
+    """BatchListingOptimizer.decide_vectorized (NumPy)"""
+    clock = time.perf_counter
+    t0 = clock()
+    optimizer = BatchListingOptimizer(scenario["settings"], scenario["channels"], scenario["regulations"])
+    optimizer.rules
+    t1 = clock()
+    winners = optimizer.decide_vectorized(scenario["catalogue"])
+    phase_times["compile"] += t1 - t0
+    phase_times["decide"] += clock() - t1
+    return winners
+
+
+PATH_RUNNERS: Dict[str, Tuple[Callable[[Dict[str, Any], Dict[str, float]], Dict[str, Optional[str]]], Tuple[str, ...]]] = {
+    "single": (_run_single, ("phase_1", "phase_2", "phase_3", "final_list")),
+    "batch": (_run_batch, ("compile", "evaluate", "final_list")),
+    "bitmask": (_run_bitmask, ("compile", "eligibility", "pick_winner")),
+    "vectorized": (_run_vectorized, ("compile", "decide")),
+}
+
+
+def benchmark_path(path: str, scenario: Dict[str, Any], repeat: int = 3,
+                   measure_memory: bool = True) -> Tuple[Dict[str, Any], Dict[str, Optional[str]]]:
+    """
+    1つの処理パスを repeat 回実行し、最速回の結果を返す。
+
+    メモリ (tracemalloc のピーク) は計測のオーバーヘッドが時間に混ざらないよう、別の1回で計測する。
+    フェーズ別時間には perf_counter 呼び出し自体のコストが含まれるため、合計は wall_seconds より大きくなり得る。
+
+    :return: (計測結果, 決定チャンネル {SKU ID: channel or None})
+    """
+    runner, phases = PATH_RUNNERS[path]
+    sku_count = len(scenario["catalogue"])
+    best: Optional[Dict[str, Any]] = None
+    winners: Dict[str, Optional[str]] = {}
+    for _ in range(repeat):
+        phase_times = dict.fromkeys(phases, 0.0)
+        gc.collect()
+        start = time.perf_counter()
+        winners = runner(scenario, phase_times)
+        wall_seconds = time.perf_counter() - start
+        if best is None or wall_seconds < best["wall_seconds"]:
+            best = {"path": path, "sku_count": sku_count, "wall_seconds": wall_seconds, "phase_seconds": phase_times}
+
+    best["skus_per_sec"] = sku_count / best["wall_seconds"] if best["wall_seconds"] else float("inf")
+    best["peak_memory_bytes"] = None
+    if measure_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            runner(scenario, dict.fromkeys(phases, 0.0))
+            _, best["peak_memory_bytes"] = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return best, winners
+
+
+def benchmark_scenario(scenario: Dict[str, Any], paths: Tuple[str, ...] = BENCHMARK_PATHS,
+                       repeat: int = 3, measure_memory: bool = True) -> List[Dict[str, Any]]:
+    """
+    1つのシナリオで各処理パスを計測する (NumPy がない場合は vectorized を除く)。
+    全パスの決定チャンネルが単一SKU処理 (または最初に計測したパス) と一致しない場合は AssertionError。
+
+    :param scenario: generate_benchmark_scenario と同じ形式の {"catalogue", "settings", "channels", "regulations"}。
+    """
+    if np is None:
+        paths = tuple(path for path in paths if path != "vectorized")
+    results = []
+    reference: Optional[Dict[str, Optional[str]]] = None
+    for path in paths:
+        result, winners = benchmark_path(path, scenario, repeat=repeat, measure_memory=measure_memory)
+        result["channel_count"] = len(scenario["channels"])
+        if reference is None:
+            reference = winners
+        elif winners != reference:
+            raise AssertionError(f"{path} パスの決定チャンネルが {paths[0]} パスと一致しません")
+        results.append(result)
+    return results
+
+
+def run_benchmark_suite(sku_counts: Tuple[int, ...] = (1000, 10000), paths: Tuple[str, ...] = BENCHMARK_PATHS,
+                        repeat: int = 3, measure_memory: bool = True, **scenario_options: Any) -> List[Dict[str, Any]]:
+    """
+    SKU数ごとに合成シナリオを生成し、各処理パスを計測する (benchmark_scenario を参照)。
+
+    :param scenario_options: generate_benchmark_scenario に渡すオプション (チャンネル数・ルール密度など)。
+    """
+    results = []
+    for sku_count in sku_counts:
+        scenario = generate_benchmark_scenario(sku_count, **scenario_options)
+        results.extend(benchmark_scenario(scenario, paths, repeat=repeat, measure_memory=measure_memory))
+    return results
+
+
+def benchmark_batch_vs_single(sku_count: int = 2000) -> Dict[str, Optional[float]]:
+    """
+    SKU_MASTER を基にした合成カタログで、単一SKU処理 (ListingOptimizer.process_sku) と一括処理・
+    ビットマスク判定・ベクトル化パスのスループットを比較する。
+    計測と決定チャンネルの一致確認は benchmark_scenario で行う。
+    """
+    scenario = {
+        "catalogue": generate_synthetic_catalogue(sku_count),
+        "settings": USER_STRATEGY_SETTINGS,
+        "channels": ALL_CHANNELS,
+        "regulations": MALL_REGULATIONS,
+    }
+    results = {result["path"]: result for result in benchmark_scenario(scenario, repeat=1, measure_memory=False)}
+    single = results["single"]
+    single_seconds = single["wall_seconds"]
+    # 表示用リストを生成しないパス (ビットマスク・ベクトル化) は、単一SKU処理の決定部分 (フェーズ1〜3) と比べる
+    decision_seconds = sum(single["phase_seconds"][phase] for phase in ("phase_1", "phase_2", "phase_3"))
+    batch_seconds = results["batch"]["wall_seconds"]
+    mask_seconds = results["bitmask"]["wall_seconds"]
+    vectorized_seconds = results["vectorized"]["wall_seconds"] if "vectorized" in results else None
+
+    result = {
+        "sku_count": sku_count,
+        "single_skus_per_sec": sku_count / single_seconds,
+        "single_decision_skus_per_sec": sku_count / decision_seconds,
+        "batch_skus_per_sec": sku_count / batch_seconds,
+        "bitmask_skus_per_sec": sku_count / mask_seconds,
+        "vectorized_skus_per_sec": sku_count / vectorized_seconds if vectorized_seconds else None,
+    }
+    print(f"[ベンチマーク] {sku_count} SKU: 単一処理 {result['single_skus_per_sec']:,.0f} SKU/秒, "
+          f"一括処理 {result['batch_skus_per_sec']:,.0f} SKU/秒 ({single_seconds / batch_seconds:.1f}倍), "
+          f"ビットマスク判定 {result['bitmask_skus_per_sec']:,.0f} SKU/秒 "
+          f"(決定のみの単一処理 {result['single_decision_skus_per_sec']:,.0f} SKU/秒の {decision_seconds / mask_seconds:.1f}倍)")
+    if vectorized_seconds:
+        print(f"[ベンチマーク] ベクトル化 (NumPy) {result['vectorized_skus_per_sec']:,.0f} SKU/秒 "
+              f"({decision_seconds / vectorized_seconds:.1f}倍)")
+    return result
+
+
+def print_benchmark_report(results: List[Dict[str, Any]]) -> None:
+    """計測結果を表形式で表示する"""
+    print(f"{'SKU数':>8} {'チャンネル':>6} {'パス':<11} {'SKU/秒':>12} {'合計(秒)':>9} {'ピークメモリ':>12}  フェーズ別(秒)")
+    print("-" * 110)
+    for result in results:
+        memory = result["peak_memory_bytes"]
+        memory_label = f"{memory / 1024 / 1024:,.1f} MB" if memory is not None else "-"
+        phases = ", ".join(f"{name} {seconds:.3f}" for name, seconds in result["phase_seconds"].items())
+        print(f"{result['sku_count']:>8,} {result['channel_count']:>10} {result['path']:<11} "
+              f"{result['skus_per_sec']:>12,.0f} {result['wall_seconds']:>9.3f} {memory_label:>12}  {phases}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="multi_channel_listing_optimizer の処理パス別ベンチマーク")
+    parser.add_argument("--skus", type=int, nargs="+", default=[1000, 10000], help="SKU数 (複数指定可)")
+    parser.add_argument("--paths", nargs="+", choices=BENCHMARK_PATHS, default=list(BENCHMARK_PATHS))
+    parser.add_argument("--malls", type=int, default=4, help="モール数")
+    parser.add_argument("--accounts-per-mall", type=int, default=2, help="モールごとのアカウント数")
+    parser.add_argument("--hts-per-category", type=int, default=3, help="カテゴリごとのHTSコード数")
+    parser.add_argument("--rule-density", type=float, default=0.3, help="各ルールを設定する確率 (0〜1)")
+    parser.add_argument("--listed-ratio", type=float, default=0.2, help="出品済みSKUの比率")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数 (最速回を採用)")
+    parser.add_argument("--no-memory", action="store_true", help="メモリ計測を省略する")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare-single", action="store_true",
+                        help="既定の戦略設定 (SKU_MASTER ベースのカタログ) で単一SKU処理との比較のみを表示する")
+    args = parser.parse_args()
+
+    if args.compare_single:
+        for sku_count in args.skus:
+            benchmark_batch_vs_single(sku_count=sku_count)
+        raise SystemExit(0)
+
+    report = run_benchmark_suite(
+        sku_counts=tuple(args.skus),
+        paths=tuple(args.paths),
+        repeat=args.repeat,
+        measure_memory=not args.no_memory,
+        mall_count=args.malls,
+        accounts_per_mall=args.accounts_per_mall,
+        hts_codes_per_category=args.hts_per_category,
+        rule_density=args.rule_density,
+        listed_ratio=args.listed_ratio,
+        seed=args.seed,
+    )
+    print_benchmark_report(report)
@@ -1,6 +1,9 @@
 import time
 import random
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
 
 # ==============================================================================
 # I. グローバル設定とFirestore/DBシミュレーション
@@ -23,6 +26,8 @@ class FirestoreQueueManager:
         self.url_queue = {}  # {url: {Target_URL: str, Source_Site: str, Scrape_Status: str, Is_New_Page: bool}}
         # 2. SKU_Master (重複排除用。既にスクレイピング・処理済みのURL/SKUを保持)
         self.sku_master = set() # 処理済みURL/SKUのセット
+        # 複数サイトの並行クロールから共有されるため、書き込みはロックで保護する
+        self._lock = threading.Lock()
         print(f"[{datetime.now().strftime('%H:%M:%S')}] DB Manager初期化: {QUEUE_COLLECTION_PATH} / {SKU_MASTER_PATH}")
         
     def add_url_to_queue(self, url: str, source_site: str, is_new: bool):
@@ -31,19 +36,20 @@ class FirestoreQueueManager:
         重複排除はクローラーモジュール側（または連携トリガー側）で行われるが、
         ここではキューへの登録処理を担う。
         """
-        if url in self.url_queue:
-            # 既にキューに存在するURLはスキップ
-            return False
-
-        doc_id = url # URL自体をドキュメントIDとして使用
-        self.url_queue[doc_id] = {
-            'Target_URL': url,
-            'Source_Site': source_site,
-            'Scrape_Status': 'Pending', # 未処理
-            'Is_New_Page': is_new,
-            'Queue_Timestamp': datetime.now().isoformat()
-        }
-        return True
+        with self._lock:
+            if url in self.url_queue:
+                # 既にキューに存在するURLはスキップ
+                return False
+
+            doc_id = url # URL自体をドキュメントIDとして使用
+            self.url_queue[doc_id] = {
+                'Target_URL': url,
+                'Source_Site': source_site,
+                'Scrape_Status': 'Pending', # 未処理
+                'Is_New_Page': is_new,
+                'Queue_Timestamp': datetime.now().isoformat()
+            }
+            return True
 
     def check_if_sku_exists(self, url: str) -> bool:
         """
@@ -67,10 +73,11 @@ class FirestoreQueueManager:
         スクレイピング後のステータス更新処理。
         """
         if url in self.url_queue:
-            self.url_queue[url]['Scrape_Status'] = status
-            if status == 'Completed':
-                # スクレイピング完了後、SKU_Masterにも登録されることをシミュレーション
-                self.sku_master.add(url)
+            with self._lock:
+                self.url_queue[url]['Scrape_Status'] = status
+                if status == 'Completed':
+                    # スクレイピング完了後、SKU_Masterにも登録されることをシミュレーション
+                    self.sku_master.add(url)
             print(f"  -> DB更新: URL {url[-20:]}... のステータスを {status} に変更。")
         else:
             print(f"  -> 警告: URL {url} はキューに見つかりません。")
@@ -169,6 +176,191 @@ class CrawlerModule:
         return new_urls_count
 
 
+# ==============================================================================
+# II-B. 複数サイト巡回のオーケストレーション
+# ==============================================================================
+
+class CronSchedule:
+    """
+    '分 時 日 月 曜日' 形式の簡易cron式を解釈するクラス。
+    各フィールドは '*', '*/n', 'a-b', 'a,b,c' の組み合わせに対応する。
+    標準のcronと同じく曜日は 0=日曜 (7も日曜)、日と曜日の両方を制限した場合はどちらかに一致すれば実行する。
+    """
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron式は5フィールドで指定してください: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse_field(field, low, high)
+            for field, (low, high) in zip(fields, self.FIELD_RANGES)
+        ]
+        # 曜日は 0=日曜 に揃える (7 は 0 と同じ日曜)
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # '*' で始まるフィールドは無制限として扱う (cronの日/曜日の OR 判定の条件)
+        self.days_restricted = not fields[2].startswith('*')
+        self.weekdays_restricted = not fields[4].startswith('*')
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_str = part.split('/')
+                step = int(step_str)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(v) for v in part.split('-'))
+            else:
+                start = end = int(part)
+            if start < low or end > high or step < 1:
+                raise ValueError(f"cron式の値が範囲外です: '{field}' ({low}-{high})")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _matches_day(self, candidate: datetime) -> bool:
+        """日と曜日の条件を判定する (両方制限されている場合は OR、それ以外は AND)"""
+        day_match = candidate.day in self.days
+        weekday_match = (candidate.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_run(self, after: datetime) -> datetime:
+        """after より後で、スケジュールに一致する最初の時刻 (分単位) を返す"""
+        candidate = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366)
+        while candidate < limit:
+            # 一致しない日・時はまとめて読み飛ばす
+            if candidate.month not in self.months or not self._matches_day(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute in self.minutes:
+                return candidate
+            candidate += timedelta(minutes=1)
+        raise ValueError(f"1年以内に一致する時刻がありません: '{self.expression}'")
+
+
+class MultiSiteCrawlOrchestrator:
+    """
+    複数サイトの CrawlerModule をまとめて管理し、1つの FirestoreQueueManager を
+    共有したまま並行実行するクラス。
+
+    - 全体の同時実行数上限 (max_concurrency)
+    - ホスト単位の同時実行数と最小アクセス間隔 (巡回先サイトへの配慮)
+    - サイト・ジョブ種別ごとのcron式スケジュール
+    """
+    JOB_METHODS = {
+        'full_crawl': 'run_full_crawl',
+        'new_page_detection': 'run_new_page_detection',
+    }
+
+    def __init__(self, db_manager: FirestoreQueueManager, max_concurrency: int = 8,
+                 per_host_concurrency: int = 1, host_min_interval: float = 2.0):
+        """
+        :param db_manager: 全サイトで共有するキューマネージャー。
+        :param max_concurrency: 全体で同時に実行するジョブ数の上限。
+        :param per_host_concurrency: 同一ホストに対して同時に実行するジョブ数の上限。
+        :param host_min_interval: 同一ホストへのジョブ開始間隔の最小値（秒）。
+        """
+        self.db_manager = db_manager
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.host_min_interval = host_min_interval
+        # {site_name: {'crawler': CrawlerModule, 'schedules': {job_type: CronSchedule}, 'next_runs': {job_type: datetime}}}
+        self.sites = {}
+        self._host_slots = {}  # {host: threading.Semaphore}
+        self._host_last_access = {}  # {host: time.monotonic()}
+        self._host_lock = threading.Lock()
+
+    def register_site(self, site_name: str, schedules: dict = None, now: datetime = None):
+        """
+        巡回対象サイトを登録する。
+        :param schedules: {ジョブ種別: cron式}。例: {'new_page_detection': '0 3 * * *'}
+        """
+        schedules = schedules or {}
+        for job_type in schedules:
+            if job_type not in self.JOB_METHODS:
+                raise ValueError(f"未対応のジョブ種別です: {job_type}")
+        now = now or datetime.now()
+        parsed = {job_type: CronSchedule(expr) for job_type, expr in schedules.items()}
+        self.sites[site_name] = {
+            'crawler': CrawlerModule(site_name=site_name),
+            'schedules': parsed,
+            'next_runs': {job_type: cron.next_run(now) for job_type, cron in parsed.items()},
+        }
+
+    def _acquire_host(self, host: str):
+        """ホスト単位の実行枠を確保し、最小アクセス間隔を守るまで待機する"""
+        with self._host_lock:
+            slot = self._host_slots.setdefault(host, threading.Semaphore(self.per_host_concurrency))
+        slot.acquire()
+        while True:
+            with self._host_lock:
+                elapsed = time.monotonic() - self._host_last_access.get(host, float('-inf'))
+                if elapsed >= self.host_min_interval:
+                    self._host_last_access[host] = time.monotonic()
+                    return
+                wait = self.host_min_interval - elapsed
+            time.sleep(wait)
+
+    def _release_host(self, host: str):
+        self._host_slots[host].release()
+
+    def _run_job(self, site_name: str, job_type: str) -> int:
+        crawler = self.sites[site_name]['crawler']
+        host = urlparse(crawler.source_url).netloc
+        self._acquire_host(host)
+        try:
+            return getattr(crawler, self.JOB_METHODS[job_type])(self.db_manager)
+        finally:
+            self._release_host(host)
+
+    def run_jobs(self, jobs: list) -> dict:
+        """
+        (サイト名, ジョブ種別) のリストを並行実行し、{(サイト名, ジョブ種別): 追加URL件数} を返す。
+        失敗したジョブの件数は None として記録する。
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {job: executor.submit(self._run_job, *job) for job in jobs}
+            for job, future in futures.items():
+                try:
+                    results[job] = future.result()
+                except Exception as e:
+                    print(f"  -> 警告: {job[0]} の {job[1]} が失敗しました: {e}")
+                    results[job] = None
+        return results
+
+    def run_due_jobs(self, now: datetime = None) -> dict:
+        """予定時刻を過ぎたジョブをまとめて実行し、次回予定時刻を更新する"""
+        now = now or datetime.now()
+        due_jobs = []
+        for site_name, site in self.sites.items():
+            for job_type, next_run in site['next_runs'].items():
+                if next_run <= now:
+                    due_jobs.append((site_name, job_type))
+                    site['next_runs'][job_type] = site['schedules'][job_type].next_run(now)
+        if not due_jobs:
+            return {}
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] 予定時刻に達したジョブ {len(due_jobs)} 件を並行実行します。")
+        return self.run_jobs(due_jobs)
+
+    def run_forever(self, poll_interval: float = 30.0, stop_event: threading.Event = None):
+        """stop_event がセットされるまで、スケジュールに従ってジョブを実行し続ける"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            self.run_due_jobs()
+            stop_event.wait(poll_interval)
+
+
 # ==============================================================================
 # III. 既存ツールの修正指示シミュレーション
 # ==============================================================================
@@ -252,6 +444,14 @@ if __name__ == '__main__':
         # 5. キューに新規URLが追加されたため、スクレイピングモジュールが再度起動
         processed_today = scraper_batch.process_queue(db_manager)
         
+    # 6. 複数サイトの日次新規ページ検知を、キューマネージャーを共有したまま並行実行
+    print("\n[シミュレーション段階 5: 複数サイトの並行クロール (オーケストレーター)]")
+    orchestrator = MultiSiteCrawlOrchestrator(db_manager, max_concurrency=4, host_min_interval=0.5)
+    for site in ['singlestar.jp', 'hareruyamtg.com', 'cardrush.jp']:
+        orchestrator.register_site(site, schedules={'new_page_detection': '0 3 * * *', 'full_crawl': '0 4 1 * *'})
+    multi_site_results = orchestrator.run_jobs([(site, 'new_page_detection') for site in orchestrator.sites])
+    print(f"  -> サイト別の新規URL件数: { {site: count for (site, _), count in multi_site_results.items()} }")
+
     print("\n--- シミュレーション完了 ---")
     print(f"最終的な処理済みSKU数 (SKU_Master): {len(db_manager.sku_master)} 件")
     print(f"最終的なキュー内の総エントリ数: {len(db_manager.url_queue)} 件")
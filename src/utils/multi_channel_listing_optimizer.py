@@ -1,5 +1,18 @@
+import json
+import time
+import bisect
+import heapq
 import random
-from typing import Dict, Any, List, Optional, Tuple
+import sqlite3
+import threading
+from enum import Enum
+from contextlib import closing
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+try:
+    import numpy as np
+except ImportError:  # ベクトル化パス (BatchListingOptimizer.decide_vectorized) 使用時のみ必須
+    np = None
 
 # --- データ構造の定義（シミュレーション用ダミーデータ） ---
 
@@ -91,28 +104,197 @@ ALL_CHANNELS = [
     "MercadoLibre_ACC-L", "Chrono24_ACC-R", "TCGplayer_ACC-T", "CardMarket_ACC-C"
 ]
 
+# --- 除外理由の構造化記録 ---
+
+class ExclusionReason(Enum):
+    """チャンネル除外理由のコード。値は表示用メッセージのテンプレート"""
+    ACCOUNT_DUPLICATE = "アカウント重複禁止: {listed_mall} の {listed_acc} で既に排他的出品済み"
+    CATEGORY_EXCLUDED = "モール規約違反: カテゴリ '{category}' は {mall} で出品規制"
+    CATEGORY_NOT_INCLUDED = "モール規約違反: {mall} はカテゴリ '{category}' 以外の出品を許可しない"
+    HTS_EXCLUDED = "モール規約違反: HTSコード '{hts_code}' は {mall} で出品規制"
+    NOT_IN_WHITELIST = "戦略フィルタ: カテゴリ '{category}' の出品先ホワイトリスト ({whitelist}) に含まれない"
+    ACCOUNT_SPECIALIZATION = "戦略フィルタ: アカウント専門化ルールにより、{account} は '{category}' 以外の出品をしない"
+    BELOW_MALL_MIN_SCORE = "戦略フィルタ: U_iスコア ({ui_score}) がモール別最低ライン ({min_score}) を下回る"
+    NOT_SELECTED = "排他的出品実行: {winner} が最適出品先として選ばれたため"
+    LOCK_CONFLICT = "排他的ロック競合: 読み込み後に他のワーカーがSKU_Masterを更新したため出品を中止"
+
+
+class DecisionRecord:
+    """
+    除外理由コードとそのパラメータ。表示用メッセージは message (str()) で参照した時点で初めて生成する。
+    """
+    __slots__ = ("code", "params")
+
+    def __init__(self, code: ExclusionReason, **params: Any):
+        self.code = code
+        self.params = params
+
+    @property
+    def message(self) -> str:
+        params = {
+            key: ",".join(value) if isinstance(value, (list, tuple)) else value
+            for key, value in self.params.items()
+        }
+        return self.code.value.format(**params)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ログ出力・API応答向けの構造化表現"""
+        return {"Code": self.code.name, **self.params}
+
+    def __str__(self) -> str:
+        return self.message
+
+    def __repr__(self) -> str:
+        return f"DecisionRecord({self.code.name}, {self.params})"
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, DecisionRecord) and self.code is other.code and self.params == other.params
+
+    def __hash__(self) -> int:
+        # パラメータの値はすべてハッシュ可能 (リストはタプルで渡す) な前提
+        return hash((self.code, tuple(sorted(self.params.items()))))
+
+# --- SKU_Master の排他制御 (並列ワーカー向け) ---
+
+class VersionedSkuStore:
+    """
+    SKU_Master をバージョン付きレコードとして保持するインメモリストア (スレッドセーフ)。
+    書き込みは compare_and_set により「読み込んだ時点からバージョンが変わっていない場合のみ」成功し、
+    複数の最適化ワーカーが同じSKUを同時に処理しても二重出品が起きない。
+    """
+
+    def __init__(self, sku_master: Dict[str, Any]):
+        self._records: Dict[str, Tuple[Dict[str, Any], int]] = {
+            sku_id: (dict(sku_data), 0) for sku_id, sku_data in sku_master.items()
+        }
+        self._lock = threading.Lock()
+
+    def get(self, sku_id: str) -> Tuple[Dict[str, Any], int]:
+        """(SKUデータのコピー, バージョン) を返す"""
+        with self._lock:
+            sku_data, version = self._records[sku_id]
+            return dict(sku_data), version
+
+    def compare_and_set(self, sku_id: str, expected_version: int, updates: Dict[str, Any]) -> bool:
+        """バージョンが expected_version と一致する場合のみ updates を反映し、バージョンを1つ進める"""
+        with self._lock:
+            sku_data, version = self._records[sku_id]
+            if version != expected_version:
+                return False
+            self._records[sku_id] = ({**sku_data, **updates}, version + 1)
+            return True
+
+    def versions(self) -> Dict[str, int]:
+        """{SKU ID: 現在のバージョン} を返す (ワーカーへ渡すジョブの作成に使う)"""
+        with self._lock:
+            return {sku_id: version for sku_id, (_, version) in self._records.items()}
+
+
+class SqliteSkuStore:
+    """
+    VersionedSkuStore と同じインターフェースを SQLite で提供するストア。
+    compare_and_set は条件付き UPDATE (WHERE version = ?) で行うため、
+    同じDBファイルを開いた複数プロセスのワーカー間でも排他が保証される。
+    (本番の Firestore ではトランザクションの事前条件で同じ契約を実現する)
+    """
+
+    def __init__(self, path: str, sku_master: Optional[Dict[str, Any]] = None):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sku_master ("
+                "sku_id TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL)"
+            )
+            if sku_master:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO sku_master (sku_id, data, version) VALUES (?, ?, 0)",
+                    [(sku_id, json.dumps(sku_data, ensure_ascii=False)) for sku_id, sku_data in sku_master.items()],
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, sku_id: str) -> Tuple[Dict[str, Any], int]:
+        """(SKUデータ, バージョン) を返す"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT data, version FROM sku_master WHERE sku_id = ?", (sku_id,)).fetchone()
+        if row is None:
+            raise KeyError(sku_id)
+        return json.loads(row[0]), row[1]
+
+    def compare_and_set(self, sku_id: str, expected_version: int, updates: Dict[str, Any]) -> bool:
+        """バージョンが expected_version と一致する場合のみ updates を反映し、バージョンを1つ進める"""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT data FROM sku_master WHERE sku_id = ? AND version = ?", (sku_id, expected_version)
+            ).fetchone()
+            if row is None:
+                return False
+            data = json.dumps({**json.loads(row[0]), **updates}, ensure_ascii=False)
+            cursor = conn.execute(
+                "UPDATE sku_master SET data = ?, version = version + 1 WHERE sku_id = ? AND version = ?",
+                (data, sku_id, expected_version),
+            )
+            return cursor.rowcount == 1
+
+    def versions(self) -> Dict[str, int]:
+        """{SKU ID: 現在のバージョン} を返す (ワーカーへ渡すジョブの作成に使う)"""
+        with closing(self._connect()) as conn:
+            return dict(conn.execute("SELECT sku_id, version FROM sku_master ORDER BY sku_id"))
+
+
 class ListingOptimizer:
     """
     開発指示書 II. コアロジック：出品先決定の3フェーズ処理 を実行するクラス
     """
     
-    def __init__(self, sku_data: Dict[str, Any], settings: Dict[str, Any]):
+    def __init__(self, sku_data: Dict[str, Any], settings: Dict[str, Any],
+                 sku_store: Optional[Any] = None, sku_id: Optional[str] = None, sku_version: Optional[int] = None,
+                 verbose: bool = True, channels: Optional[List[str]] = None,
+                 regulations: Optional[Dict[str, Any]] = None):
+        """
+        :param verbose: False の場合、フェーズごとの進捗を標準出力に表示しない (一括処理向けのサイレントモード)。
+        :param channels: 出品先チャンネル一覧 (省略時は ALL_CHANNELS)。
+        :param regulations: モール規約 (省略時は MALL_REGULATIONS)。
+        :param sku_store: 指定した場合、排他的ロックを sku_store.compare_and_set で書き込む
+                          (VersionedSkuStore / SqliteSkuStore)。from_store での生成を推奨。
+        :param sku_id: sku_store 上のSKU ID。
+        :param sku_version: sku_data を読み込んだ時点のバージョン。
+        """
         self.sku_data = sku_data
         self.settings = settings
-        self.listing_candidates: List[str] = ALL_CHANNELS.copy()
-        self.exclusion_log: Dict[str, str] = {}
+        self.sku_store = sku_store
+        self.sku_id = sku_id
+        self.sku_version = sku_version
+        self.channels: List[str] = list(channels if channels is not None else ALL_CHANNELS)
+        self.regulations: Dict[str, Any] = regulations if regulations is not None else MALL_REGULATIONS
+        self.listing_candidates: List[str] = self.channels.copy()
+        self.verbose = verbose
+        self.exclusion_log: Dict[str, DecisionRecord] = {}
+
+    @classmethod
+    def from_store(cls, sku_store: Any, sku_id: str, settings: Dict[str, Any],
+                   verbose: bool = True) -> "ListingOptimizer":
+        """ストアからSKUデータとバージョンを読み込み、CAS書き込みを行うオプティマイザーを生成する"""
+        sku_data, version = sku_store.get(sku_id)
+        return cls(sku_data, settings, sku_store=sku_store, sku_id=sku_id, sku_version=version, verbose=verbose)
+
+    def _print(self, template: str, *args: Any, **kwargs: Any) -> None:
+        """verbose の場合のみ、テンプレートを整形して表示する (サイレントモードでは整形もしない)"""
+        if self.verbose:
+            print(template.format(*args, **kwargs))
     
-    def _log_exclusion(self, channel: str, reason: str):
-        """チャンネルを出品候補から除外し、その理由を記録する"""
+    def _log_exclusion(self, channel: str, code: ExclusionReason, **params: Any):
+        """チャンネルを出品候補から除外し、その理由コードとパラメータを記録する"""
         if channel in self.listing_candidates:
             self.listing_candidates.remove(channel)
-            self.exclusion_log[channel] = reason
+            self.exclusion_log[channel] = DecisionRecord(code, **params)
 
     def phase_1_system_constraints(self) -> None:
         """
         フェーズ 1: システム制約と出品可否の判断（自動排除）
         """
-        print("\n--- [フェーズ 1: システム制約 (自動排除)] ---")
+        self._print("\n--- [フェーズ 1: システム制約 (自動排除)] ---")
         item_id = self.sku_data["Item_ID"]
         category = self.sku_data["Category"]
         hts_code = self.sku_data["HTS_Code"]
@@ -121,14 +303,13 @@ class ListingOptimizer:
         
         # C. 在庫/スコアフィルタ（全モール対象の自動排除）
         if stock == 0:
-            reason = "在庫数がゼロのため、全モールから除外"
-            print(f"❌ 全モール除外: {reason}")
+            self._print("❌ 全モール除外: 在庫数がゼロのため、全モールから除外")
             self.listing_candidates = []
             return
         
         if ui_score < self.settings["System_Min_Ui_Score"]:
-            reason = f"U_iスコア ({ui_score}) がシステム最低ライン ({self.settings['System_Min_Ui_Score']}) を下回るため、全モールから除外"
-            print(f"❌ 全モール除外: {reason}")
+            self._print("❌ 全モール除外: U_iスコア ({}) がシステム最低ライン ({}) を下回るため、全モールから除外",
+                        ui_score, self.settings["System_Min_Ui_Score"])
             self.listing_candidates = []
             return
 
@@ -136,7 +317,7 @@ class ListingOptimizer:
         listing_info = self.sku_data.get("Listing_Info")
         if listing_info:
             listed_mall, listed_acc, _ = listing_info.split("_")
-            print(f"⚠️ Item_ID ({item_id}) は既に {listed_mall} の {listed_acc} で出品済みです。")
+            self._print("⚠️ Item_ID ({}) は既に {} の {} で出品済みです。", item_id, listed_mall, listed_acc)
             
             channels_to_exclude = []
             for channel in self.listing_candidates:
@@ -146,62 +327,63 @@ class ListingOptimizer:
                     channels_to_exclude.append(channel)
             
             for channel in channels_to_exclude:
-                self._log_exclusion(channel, f"アカウント重複禁止: {listed_mall} の {listed_acc} で既に排他的出品済み")
+                self._log_exclusion(channel, ExclusionReason.ACCOUNT_DUPLICATE,
+                                   listed_mall=listed_mall, listed_acc=listed_acc)
 
         # B. モール規約フィルタ
-        channels_to_exclude = []
-        for channel in self.listing_candidates:
+        # (ループ中に _log_exclusion で候補リストが変化するため、コピーを走査する)
+        for channel in list(self.listing_candidates):
             mall, _ = channel.split("_")
-            regulation = MALL_REGULATIONS.get(mall, {})
+            regulation = self.regulations.get(mall, {})
             
-            # カテゴリ規制
+            # カテゴリ規制 (複数の規制に該当する場合は最初の理由を記録)
             if category in regulation.get("Category_Exclusion", []):
-                self._log_exclusion(channel, f"モール規約違反: カテゴリ '{category}' は {mall} で出品規制")
+                self._log_exclusion(channel, ExclusionReason.CATEGORY_EXCLUDED, category=category, mall=mall)
             if regulation.get("Category_Inclusion") and category not in regulation["Category_Inclusion"]:
-                self._log_exclusion(channel, f"モール規約違反: {mall} はカテゴリ '{category}' 以外の出品を許可しない")
+                self._log_exclusion(channel, ExclusionReason.CATEGORY_NOT_INCLUDED, category=category, mall=mall)
             
             # HTSコード規制
             if hts_code in regulation.get("HTS_Exclusion", []):
-                self._log_exclusion(channel, f"モール規約違反: HTSコード '{hts_code}' は {mall} で出品規制")
+                self._log_exclusion(channel, ExclusionReason.HTS_EXCLUDED, hts_code=hts_code, mall=mall)
     
     def phase_2_user_strategy(self) -> None:
         """
         フェーズ 2: ユーザー戦略の適用（戦略的フィルタリング）
         """
-        print("\n--- [フェーズ 2: ユーザー戦略 (戦略的フィルタリング)] ---")
+        self._print("\n--- [フェーズ 2: ユーザー戦略 (戦略的フィルタリング)] ---")
         category = self.sku_data["Category"]
         
-        channels_to_exclude = []
-        for channel in self.listing_candidates:
+        for channel in list(self.listing_candidates):
             mall, account = channel.split("_")
             
             # D. カテゴリ・モール限定（ルールベースホワイトリスト）
             whitelist = self.settings["Category_Whitelist"].get(category)
             if whitelist is not None and channel not in whitelist:
-                self._log_exclusion(channel, f"戦略フィルタ: カテゴリ '{category}' の出品先ホワイトリスト ({','.join(whitelist)}) に含まれない")
+                self._log_exclusion(channel, ExclusionReason.NOT_IN_WHITELIST, category=category, whitelist=tuple(whitelist))
                 continue
             
             # E. アカウント専門化
             specialized_categories = self.settings["Account_Specialization"].get(channel)
             if specialized_categories is not None and category not in specialized_categories:
-                self._log_exclusion(channel, f"戦略フィルタ: アカウント専門化ルールにより、{account} は '{category}' 以外の出品をしない")
+                self._log_exclusion(channel, ExclusionReason.ACCOUNT_SPECIALIZATION, account=account, category=category)
                 continue
 
             # F. スコア下限設定（モール/アカウント別）
             min_score = self.settings["Mall_Min_Ui_Score"].get(channel, self.settings["System_Min_Ui_Score"])
             if self.sku_data["Ui_Score"] < min_score:
-                self._log_exclusion(channel, f"戦略フィルタ: U_iスコア ({self.sku_data['Ui_Score']}) がモール別最低ライン ({min_score}) を下回る")
+                self._log_exclusion(channel, ExclusionReason.BELOW_MALL_MIN_SCORE,
+                                    ui_score=self.sku_data["Ui_Score"], min_score=min_score)
                 continue
 
-    def phase_3_optimization_and_execution(self) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    def phase_3_optimization_and_execution(self, include_final_list: bool = True) -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
         """
         フェーズ 3: 最適化と排他的出品実行（U_i,Mallによる決定）
         """
-        print("\n--- [フェーズ 3: 最適化と排他的出品実行] ---")
+        self._print("\n--- [フェーズ 3: 最適化と排他的出品実行] ---")
         
         if not self.listing_candidates:
-            print("🛑 出品可能なチャンネルが残っていません。出品は中止されます。")
-            return None, self._generate_final_list()
+            self._print("🛑 出品可能なチャンネルが残っていません。出品は中止されます。")
+            return None, self._generate_final_list() if include_final_list else None
         
         # モール別スコアの計算: U_i,Mall = U_i * M_Mall
         ui_base = self.sku_data["Ui_Score"]
@@ -220,82 +402,748 @@ class ListingOptimizer:
         # 出品先決定: U_i,Mall スコアが最も高いチャンネルを第一出品先とする
         best_channel = max(score_details, key=lambda x: x["Ui_Mall_Score"])
         
-        print(f"✅ 最適出品先決定: {best_channel['Channel']}")
-        print(f"   ∟ 最終スコア (U_i,Mall): {best_channel['Ui_Mall_Score']:.2f} (ベース {ui_base} x ブースト {best_channel['Boost_Factor']})")
+        self._print("✅ 最適出品先決定: {}", best_channel["Channel"])
+        self._print("   ∟ 最終スコア (U_i,Mall): {:.2f} (ベース {} x ブースト {})",
+                    best_channel["Ui_Mall_Score"], ui_base, best_channel["Boost_Factor"])
         
         # 実行シミュレーション（排他的ロックの徹底）
-        self.simulate_exclusive_lock(best_channel['Channel'], self.sku_data["Item_ID"])
+        if not self.simulate_exclusive_lock(best_channel['Channel'], self.sku_data["Item_ID"]):
+            # 他のワーカーが先に書き込んだため出品しない
+            for detail in score_details:
+                self._log_exclusion(detail["Channel"], ExclusionReason.LOCK_CONFLICT)
+            return None, self._generate_final_list() if include_final_list else None
         
         # 第一出品先以外は排他的ロックにより除外として記録
         for detail in score_details:
             if detail["Channel"] != best_channel["Channel"]:
-                self._log_exclusion(detail["Channel"], f"排他的出品実行: {best_channel['Channel']} が最適出品先として選ばれたため")
+                self._log_exclusion(detail["Channel"], ExclusionReason.NOT_SELECTED, winner=best_channel["Channel"])
         
-        return best_channel["Channel"], self._generate_final_list(best_channel["Channel"])
+        return best_channel["Channel"], self._generate_final_list(best_channel["Channel"]) if include_final_list else None
 
-    def simulate_exclusive_lock(self, channel: str, item_id: str):
+    def simulate_exclusive_lock(self, channel: str, item_id: str) -> bool:
         """
         IV. 既存ツールの修正指示 1. 排他的ロックの徹底
-        出品成功時、DBのSKU_MasterテーブルのItem_IDフィールドに書き込みをシミュレート
+        出品成功時、DBのSKU_MasterテーブルのItem_IDフィールドに書き込みをシミュレート。
+        sku_store がある場合は読み込み時のバージョンを条件に書き込み (compare-and-set)、
+        他のワーカーが先に更新していた場合は False を返す。
         """
-        mall, account = channel.split("_")
-        listing_id = f"LID{random.randint(1000, 9999)}"
-        new_listing_info = f"{mall}_{account}_{listing_id}"
+        new_listing_info = _new_listing_info(channel)
+
+        if self.sku_store is not None:
+            if not self.sku_store.compare_and_set(self.sku_id, self.sku_version, {"Listing_Info": new_listing_info}):
+                self._print("   ∟ 排他的ロック競合: Item_ID='{}' は読み込み後に他のワーカーが更新したため、書き込みを中止しました。", item_id)
+                return False
+            self.sku_version += 1
         
         # DB書き込みシミュレーション
         self.sku_data["Listing_Info"] = new_listing_info
         
-        print(f"   ∟ 排他的ロック発動: SKU_MasterのItem_ID='{item_id}'に'{new_listing_info}'を書き込みました。")
+        self._print("   ∟ 排他的ロック発動: SKU_MasterのItem_ID='{}'に'{}'を書き込みました。", item_id, new_listing_info)
+        return True
 
     def _generate_final_list(self, final_winner: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         IV. 既存ツールの修正指示 2. 出品可能先の表示 のための最終リストを生成
+        (除外理由の表示用メッセージはここで初めて整形する。Reason_Code は除外理由コード名)
         """
         final_list = []
         
         # 出品候補に残ったチャンネル（出品可能と判断された）
-        for channel in ALL_CHANNELS:
+        for channel in self.channels:
             status = "❌ 出品不可"
-            reason = self.exclusion_log.get(channel)
+            record = self.exclusion_log.get(channel)
+            reason = record.message if record else None
+            reason_code = record.code.name if record else None
             
             if final_winner and channel == final_winner:
                 status = "🟢 出品決定"
                 reason = "最終最適化スコアに基づき決定"
+                reason_code = None
             elif channel in self.listing_candidates:
                 # フェーズ2まで通過したが、フェーズ3で排他的ロックにより除外されたケースは既にログに記録済み
                 pass
             
             if status == "❌ 出品不可":
-                final_list.append({"Channel": channel, "Status": status, "Reason": reason})
+                final_list.append({"Channel": channel, "Status": status, "Reason": reason, "Reason_Code": reason_code})
             elif status == "🟢 出品決定":
-                final_list.append({"Channel": channel, "Status": status, "Reason": reason})
+                final_list.append({"Channel": channel, "Status": status, "Reason": reason, "Reason_Code": reason_code})
             else:
                 # フィルタリングを通過したが、最終決定/ロックのステップに至らなかった場合（理論上はありえないが安全のため）
-                 final_list.append({"Channel": channel, "Status": "⚠️ 候補に残ったが未出品", "Reason": "排他的ロックの競合に敗れた可能性があります"})
+                 final_list.append({"Channel": channel, "Status": "⚠️ 候補に残ったが未出品", "Reason": "排他的ロックの競合に敗れた可能性があります", "Reason_Code": None})
                  
         return final_list
 
-    def process_sku(self) -> Tuple[Optional[str], List[Dict[str, Any]]]:
-        """SKUの出品先決定プロセス全体を実行する"""
-        print(f"==========================================")
-        print(f"SKU処理開始: {self.sku_data['Item_ID']} ({self.sku_data['Category']})")
-        print(f"U_iスコア: {self.sku_data['Ui_Score']}")
-        print(f"==========================================")
+    def process_sku(self, include_final_list: bool = True) -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
+        """
+        SKUの出品先決定プロセス全体を実行する
+
+        :param include_final_list: False の場合、表示用リストを生成せず None を返す。
+                                   除外理由は exclusion_log に残るため、後から _generate_final_list で生成できる。
+        """
+        self._print("==========================================")
+        self._print("SKU処理開始: {} ({})", self.sku_data["Item_ID"], self.sku_data["Category"])
+        self._print("U_iスコア: {}", self.sku_data["Ui_Score"])
+        self._print("==========================================")
         
         # 1. フェーズ1実行
         self.phase_1_system_constraints()
-        print(f"\n[中間結果 1] フェーズ1通過チャンネル: {len(self.listing_candidates)} / {len(ALL_CHANNELS)} チャンネル")
+        self._print("\n[中間結果 1] フェーズ1通過チャンネル: {} / {} チャンネル", len(self.listing_candidates), len(self.channels))
         
         # 2. フェーズ2実行
         if self.listing_candidates:
             self.phase_2_user_strategy()
-        print(f"\n[中間結果 2] フェーズ2通過チャンネル: {len(self.listing_candidates)} チャンネル")
+        self._print("\n[中間結果 2] フェーズ2通過チャンネル: {} チャンネル", len(self.listing_candidates))
         
         # 3. フェーズ3実行
-        winner, final_list = self.phase_3_optimization_and_execution()
+        winner, final_list = self.phase_3_optimization_and_execution(include_final_list)
         
         return winner, final_list
 
+# --- 複数SKUの一括処理 ---
+
+class CompiledRules:
+    """
+    USER_STRATEGY_SETTINGS と MALL_REGULATIONS を、チャンネル単位の参照テーブルへ事前変換したもの。
+    ListingOptimizer が SKU ごと・チャンネルごとに行う文字列分割や設定辞書の参照を、
+    カタログ全体の一括処理では1回だけにするために使う。
+
+    出品可否はチャンネルごとのビット (channels[i] -> 1 << i) を並べたビットマスクでも保持する。
+    - カテゴリ × HTSコード: 規約・ホワイトリスト・専門化を通過するチャンネル (組み合わせごとにメモ化)
+    - スコア下限: 閾値の昇順に、その閾値以下で出品可能になるチャンネルの累積マスク
+    - 重複出品: 出品済み (モール, アカウント) ごとの除外マスク
+    """
+
+    def __init__(self, settings: Dict[str, Any], channels: List[str] = ALL_CHANNELS,
+                 regulations: Dict[str, Any] = MALL_REGULATIONS):
+        self.channels: Tuple[str, ...] = tuple(channels)
+        self.channel_parts: Dict[str, Tuple[str, str]] = {
+            channel: tuple(channel.split("_")) for channel in self.channels
+        }
+        self.system_min_score = settings["System_Min_Ui_Score"]
+        self.whitelists: Dict[str, frozenset] = {
+            category: frozenset(channels) for category, channels in settings["Category_Whitelist"].items()
+        }
+        # DecisionRecord のパラメータ用 (ListingOptimizer と同じくタプルで渡す)
+        self.whitelist_params: Dict[str, Tuple[str, ...]] = {
+            category: tuple(channels) for category, channels in settings["Category_Whitelist"].items()
+        }
+        self.specializations: Dict[str, frozenset] = {
+            channel: frozenset(categories) for channel, categories in settings["Account_Specialization"].items()
+        }
+        self.min_scores: Dict[str, float] = {
+            channel: settings["Mall_Min_Ui_Score"].get(channel, self.system_min_score) for channel in self.channels
+        }
+        self.boosts: Dict[str, float] = {
+            channel: settings["Mall_Boost_Factor"].get(channel, 1.0) for channel in self.channels
+        }
+        # {channel: (カテゴリ除外, カテゴリ限定 or None, HTS除外)}
+        self.regulations: Dict[str, Tuple[frozenset, Optional[frozenset], frozenset]] = {}
+        for channel, (mall, _) in self.channel_parts.items():
+            regulation = regulations.get(mall, {})
+            inclusion = regulation.get("Category_Inclusion")
+            self.regulations[channel] = (
+                frozenset(regulation.get("Category_Exclusion", [])),
+                frozenset(inclusion) if inclusion else None,
+                frozenset(regulation.get("HTS_Exclusion", [])),
+            )
+
+        # --- ビットマスク表 ---
+        self.channel_bits: Dict[str, int] = {channel: 1 << i for i, channel in enumerate(self.channels)}
+        self.all_mask = (1 << len(self.channels)) - 1
+        self._static_masks: Dict[Tuple[str, str], int] = {}
+        self._duplicate_masks: Dict[Tuple[str, str], int] = {}
+        # スコア下限: thresholds[k] 以上のスコアで score_masks[k] のチャンネルが出品可能
+        self.score_thresholds: List[float] = sorted(set(self.min_scores.values()))
+        self.score_masks: List[int] = []
+        mask = 0
+        for threshold in self.score_thresholds:
+            for channel, min_score in self.min_scores.items():
+                if min_score == threshold:
+                    mask |= self.channel_bits[channel]
+            self.score_masks.append(mask)
+        # フェーズ3の勝者探索順 (U_i,Mall = U_i * boost の大きい順。同点はチャンネル順)
+        indexed = list(enumerate(self.channels))
+        self.order_positive = [channel for _, channel in sorted(indexed, key=lambda item: (-self.boosts[item[1]], item[0]))]
+        self.order_negative = [channel for _, channel in sorted(indexed, key=lambda item: (self.boosts[item[1]], item[0]))]
+
+    def static_mask(self, category: str, hts_code: str) -> int:
+        """カテゴリとHTSコードだけで決まる出品可能チャンネルのマスク (規約・ホワイトリスト・専門化)"""
+        key = (category, hts_code)
+        mask = self._static_masks.get(key)
+        if mask is None:
+            whitelist = self.whitelists.get(category)
+            mask = 0
+            for channel in self.channels:
+                category_exclusion, category_inclusion, hts_exclusion = self.regulations[channel]
+                specialized_categories = self.specializations.get(channel)
+                if (category in category_exclusion
+                        or (category_inclusion is not None and category not in category_inclusion)
+                        or hts_code in hts_exclusion
+                        or (whitelist is not None and channel not in whitelist)
+                        or (specialized_categories is not None and category not in specialized_categories)):
+                    continue
+                mask |= self.channel_bits[channel]
+            self._static_masks[key] = mask
+        return mask
+
+    def duplicate_mask(self, listing_info: Optional[str]) -> int:
+        """既に出品済みのモールで、別アカウントのチャンネルを表すマスク (除外対象)"""
+        if not listing_info:
+            return 0
+        listed_mall, listed_acc, _ = listing_info.split("_")
+        return self.listed_account_mask(listed_mall, listed_acc)
+
+    def listed_account_mask(self, listed_mall: str, listed_acc: str) -> int:
+        """listed_mall の listed_acc で出品済みの場合に除外される、同モール別アカウントのマスク"""
+        key = (listed_mall, listed_acc)
+        mask = self._duplicate_masks.get(key)
+        if mask is None:
+            mask = 0
+            for channel, (mall, account) in self.channel_parts.items():
+                if mall == listed_mall and account != listed_acc:
+                    mask |= self.channel_bits[channel]
+            self._duplicate_masks[key] = mask
+        return mask
+
+    def score_mask(self, ui_score: float) -> int:
+        """モール別スコア下限を満たすチャンネルのマスク"""
+        position = bisect.bisect_right(self.score_thresholds, ui_score)
+        return self.score_masks[position - 1] if position else 0
+
+    def eligibility_mask(self, sku_data: Dict[str, Any]) -> int:
+        """フェーズ1・2を通過するチャンネルのマスク (ビット演算のみで評価する)"""
+        ui_score = sku_data["Ui_Score"]
+        if sku_data["Stock"] == 0 or ui_score < self.system_min_score:
+            return 0
+        return (self.static_mask(sku_data["Category"], sku_data["HTS_Code"])
+                & self.score_mask(ui_score)
+                & ~self.duplicate_mask(sku_data.get("Listing_Info")))
+
+    def pick_winner(self, mask: int, ui_score: float) -> Optional[str]:
+        """マスク内で U_i,Mall が最大のチャンネル (フェーズ3) を返す"""
+        if not mask:
+            return None
+        if ui_score > 0:
+            order = self.order_positive
+        elif ui_score < 0:
+            order = self.order_negative
+        else:
+            order = self.channels
+        bits = self.channel_bits
+        for channel in order:
+            if mask & bits[channel]:
+                return channel
+        return None
+
+    def channels_in(self, mask: int) -> List[str]:
+        """マスクをチャンネル名のリスト (チャンネル順) に戻す"""
+        return [channel for channel in self.channels if mask & self.channel_bits[channel]]
+
+
+def _new_listing_info(channel: str) -> str:
+    """排他的ロックで SKU_Master に書き込む 'モール名_アカウントID_出品ID' を生成する"""
+    mall, account = channel.split("_")
+    return f"{mall}_{account}_LID{random.randint(1000, 9999)}"
+
+
+def evaluate_sku(sku_data: Dict[str, Any], rules: CompiledRules) -> Tuple[Optional[str], List[str], Dict[str, DecisionRecord]]:
+    """
+    ListingOptimizer のフェーズ1〜3を、事前変換済みのルールで出力なしに評価する。
+
+    Returns:
+        (決定チャンネル or None, フェーズ2通過チャンネル, 除外理由 {channel: DecisionRecord})
+    """
+    category = sku_data["Category"]
+    hts_code = sku_data["HTS_Code"]
+    ui_score = sku_data["Ui_Score"]
+    exclusion_log: Dict[str, DecisionRecord] = {}
+
+    # フェーズ1 C. 在庫/スコアフィルタ（全モール除外。理由はチャンネル別には記録されない）
+    if sku_data["Stock"] == 0 or ui_score < rules.system_min_score:
+        return None, [], exclusion_log
+
+    listed_mall = listed_acc = None
+    listing_info = sku_data.get("Listing_Info")
+    if listing_info:
+        listed_mall, listed_acc, _ = listing_info.split("_")
+
+    whitelist = rules.whitelists.get(category)
+    candidates = []
+    for channel in rules.channels:
+        mall, account = rules.channel_parts[channel]
+
+        # フェーズ1 A. アカウント重複禁止
+        if mall == listed_mall and account != listed_acc:
+            exclusion_log[channel] = DecisionRecord(ExclusionReason.ACCOUNT_DUPLICATE, listed_mall=listed_mall, listed_acc=listed_acc)
+            continue
+
+        # フェーズ1 B. モール規約フィルタ
+        category_exclusion, category_inclusion, hts_exclusion = rules.regulations[channel]
+        if category in category_exclusion:
+            exclusion_log[channel] = DecisionRecord(ExclusionReason.CATEGORY_EXCLUDED, category=category, mall=mall)
+            continue
+        if category_inclusion is not None and category not in category_inclusion:
+            exclusion_log[channel] = DecisionRecord(ExclusionReason.CATEGORY_NOT_INCLUDED, category=category, mall=mall)
+            continue
+        if hts_code in hts_exclusion:
+            exclusion_log[channel] = DecisionRecord(ExclusionReason.HTS_EXCLUDED, hts_code=hts_code, mall=mall)
+            continue
+
+        # フェーズ2 D. カテゴリ・モール限定 / E. アカウント専門化 / F. スコア下限
+        if whitelist is not None and channel not in whitelist:
+            exclusion_log[channel] = DecisionRecord(ExclusionReason.NOT_IN_WHITELIST, category=category,
+                                                    whitelist=rules.whitelist_params[category])
+            continue
+        specialized_categories = rules.specializations.get(channel)
+        if specialized_categories is not None and category not in specialized_categories:
+            exclusion_log[channel] = DecisionRecord(ExclusionReason.ACCOUNT_SPECIALIZATION, account=account, category=category)
+            continue
+        min_score = rules.min_scores[channel]
+        if ui_score < min_score:
+            exclusion_log[channel] = DecisionRecord(ExclusionReason.BELOW_MALL_MIN_SCORE, ui_score=ui_score, min_score=min_score)
+            continue
+
+        candidates.append(channel)
+
+    if not candidates:
+        return None, candidates, exclusion_log
+
+    # フェーズ3: U_i,Mall が最大のチャンネル (同点は先勝ち)
+    boosts = rules.boosts
+    winner = max(candidates, key=lambda channel: ui_score * boosts[channel])
+    for channel in candidates:
+        if channel != winner:
+            exclusion_log[channel] = DecisionRecord(ExclusionReason.NOT_SELECTED, winner=winner)
+    return winner, candidates, exclusion_log
+
+
+def build_final_list(channels: Tuple[str, ...], winner: Optional[str],
+                     exclusion_log: Dict[str, DecisionRecord]) -> List[Dict[str, Any]]:
+    """ListingOptimizer._generate_final_list と同じ形式の表示用リストを生成する"""
+    final_list = []
+    for channel in channels:
+        if channel == winner:
+            final_list.append({"Channel": channel, "Status": "🟢 出品決定", "Reason": "最終最適化スコアに基づき決定",
+                               "Reason_Code": None})
+        else:
+            record = exclusion_log.get(channel)
+            final_list.append({"Channel": channel, "Status": "❌ 出品不可",
+                               "Reason": record.message if record else None,
+                               "Reason_Code": record.code.name if record else None})
+    return final_list
+
+
+class BatchListingOptimizer:
+    """
+    カタログ全体 (複数SKU) の出品先を一括で決定するクラス。
+    ルールは CompiledRules として事前変換し、設定 (USER_STRATEGY_SETTINGS) の内容が
+    変わった場合にのみ再変換する。結果はジェネレーターで逐次返す。
+    """
+
+    def __init__(self, settings: Dict[str, Any], channels: List[str] = ALL_CHANNELS,
+                 regulations: Dict[str, Any] = MALL_REGULATIONS):
+        self.settings = settings
+        self.channels = channels
+        self.regulations = regulations
+        self._settings_fingerprint: Optional[str] = None
+        self._rules: Optional[CompiledRules] = None
+
+    @property
+    def rules(self) -> CompiledRules:
+        """現在の設定に対応する CompiledRules (設定が変更されていれば再変換する)"""
+        fingerprint = json.dumps(self.settings, sort_keys=True, ensure_ascii=False)
+        if fingerprint != self._settings_fingerprint:
+            self._rules = CompiledRules(self.settings, self.channels, self.regulations)
+            self._settings_fingerprint = fingerprint
+        return self._rules
+
+    def process_skus(self, sku_master: Dict[str, Any], include_final_list: bool = True,
+                     apply_lock: bool = False) -> Iterator[Tuple[str, Optional[str], Optional[List[Dict[str, Any]]]]]:
+        """
+        SKUごとに (SKU ID, 決定チャンネル or None, 表示用リスト or None) を返すジェネレーター。
+
+        :param include_final_list: False の場合、表示用リストを生成せず、ビットマスク表のみで決定する
+                                   (決定のみが必要な夜間バッチ向け)。
+        :param apply_lock: True の場合、決定チャンネルを各SKUの Listing_Info に書き込む (排他的ロック)。
+        """
+        rules = self.rules
+        for sku_id, sku_data in sku_master.items():
+            if include_final_list:
+                winner, _, exclusion_log = evaluate_sku(sku_data, rules)
+                final_list = build_final_list(rules.channels, winner, exclusion_log)
+            else:
+                winner = rules.pick_winner(rules.eligibility_mask(sku_data), sku_data["Ui_Score"])
+                final_list = None
+            if apply_lock and winner:
+                sku_data["Listing_Info"] = _new_listing_info(winner)
+            yield sku_id, winner, final_list
+
+    def allocate_global(self, sku_master: Dict[str, Any], channel_caps: Optional[Dict[str, int]] = None,
+                        mall_quotas: Optional[Dict[str, int]] = None) -> Dict[str, Optional[str]]:
+        """
+        出品上限・モール別枠を考慮し、カタログ全体の U_i,Mall 合計が最大となる割り当てを返す
+        (GlobalChannelAllocator を参照)。上限を指定しない場合、U_i,Mall が正となるチャンネルを持つ SKU は
+        SKU ごとの最適選択と一致する。正のチャンネルがない SKU (U_i が0以下など) は、SKU ごとの選択では
+        出品先が決まる場合でも None (出品しない) になる。
+        """
+        return GlobalChannelAllocator(self.rules, channel_caps, mall_quotas).allocate(sku_master)
+
+    def decide_vectorized(self, sku_master: Dict[str, Any]) -> Dict[str, Optional[str]]:
+        """
+        カタログ全体の決定チャンネルを NumPy で一括計算する (表示用リストは生成しない)。
+
+        SKU × チャンネルの出品可否をブール行列、U_i をSKUベクトル、M_Mall をチャンネルベクトルとし、
+        U_i,Mall = U_i * M_Mall を出品不可の要素を -inf にした上で行ごとに argmax する
+        (同点は max() と同じくチャンネル順で先のものが選ばれる)。
+        """
+        if np is None:
+            raise ImportError("decide_vectorized には NumPy が必要です (pip install numpy)")
+        rules = self.rules
+        sku_ids = list(sku_master)
+        if not sku_ids:
+            return {}
+        channel_count = len(rules.channels)
+
+        # カテゴリ×HTS、出品済み情報は組み合わせごとのコードに変換し、マスクはコード単位で参照する
+        static_codes: Dict[Tuple[str, str], int] = {}
+        duplicate_codes: Dict[Optional[Tuple[str, str]], int] = {}
+        static_index = np.empty(len(sku_ids), dtype=np.int64)
+        duplicate_index = np.empty(len(sku_ids), dtype=np.int64)
+        ui_scores = np.empty(len(sku_ids), dtype=np.float64)
+        in_stock = np.empty(len(sku_ids), dtype=bool)
+        for row, sku_id in enumerate(sku_ids):
+            sku_data = sku_master[sku_id]
+            static_key = (sku_data["Category"], sku_data["HTS_Code"])
+            static_index[row] = static_codes.setdefault(static_key, len(static_codes))
+            listing_info = sku_data.get("Listing_Info")
+            listing_key = tuple(listing_info.split("_")[:2]) if listing_info else None
+            duplicate_index[row] = duplicate_codes.setdefault(listing_key, len(duplicate_codes))
+            ui_scores[row] = sku_data["Ui_Score"]
+            in_stock[row] = sku_data["Stock"] != 0
+
+        def mask_rows(masks: List[int]):
+            """チャンネルのビットマスク列を (件数 × チャンネル数) のブール行列に展開する"""
+            return np.array([[bool(mask >> i & 1) for i in range(channel_count)] for mask in masks], dtype=bool)
+
+        static_matrix = mask_rows([rules.static_mask(*key) for key in static_codes])
+        duplicate_matrix = mask_rows([
+            rules.listed_account_mask(*key) if key else 0 for key in duplicate_codes
+        ])
+        min_scores = np.array([rules.min_scores[channel] for channel in rules.channels], dtype=np.float64)
+        boosts = np.array([rules.boosts[channel] for channel in rules.channels], dtype=np.float64)
+
+        eligible = static_matrix[static_index] & ~duplicate_matrix[duplicate_index]
+        eligible &= ui_scores[:, None] >= min_scores[None, :]
+        eligible &= (in_stock & (ui_scores >= rules.system_min_score))[:, None]
+
+        scores = np.where(eligible, ui_scores[:, None] * boosts[None, :], -np.inf)
+        best = scores.argmax(axis=1)
+        has_winner = eligible.any(axis=1)
+        channels = rules.channels
+        return {
+            sku_id: channels[index] if winner_exists else None
+            for sku_id, index, winner_exists in zip(sku_ids, best.tolist(), has_winner.tolist())
+        }
+
+
+class GlobalChannelAllocator:
+    """
+    アカウント別の出品上限・モール別枠がある場合に、カタログ全体の U_i,Mall 合計が最大になるよう
+    SKUを出品先へ割り当てる (フェーズ3のグローバル版)。
+
+    SKU → チャンネル → モール → 終点 のネットワークにおける最小費用流を、最短路の逐次追加
+    (Successive Shortest Path) で解く。チャンネル数はSKU数より十分少ないため、最短路探索は
+    チャンネル・モールのノードだけの縮約グラフで行い、SKUの付け替え候補はチャンネル組ごとの
+    ヒープで保持する。U_i,Mall が0以下の割り当ては合計を下げるため行わない。
+    """
+    EPSILON = 1e-9
+
+    def __init__(self, rules: CompiledRules, channel_caps: Optional[Dict[str, int]] = None,
+                 mall_quotas: Optional[Dict[str, int]] = None):
+        """
+        :param channel_caps: {チャンネル: 出品可能件数の上限}。未指定のチャンネルは無制限。
+        :param mall_quotas: {モール名: 出品可能件数の上限}。未指定のモールは無制限。
+        """
+        channel_caps = channel_caps or {}
+        mall_quotas = mall_quotas or {}
+        self.rules = rules
+        self.channels = rules.channels
+        # モールはチャンネル順での初出順に並べる (同点時にチャンネル順の先を優先するため)
+        self.malls = list(dict.fromkeys(mall for mall, _ in rules.channel_parts.values()))
+        mall_index = {mall: i for i, mall in enumerate(self.malls)}
+        self.mall_of = [mall_index[rules.channel_parts[channel][0]] for channel in self.channels]
+        self.caps = [channel_caps.get(channel, float("inf")) for channel in self.channels]
+        self.quotas = [mall_quotas.get(mall, float("inf")) for mall in self.malls]
+
+    def allocate(self, sku_master: Dict[str, Any]) -> Dict[str, Optional[str]]:
+        """{SKU ID: 割り当てチャンネル or None} を返す"""
+        rules = self.rules
+        channel_count, mall_count = len(self.channels), len(self.malls)
+        sku_ids = list(sku_master)
+        # SKUごとの候補 {チャンネル番号: U_i,Mall} (フェーズ1・2を通過し、スコアが正のもの)
+        weights: List[Dict[int, float]] = []
+        for sku_id in sku_ids:
+            sku_data = sku_master[sku_id]
+            mask = rules.eligibility_mask(sku_data)
+            ui_score = sku_data["Ui_Score"]
+            weights.append({
+                c: ui_score * rules.boosts[channel]
+                for c, channel in enumerate(self.channels)
+                if mask >> c & 1 and ui_score * rules.boosts[channel] > 0
+            })
+
+        assigned = [-1] * len(sku_ids)
+        load = [0] * channel_count
+        mall_load = [0] * mall_count
+        # 未割り当てSKUの参入候補: entry_heaps[c] = [(-U, sku)]
+        entry_heaps: List[List[Tuple[float, int]]] = [[] for _ in range(channel_count)]
+        # 割り当て済みSKUの付け替え候補: move_heaps[a][b] = [(U_a - U_b, sku)]
+        move_heaps = [[[] for _ in range(channel_count)] for _ in range(channel_count)]
+        for s, candidates in enumerate(weights):
+            for c, weight in candidates.items():
+                entry_heaps[c].append((-weight, s))
+        for heap in entry_heaps:
+            heapq.heapify(heap)
+
+        def peek(heap, channel):
+            # 状態が変わったSKUのエントリを遅延削除する (channel = -1 は未割り当てを意味する)
+            while heap and assigned[heap[0][1]] != channel:
+                heapq.heappop(heap)
+            return heap[0] if heap else None
+
+        # 縮約グラフのノード番号: 0 = 始点, 1..C = チャンネル, C+1..C+M = モール, C+M+1 = 終点
+        source, sink = 0, channel_count + mall_count + 1
+        node_count = sink + 1
+        while True:
+            edges = []  # (from, to, cost, 付け替えるSKU or None)
+            for c in range(channel_count):
+                top = peek(entry_heaps[c], -1)
+                if top is not None:
+                    edges.append((source, 1 + c, top[0], top[1]))
+                m = 1 + channel_count + self.mall_of[c]
+                if load[c] < self.caps[c]:
+                    edges.append((1 + c, m, 0.0, None))
+                if load[c] > 0:
+                    edges.append((m, 1 + c, 0.0, None))
+                    for b in range(channel_count):
+                        if b != c:
+                            top = peek(move_heaps[c][b], c)
+                            if top is not None:
+                                edges.append((1 + c, 1 + b, top[0], top[1]))
+            for m in range(mall_count):
+                if mall_load[m] < self.quotas[m]:
+                    edges.append((1 + channel_count + m, sink, 0.0, None))
+
+            # Bellman-Ford (負の費用辺を含むが、最短路の逐次追加では負閉路は生じない)
+            dist = [float("inf")] * node_count
+            pred: List[Optional[Tuple[int, Optional[int]]]] = [None] * node_count
+            dist[source] = 0.0
+            for _ in range(node_count - 1):
+                updated = False
+                for u, v, cost, s in edges:
+                    if dist[u] + cost < dist[v] - self.EPSILON:
+                        dist[v] = dist[u] + cost
+                        pred[v] = (u, s)
+                        updated = True
+                if not updated:
+                    break
+            if dist[sink] >= -self.EPSILON:
+                break
+
+            # 最短路に沿ってSKUの割り当て・付け替えを反映する
+            path = []
+            node = sink
+            while node != source:
+                u, s = pred[node]
+                path.append((u, node, s))
+                node = u
+            for u, v, s in reversed(path):
+                if s is None:
+                    continue
+                target = v - 1
+                if u == source:
+                    assigned[s] = target
+                else:
+                    load[u - 1] -= 1
+                    mall_load[self.mall_of[u - 1]] -= 1
+                    assigned[s] = target
+                load[target] += 1
+                mall_load[self.mall_of[target]] += 1
+                weight = weights[s][target]
+                for b, other in weights[s].items():
+                    if b != target:
+                        heapq.heappush(move_heaps[target][b], (weight - other, s))
+
+        return {
+            sku_id: self.channels[c] if c >= 0 else None
+            for sku_id, c in zip(sku_ids, assigned)
+        }
+
+
+class IncrementalListingOptimizer:
+    """
+    設定やSKUの変更時に、影響を受けるSKUだけを再評価して決定の差分を返すクラス。
+
+    依存インデックス:
+    - カテゴリ -> SKU (Category_Whitelist / Account_Specialization の変更)
+    - U_iスコアのソート済み一覧 (System_Min_Ui_Score / Mall_Min_Ui_Score の変更は、新旧の閾値に
+      挟まれたスコアのSKUだけが影響を受ける)
+    - 出品可能チャンネル -> SKU (Mall_Boost_Factor の変更)
+    SKUの Stock / Ui_Score / Listing_Info などの変更は、そのSKUだけを再評価する。
+    """
+    # {チャンネル or カテゴリ: 値} の辞書を値に持つセクション (key=None で丸ごと置き換えた場合は全SKUを再評価する)
+    KEYED_SECTIONS = frozenset({"Category_Whitelist", "Account_Specialization", "Mall_Min_Ui_Score", "Mall_Boost_Factor"})
+
+    def __init__(self, sku_master: Dict[str, Any], settings: Dict[str, Any], channels: List[str] = ALL_CHANNELS,
+                 regulations: Dict[str, Any] = MALL_REGULATIONS):
+        """
+        :param channels: 出品先チャンネル一覧 (BatchListingOptimizer と同じ)。
+        :param regulations: モール規約 (BatchListingOptimizer と同じ)。
+        """
+        self.sku_master = sku_master
+        self.settings = settings
+        self._batch = BatchListingOptimizer(settings, channels, regulations)
+        self.decisions: Dict[str, Optional[str]] = {}
+        self._by_category: Dict[str, set] = {}
+        self._by_eligible_channel: Dict[str, set] = {}
+        self._eligible_mask: Dict[str, int] = {}
+        self._scores: List[Tuple[float, str]] = []
+        # rules は参照のたびに設定を直列化して変更を確認するため、ループの外で1回だけ取得する
+        rules = self._batch.rules
+        for sku_id, sku_data in sku_master.items():
+            self._by_category.setdefault(sku_data["Category"], set()).add(sku_id)
+            self._scores.append((sku_data["Ui_Score"], sku_id))
+            self._evaluate(sku_id, rules)
+        self._scores.sort()
+
+    def _evaluate(self, sku_id: str, rules: CompiledRules) -> Optional[Dict[str, Any]]:
+        """SKUを再評価し、決定が変わった場合は差分を返す"""
+        sku_data = self.sku_master[sku_id]
+        mask = rules.eligibility_mask(sku_data)
+        old_mask = self._eligible_mask.get(sku_id, 0)
+        if mask != old_mask:
+            for channel in rules.channels_in(old_mask & ~mask):
+                self._by_eligible_channel[channel].discard(sku_id)
+            for channel in rules.channels_in(mask & ~old_mask):
+                self._by_eligible_channel.setdefault(channel, set()).add(sku_id)
+            self._eligible_mask[sku_id] = mask
+        winner = rules.pick_winner(mask, sku_data["Ui_Score"])
+        old_winner = self.decisions.get(sku_id)
+        self.decisions[sku_id] = winner
+        if winner != old_winner:
+            return {"SKU_ID": sku_id, "Old_Winner": old_winner, "New_Winner": winner}
+        return None
+
+    def _reevaluate(self, sku_ids) -> List[Dict[str, Any]]:
+        deltas = []
+        rules = self._batch.rules
+        for sku_id in sku_ids:
+            delta = self._evaluate(sku_id, rules)
+            if delta:
+                deltas.append(delta)
+        return deltas
+
+    def _skus_in_score_range(self, low: float, high: float) -> List[str]:
+        """low <= U_i < high のSKU"""
+        start = bisect.bisect_left(self._scores, (low,))
+        end = bisect.bisect_left(self._scores, (high,))
+        return [sku_id for _, sku_id in self._scores[start:end]]
+
+    def _affected_by_setting(self, section: str, key: Optional[str], old_value: Any, new_value: Any) -> set:
+        if key is None and section in self.KEYED_SECTIONS:
+            # セクション全体の置き換えは影響範囲を絞り込めないため、全SKUを対象とする
+            return set(self.sku_master)
+        if section == "System_Min_Ui_Score":
+            low, high = sorted((old_value, new_value))
+            return set(self._skus_in_score_range(low, high))
+        if section == "Mall_Min_Ui_Score":
+            system_min = self.settings["System_Min_Ui_Score"]
+            old_min = system_min if old_value is None else old_value
+            new_min = system_min if new_value is None else new_value
+            low, high = sorted((old_min, new_min))
+            return set(self._skus_in_score_range(low, high))
+        if section == "Category_Whitelist":
+            return set(self._by_category.get(key, ()))
+        if section == "Account_Specialization":
+            # 専門化ルールの新旧で出品可否が変わるカテゴリのSKUのみ
+            affected = set()
+            for category, sku_ids in self._by_category.items():
+                old_allowed = old_value is None or category in old_value
+                new_allowed = new_value is None or category in new_value
+                if old_allowed != new_allowed:
+                    affected |= sku_ids
+            return affected
+        if section == "Mall_Boost_Factor":
+            return set(self._by_eligible_channel.get(key, ()))
+        # 未知の設定は全SKUを対象とする
+        return set(self.sku_master)
+
+    def update_setting(self, section: str, key: Optional[str] = None, value: Any = None) -> List[Dict[str, Any]]:
+        """
+        USER_STRATEGY_SETTINGS の1項目を変更し、影響を受けるSKUの決定差分を返す。
+
+        :param section: 設定のセクション (例: "Mall_Min_Ui_Score")。
+        :param key: セクション内のキー (例: "eBay_ACC-B")。System_Min_Ui_Score のような値そのものは None。
+                    キー付きのセクションで None の場合は、value でセクション全体を置き換えて全SKUを再評価する。
+        :param value: 新しい値。キー付きのセクションで None の場合はその項目を削除する。
+        """
+        if key is None:
+            old_value = self.settings[section]
+            self.settings[section] = value
+        else:
+            old_value = self.settings[section].get(key)
+            if value is None:
+                self.settings[section].pop(key, None)
+            else:
+                self.settings[section][key] = value
+        if old_value == value:
+            return []
+        affected = self._affected_by_setting(section, key, old_value, value)
+        return self._reevaluate(sorted(affected))
+
+    def update_sku(self, sku_id: str, changes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """SKUのフィールド (Stock, Ui_Score, Listing_Info など) を変更し、そのSKUの決定差分を返す"""
+        sku_data = self.sku_master.get(sku_id)
+        if sku_data is None:
+            sku_data = self.sku_master[sku_id] = dict(changes)
+            self._by_category.setdefault(sku_data["Category"], set()).add(sku_id)
+            bisect.insort(self._scores, (sku_data["Ui_Score"], sku_id))
+            return self._reevaluate([sku_id])
+
+        if "Category" in changes and changes["Category"] != sku_data["Category"]:
+            self._by_category[sku_data["Category"]].discard(sku_id)
+            self._by_category.setdefault(changes["Category"], set()).add(sku_id)
+        if "Ui_Score" in changes and changes["Ui_Score"] != sku_data["Ui_Score"]:
+            self._scores.pop(bisect.bisect_left(self._scores, (sku_data["Ui_Score"], sku_id)))
+            bisect.insort(self._scores, (changes["Ui_Score"], sku_id))
+        sku_data.update(changes)
+        return self._reevaluate([sku_id])
+
+
+def run_locked_worker(sku_store: Any, jobs: Dict[str, int], settings: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    並列実行用の最適化ワーカー。jobs は {SKU ID: ジョブ作成時のバージョン}。
+
+    SKUを読み込んだ時点でバージョンがジョブ作成時から進んでいれば、他のワーカー (または別の更新) が
+    既に処理したものとしてスキップする。出品先の Listing_Info は compare-and-set で書き込み、
+    競合した場合も書き込まない。同じジョブを複数のワーカーに配っても、各SKUの出品確定は1回だけになる。
+
+    Returns:
+        {SKU ID: このワーカーが出品を確定したチャンネル or None}
+    """
+    rules = BatchListingOptimizer(settings).rules
+    results: Dict[str, Optional[str]] = {}
+    for sku_id, job_version in jobs.items():
+        results[sku_id] = None
+        sku_data, version = sku_store.get(sku_id)
+        if version != job_version:
+            continue
+        winner, _, _ = evaluate_sku(sku_data, rules)
+        if winner and sku_store.compare_and_set(sku_id, version, {"Listing_Info": _new_listing_info(winner)}):
+            results[sku_id] = winner
+    return results
+
+
 # --- シミュレーション実行 ---
 
 def run_simulation(sku_id: str):
@@ -321,18 +1169,81 @@ def run_simulation(sku_id: str):
              print(f"{entry['Status']:<10} {entry['Channel']:<20} 理由: {entry['Reason']}")
 
 
-# SKU1001: フィギュア（ホワイトリスト適用）
-run_simulation("SKU1001") 
+if __name__ == "__main__":
+    # SKU1001: フィギュア（ホワイトリスト適用）
+    run_simulation("SKU1001") 
+
+    print("\n" + "=" * 80 + "\n")
+
+    # SKU1003: スコア低、全モール排除（-50000点）
+    run_simulation("SKU1003")
+
+    print("\n" + "=" * 80 + "\n")
 
-print("\n" + "=" * 80 + "\n")
+    # SKU1004: 時計、既にeBayで出品済み
+    run_simulation("SKU1004")
 
-# SKU1003: スコア低、全モール排除（-50000点）
-run_simulation("SKU1003")
+    # SKU1002: アパレル（在庫ゼロで全モール除外）
+    # run_simulation("SKU1002")
+
+    print("\n" + "=" * 80 + "\n")
+
+    # ベクトル化パスが既存フィクスチャで単一SKU処理と同じ決定を返すことを確認
+    if np is not None:
+        fixture_winners = {
+            sku_id: ListingOptimizer(sku_data.copy(), USER_STRATEGY_SETTINGS, verbose=False).process_sku()[0]
+            for sku_id, sku_data in SKU_MASTER.items()
+        }
+        vectorized_fixture_winners = BatchListingOptimizer(USER_STRATEGY_SETTINGS).decide_vectorized(SKU_MASTER)
+        print(f"[検証] SKU_MASTER のベクトル化決定: {vectorized_fixture_winners} "
+              f"(単一SKU処理と一致: {vectorized_fixture_winners == fixture_winners})")
+
+    # 以降のデモ用: SKU_MASTER を複製し、在庫・スコア・出品済み情報を変えたカタログ
+    # (処理パス別のスループット比較は listing_optimizer_benchmark.py を参照)
+    demo_rng = random.Random(0)
+    demo_catalogue = {
+        f"SKU{i:07d}": {
+            **template,
+            "Item_ID": f"ITM{i:07d}",
+            "Stock": demo_rng.choice([0, 1, 2, 5, 10]),
+            "Ui_Score": demo_rng.randint(-20000, 80000),
+            "Listing_Info": demo_rng.choice([None, None, None, "eBay_ACC-B_EID789", "Amazon_ACC-A_EID123"]),
+        }
+        for i, template in enumerate(demo_rng.choices(list(SKU_MASTER.values()), k=10000))
+    }
 
-print("\n" + "=" * 80 + "\n")
+    # 並列ワーカー: 同じSKU群を4ワーカーが同時に処理しても、各SKUの出品確定は1回だけ
+    sku_store = VersionedSkuStore({sku_id: demo_catalogue[sku_id] for sku_id in list(demo_catalogue)[:2000]})
+    shared_jobs = sku_store.versions()
+    worker_results: List[Dict[str, Optional[str]]] = []
+    workers = [
+        threading.Thread(target=lambda: worker_results.append(run_locked_worker(sku_store, shared_jobs, USER_STRATEGY_SETTINGS)))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    listing_counts = [sum(1 for result in worker_results if result[sku_id]) for sku_id in shared_jobs]
+    print(f"[並列ワーカー] 4ワーカー × {len(shared_jobs)} SKU: 最大出品確定回数/SKU = {max(listing_counts)}")
 
-# SKU1004: 時計、既にeBayで出品済み
-run_simulation("SKU1004")
+    # 変更駆動の再最適化: 設定・SKUの変更で影響を受けるSKUだけを再評価
+    incremental = IncrementalListingOptimizer({sku_id: dict(sku_data) for sku_id, sku_data in demo_catalogue.items()},
+                                              json.loads(json.dumps(USER_STRATEGY_SETTINGS)))
+    deltas = incremental.update_setting("Mall_Min_Ui_Score", "Amazon_ACC-A", 40000)
+    print(f"[差分再最適化] Amazon_ACC-A のスコア下限を40000に変更: 決定が変わったSKU {len(deltas)} 件")
+    deltas = incremental.update_sku("SKU0000001", {"Stock": 0})
+    print(f"[差分再最適化] SKU0000001 の在庫をゼロに変更: {deltas}")
 
-# SKU1002: アパレル（在庫ゼロで全モール除外）
-# run_simulation("SKU1002")
+    # 出品上限・モール別枠がある場合のグローバル割り当て
+    catalogue = demo_catalogue
+    channel_caps = {"Amazon_ACC-A": 500, "Chrono24_ACC-R": 200, "MercadoLibre_ACC-L": 300}
+    mall_quotas = {"eBay": 700}
+    start = time.perf_counter()
+    allocation = BatchListingOptimizer(USER_STRATEGY_SETTINGS).allocate_global(catalogue, channel_caps, mall_quotas)
+    elapsed = time.perf_counter() - start
+    allocated = [(sku_id, channel) for sku_id, channel in allocation.items() if channel]
+    total_score = sum(catalogue[sku_id]["Ui_Score"] * USER_STRATEGY_SETTINGS["Mall_Boost_Factor"].get(channel, 1.0)
+                      for sku_id, channel in allocated)
+    print(f"[グローバル割り当て] {len(catalogue)} SKU中 {len(allocated)} SKUを割り当て "
+          f"(U_i,Mall 合計 {total_score:,.0f}, 処理時間 {elapsed:.2f}秒)")
@@ -1,6 +1,26 @@
 import time
 import random
-from datetime import datetime, timedelta
+import bisect
+import heapq
+import itertools
+import json
+import base64
+import threading
+import os
+import pickle
+import math
+import re
+import unicodedata
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from collections import OrderedDict
+from datetime import datetime, timedelta, date
+
+try:
+    import numpy as np
+except ImportError:  # 列指向バックエンド (ColumnarFirestoreSimulator) 使用時のみ必須
+    np = None
 # Firestore/Firebase Admin SDKの代わりに、動作シミュレーション用のモジュールをインポートします。
 # 実際の環境では、firebase_adminライブラリやFirestore SDKを使用します。
 
@@ -15,20 +35,291 @@ APP_ID = 'default-app-id' # typeof __app_id !== 'undefined' ? __app_id : 'defaul
 # Firestoreのコレクションパス定義 (指示書に基づきパブリックデータとして定義)
 RESEARCH_REPO_PATH = f'artifacts/{APP_ID}/public/data/research_repository'
 
+# セカンダリインデックスを張る等価フィルタ対象フィールド
+INDEXED_EQUALITY_FIELDS = ('dataSource', 'veroRisk', 'status')
+
+# スナップショット形式のバージョン (形式を変更した場合は上げる)
+SNAPSHOT_VERSION = 1
+
+def _parse_date_ordinals(docs):
+    """researchDate を日付序数に変換する (同じ日付文字列の解析は1回だけ)"""
+    parsed = {}
+    ordinals = []
+    for doc in docs:
+        date_str = doc['researchDate']
+        ordinal = parsed.get(date_str)
+        if ordinal is None:
+            ordinal = parsed[date_str] = date.fromisoformat(date_str).toordinal()
+        ordinals.append(ordinal)
+    return ordinals
+
+def _write_atomically(path, write):
+    """一時ファイルに書き出してから置き換え、書き込み途中のファイルが残らないようにする"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _normalize_filters(filters):
+    """フィルタ条件を (期間開始の日付序数, dataSource, veroRisk, status) のタプルに正規化する"""
+    period = filters.get('period')
+    start_ordinal = _period_start_ordinal(period) if period and period != 'all' else None
+    return (start_ordinal,) + tuple(filters.get(field) or None for field in INDEXED_EQUALITY_FIELDS)
+
+def _document_matches(key, doc, date_ordinal=None):
+    """
+    ドキュメントが正規化済みフィルタ条件 (_normalize_filters の戻り値) に一致するか判定する。
+    date_ordinal に解析済みの researchDate の日付序数を渡すと、日付の再解析を省略する。
+    """
+    start_ordinal, *values = key
+    if start_ordinal is not None:
+        if date_ordinal is None:
+            date_ordinal = date.fromisoformat(doc['researchDate']).toordinal()
+        if date_ordinal < start_ordinal:
+            return False
+    return all(value is None or doc.get(field) == value for field, value in zip(INDEXED_EQUALITY_FIELDS, values))
+
+# ページングで指定できる並び順: {名前: (並び替えフィールド, 降順か)}
+# 同値の場合は id で順序を確定させる (キーセットページング: (値, id) の組がカーソル)
+SORT_OPTIONS = {
+    'researchDate_desc': ('researchDate', True),
+    'researchDate_asc': ('researchDate', False),
+    'marketVolume_desc': ('marketVolume', True),
+    'marketVolume_asc': ('marketVolume', False),
+}
+# カーソルに含まれる並び替え値の型 (デコード時の検証用)
+SORT_VALUE_TYPES = {
+    'researchDate': (str,),
+    'marketVolume': (int, float),
+}
+
+# 一覧表示用の要約フィールド (claudeHTSLog / geminiSupplier などの長文フィールドを除く)
+SUMMARY_FIELDS = ('id', 'rawTitle', 'researchDate', 'dataSource', 'veroRisk', 'status', 'marketVolume', 'htsCode')
+
+def _period_start_ordinal(period):
+    """
+    期間フィルタ ('30d' 等) を、結果に含める最初の researchDate の日付序数に変換する。
+    researchDate (その日の0時) >= 現在時刻 - N日 となる最初の日付。
+    """
+    date_limit = datetime.now() - timedelta(days=int(period.replace('d', '')))
+    start = date_limit.toordinal()
+    if date_limit.time() != datetime.min.time():
+        start += 1
+    return start
+
 class FirestoreSimulator:
     """
     FirestoreへのCRUD操作とクエリをシミュレートするクラス。
     実際にはFirebase Admin SDKを使用して接続します。
+
+    Firestoreの複合インデックスに相当するセカンダリインデックスを保持し、
+    クエリ時に全件走査を行わずに済むようにしています。
+    - ハッシュインデックス: dataSource / veroRisk / status の値 -> ドキュメントIDの集合
+    - ソート済みインデックス: researchDate (日付単位のバケット + ソート済み日付一覧)
+    researchDate は登録時に一度だけ日付序数 (date.toordinal()) に変換して保持し、
+    クエリ時には文字列の日付解析を行いません。
     """
     def __init__(self):
         # データベースのインメモリ表現
         self.repository = {}
+        # {field: {value: set(doc_id)}}
+        self._hash_indexes = {field: {} for field in INDEXED_EQUALITY_FIELDS}
+        # 登録時に解析済みの researchDate 列 {doc_id: 日付序数}
+        self._date_ordinals = {}
+        # {日付序数: set(doc_id)} と、重複のないソート済み日付序数の一覧
+        self._date_buckets = {}
+        self._sorted_dates = []
+        # 結果をリポジトリへの登録順で返すための通し番号 {doc_id: seq}
+        self._insertion_order = {}
+        self._next_seq = 0
+        # 書き込み通知先 (クエリ結果キャッシュの無効化などに使用) fn(旧ドキュメント or None, 新ドキュメント or None)
+        self._write_listeners = []
+        # 書き込みとクエリ対象IDのスナップショット取得を直列化するロック
+        self._lock = threading.RLock()
         print(f"[{datetime.now().strftime('%H:%M:%S')}] FirestoreSimulator初期化完了 (コレクション: {RESEARCH_REPO_PATH})")
         
+    def add_write_listener(self, listener):
+        """
+        ドキュメント書き込み時に listener(旧ドキュメント, 新ドキュメント) を呼び出すよう登録する。
+        新規追加では旧ドキュメントが、削除では新ドキュメントが None になる。
+        """
+        self._write_listeners.append(listener)
+
     def add_document(self, doc_id, data):
-        """ドキュメントを追加 (DBシード用)"""
-        self.repository[doc_id] = data
-        
+        """ドキュメントを追加 (DBシード用)。既存IDの場合は上書きし、インデックスも更新する"""
+        with self._lock:
+            old_data = self.repository.get(doc_id)
+            if old_data is not None:
+                self._unindex_document(doc_id, old_data)
+            else:
+                self._insertion_order[doc_id] = self._next_seq
+                self._next_seq += 1
+            self.repository[doc_id] = data
+            self._index_document(doc_id, data)
+            for listener in self._write_listeners:
+                listener(old_data, data)
+
+    def add_documents(self, documents):
+        """
+        ドキュメントをまとめて追加する (一括シード・スナップショット復元用)。
+        documents は {'id': ...} を含むドキュメントのリスト。新規IDはインデックスへ一括登録し、
+        ソート済み日付一覧の再構築も1回で済ませる。既存IDは add_document と同じく上書きする。
+        """
+        with self._lock:
+            # バッチ内で同じIDが重複した場合は、位置は最初の出現・内容は最後の出現を採用する
+            # (add_document を順に呼んだ場合と同じ結果)
+            new_docs_by_id = {}
+            for data in documents:
+                if data['id'] in self.repository:
+                    self.add_document(data['id'], data)
+                else:
+                    new_docs_by_id[data['id']] = data
+            new_docs = list(new_docs_by_id.values())
+
+            new_dates = set()
+            for data, date_key in zip(new_docs, _parse_date_ordinals(new_docs)):
+                doc_id = data['id']
+                self.repository[doc_id] = data
+                self._insertion_order[doc_id] = self._next_seq
+                self._next_seq += 1
+                for field, index in self._hash_indexes.items():
+                    index.setdefault(data.get(field), set()).add(doc_id)
+                self._date_ordinals[doc_id] = date_key
+                bucket = self._date_buckets.get(date_key)
+                if bucket is None:
+                    bucket = self._date_buckets[date_key] = set()
+                    new_dates.add(date_key)
+                bucket.add(doc_id)
+            if new_dates:
+                self._sorted_dates = sorted(self._sorted_dates + list(new_dates))
+            for data in new_docs:
+                for listener in self._write_listeners:
+                    listener(None, data)
+
+    def save_snapshot(self, path):
+        """リポジトリとインデックスをバイナリスナップショット (pickle) として保存する"""
+        state = {
+            'version': SNAPSHOT_VERSION,
+            'repository': self.repository,
+            'hash_indexes': self._hash_indexes,
+            'date_ordinals': self._date_ordinals,
+            'date_buckets': self._date_buckets,
+            'sorted_dates': self._sorted_dates,
+            'insertion_order': self._insertion_order,
+            'next_seq': self._next_seq,
+        }
+        _write_atomically(path, lambda f: pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL))
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] スナップショット保存完了: {path} ({len(self.repository)}件)")
+
+    @classmethod
+    def load_snapshot(cls, path):
+        """save_snapshot で保存したスナップショットから、インデックスを再構築せずに復元する"""
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"スナップショットのバージョンが一致しません: {state.get('version')} (期待値: {SNAPSHOT_VERSION})")
+        simulator = cls()
+        simulator.repository = state['repository']
+        simulator._hash_indexes = state['hash_indexes']
+        simulator._date_ordinals = state['date_ordinals']
+        simulator._date_buckets = state['date_buckets']
+        simulator._sorted_dates = state['sorted_dates']
+        simulator._insertion_order = state['insertion_order']
+        simulator._next_seq = state['next_seq']
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] スナップショット復元完了: {path} ({len(simulator.repository)}件)")
+        return simulator
+
+    def delete_document(self, doc_id):
+        """ドキュメントを削除し、インデックスからも取り除く。存在しない場合は False を返す"""
+        with self._lock:
+            old_data = self.repository.pop(doc_id, None)
+            if old_data is None:
+                return False
+            self._unindex_document(doc_id, old_data)
+            del self._insertion_order[doc_id]
+            for listener in self._write_listeners:
+                listener(old_data, None)
+            return True
+
+    def _index_document(self, doc_id, data):
+        """ドキュメントをセカンダリインデックスに登録する"""
+        for field, index in self._hash_indexes.items():
+            index.setdefault(data.get(field), set()).add(doc_id)
+        date_key = date.fromisoformat(data['researchDate']).toordinal()
+        self._date_ordinals[doc_id] = date_key
+        bucket = self._date_buckets.get(date_key)
+        if bucket is None:
+            bucket = self._date_buckets[date_key] = set()
+            bisect.insort(self._sorted_dates, date_key)
+        bucket.add(doc_id)
+
+    def _unindex_document(self, doc_id, data):
+        """ドキュメントをセカンダリインデックスから取り除く"""
+        for field, index in self._hash_indexes.items():
+            ids = index.get(data.get(field))
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del index[data.get(field)]
+        date_key = self._date_ordinals.pop(doc_id)
+        bucket = self._date_buckets.get(date_key)
+        if bucket is not None:
+            bucket.discard(doc_id)
+            if not bucket:
+                del self._date_buckets[date_key]
+                del self._sorted_dates[bisect.bisect_left(self._sorted_dates, date_key)]
+
+    def _date_range_ids(self, start_ordinal):
+        """start_ordinal 以降の researchDate を持つドキュメントIDのバケット一覧を返す (二分探索)"""
+        first = bisect.bisect_left(self._sorted_dates, start_ordinal)
+        return [self._date_buckets[date_key] for date_key in self._sorted_dates[first:]]
+
+    def _plan_query(self, filters):
+        """
+        フィルタ条件ごとの候補ID集合を、件数の少ない (選択性の高い) 順に並べて返す。
+        期間フィルタは日付バケットの和集合として扱う。
+        """
+        candidates = []
+        for field in INDEXED_EQUALITY_FIELDS:
+            if filters.get(field):
+                candidates.append(self._hash_indexes[field].get(filters[field], set()))
+        if filters.get('period') and filters['period'] != 'all':
+            buckets = self._date_range_ids(_period_start_ordinal(filters['period']))
+            if len(buckets) == 1:
+                candidates.append(buckets[0])
+            else:
+                candidates.append(set().union(*buckets))
+        return sorted(candidates, key=len)
+
+    def iter_documents(self, filters):
+        """
+        最も選択性の高いインデックスを起点に、他のインデックスのID集合と積集合を取り、
+        登録順にドキュメントを1件ずつ返すジェネレーター。
+        (ドキュメント本体のリストは作らないため、大量件数のストリーミング返却に使う)
+        対象IDの一覧はロック下で確定させ、返却中に削除されたドキュメントは読み飛ばす。
+        """
+        with self._lock:
+            plan = self._plan_query(filters)
+            if not plan:
+                # フィルタなし: 全件を登録順に返す
+                doc_ids = list(self.repository)
+            else:
+                matched_ids = plan[0]
+                for ids in plan[1:]:
+                    if not matched_ids:
+                        break
+                    matched_ids = matched_ids & ids
+                doc_ids = sorted(matched_ids, key=self._insertion_order.__getitem__)
+        repository = self.repository
+        for doc_id in doc_ids:
+            doc = repository.get(doc_id)
+            if doc is not None:
+                yield doc
+
+    def _matching_documents(self, filters):
+        """iter_documents の結果をリストとして返す"""
+        return list(self.iter_documents(filters))
+
     def query_documents(self, filters):
         """
         高性能なクエリとフィルタリング処理をシミュレートする (Supabase RPC相当)。
@@ -36,25 +327,7 @@ class FirestoreSimulator:
         """
         start_time = time.time()
         
-        # 全データ取得 (実際はFirestoreクエリでフィルタリングしながら取得)
-        results = list(self.repository.values())
-        
-        # 1. 期間フィルタリング
-        if filters.get('period') and filters['period'] != 'all':
-            days = int(filters['period'].replace('d', ''))
-            date_limit = datetime.now() - timedelta(days=days)
-            results = [
-                doc for doc in results 
-                if datetime.strptime(doc['researchDate'], '%Y-%m-%d') >= date_limit
-            ]
-
-        # 2. その他のフィルタリング
-        if filters.get('dataSource'):
-            results = [doc for doc in results if doc['dataSource'] == filters['dataSource']]
-        if filters.get('veroRisk'):
-            results = [doc for doc in results if doc['veroRisk'] == filters['veroRisk']]
-        if filters.get('status'):
-            results = [doc for doc in results if doc['status'] == filters['status']]
+        results = self._matching_documents(filters)
 
         end_time = time.time()
         query_time = (end_time - start_time) * 1000 # ミリ秒単位
@@ -63,6 +336,688 @@ class FirestoreSimulator:
         
         return results
 
+    def aggregate_market_volume(self, filters, group_by=('dataSource', 'veroRisk')):
+        """フィルタ後のドキュメントを group_by の組み合わせごとに集計する (件数と平均 marketVolume)"""
+        groups = {}
+        for doc in self._matching_documents(filters):
+            totals = groups.setdefault(tuple(doc.get(field) for field in group_by), [0, 0])
+            totals[0] += 1
+            totals[1] += doc['marketVolume']
+        return _format_aggregate_rows(group_by, groups)
+
+    def query_page(self, filters, sort, after_key, page_size):
+        """
+        キーセットページング用に、カーソル (値, id) より後ろの page_size + 1 件を返す。
+        researchDate 順の場合は日付インデックスを端から辿り、必要なバケットだけを読む。
+        """
+        field, descending = SORT_OPTIONS[sort]
+        if field != 'researchDate':
+            return _keyset_page(self._matching_documents(filters), sort, after_key, page_size)
+
+        # 期間以外のフィルタは候補ID集合として、日付バケットとの積集合に使う
+        equality_sets = self._plan_query({key: value for key, value in filters.items() if key != 'period'})
+        first = 0
+        if filters.get('period') and filters['period'] != 'all':
+            first = bisect.bisect_left(self._sorted_dates, _period_start_ordinal(filters['period']))
+        last = len(self._sorted_dates)
+        if after_key is not None:
+            cursor_ordinal = date.fromisoformat(after_key[0]).toordinal()
+            if descending:
+                last = min(last, bisect.bisect_right(self._sorted_dates, cursor_ordinal))
+            else:
+                first = max(first, bisect.bisect_left(self._sorted_dates, cursor_ordinal))
+        ordinals = self._sorted_dates[first:last]
+        if descending:
+            ordinals = reversed(ordinals)
+
+        page = []
+        for ordinal in ordinals:
+            ids = self._date_buckets[ordinal]
+            for other in equality_sets:
+                ids = ids & other
+            docs = sorted((self.repository[doc_id] for doc_id in ids), key=lambda doc: doc['id'], reverse=descending)
+            if after_key is not None and ordinal == cursor_ordinal:
+                if descending:
+                    docs = [doc for doc in docs if (doc['researchDate'], doc['id']) < after_key]
+                else:
+                    docs = [doc for doc in docs if (doc['researchDate'], doc['id']) > after_key]
+            page.extend(docs[:page_size + 1 - len(page)])
+            if len(page) > page_size:
+                break
+        return page
+
+
+def _group_value_sort_key(value):
+    """
+    グループ値の並び順キー。数値 -> 文字列など (文字列表現の順) -> None の順に並べ、
+    型の異なる値が混在しても比較できるようにする。
+    """
+    if value is None:
+        return (2, 0, '')
+    if isinstance(value, (int, float)):
+        return (0, value, '')
+    return (1, 0, str(value))
+
+def _format_aggregate_rows(group_by, groups):
+    """{グループキー: (件数, marketVolume合計)} をフロントエンド向けの行リストに変換する"""
+    rows = []
+    # group_by フィールドを持たないドキュメントは None のグループになるため、None を最後に並べる
+    for key in sorted(groups, key=lambda key: tuple(_group_value_sort_key(value) for value in key)):
+        # NumPy のスカラー型が混ざっても同じ丸め結果になるよう、Pythonの数値に揃えてから計算する
+        count, volume_sum = int(groups[key][0]), float(groups[key][1])
+        row = dict(zip(group_by, key))
+        row['count'] = count
+        row['avgMarketVolume'] = round(volume_sum / count, 2)
+        rows.append(row)
+    return rows
+
+
+def _keyset_page(documents, sort, after_key, page_size):
+    """
+    ドキュメント列から、カーソル (値, id) より後ろの page_size + 1 件を並び順どおりに取り出す。
+    全件ソートせず、ヒープで上位のみを選ぶ。
+    """
+    field, descending = SORT_OPTIONS[sort]
+    sort_key = lambda doc: (doc[field], doc['id'])
+    if after_key is not None:
+        if descending:
+            documents = (doc for doc in documents if sort_key(doc) < after_key)
+        else:
+            documents = (doc for doc in documents if sort_key(doc) > after_key)
+    select = heapq.nlargest if descending else heapq.nsmallest
+    return select(page_size + 1, documents, key=sort_key)
+
+
+class ColumnarFirestoreSimulator:
+    """
+    FirestoreSimulator と同じインターフェースを持つ、分析用の列指向バックエンド。
+
+    ドキュメントを列ごとに NumPy 配列で保持し (marketVolume, researchDateの日付序数,
+    dataSource / veroRisk / status / htsCode は辞書符号化した整数コード)、
+    フィルタはブールマスク演算、集計は np.bincount で評価します。
+    """
+    CATEGORICAL_FIELDS = ('dataSource', 'veroRisk', 'status', 'htsCode')
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("ColumnarFirestoreSimulator には NumPy が必要です (pip install numpy)")
+        # 結果返却用のドキュメント本体 (FirestoreSimulator と同じ形)。repository / _row_docs プロパティで参照する
+        self._repository = {}
+        self._row_of = {}  # {doc_id: 行番号}
+        self._row_doc_list = []  # 行番号 -> ドキュメント
+        # スナップショットから復元した直後は、ドキュメント本体を最初に参照した時点で読み込む
+        self._pending_documents_path = None
+        self._size = 0
+        capacity = self.INITIAL_CAPACITY
+        self._market_volume = np.zeros(capacity, dtype=np.int64)
+        self._date_ordinal = np.zeros(capacity, dtype=np.int32)
+        # 削除済みの行は詰めずに無効化する (行順 = 登録順を保つため)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._deleted_rows = 0
+        self._codes = {field: np.zeros(capacity, dtype=np.int32) for field in self.CATEGORICAL_FIELDS}
+        # 辞書符号化: {field: {値: コード}} と {field: [コード -> 値]}
+        self._dictionaries = {field: {} for field in self.CATEGORICAL_FIELDS}
+        self._dictionary_values = {field: [] for field in self.CATEGORICAL_FIELDS}
+        self._write_listeners = []
+        self._lock = threading.RLock()
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] ColumnarFirestoreSimulator初期化完了 (コレクション: {RESEARCH_REPO_PATH})")
+
+    @property
+    def repository(self):
+        """{doc_id: ドキュメント} (未読み込みのスナップショットがあればここで読み込む)"""
+        if self._pending_documents_path is not None:
+            self._load_pending_documents()
+        return self._repository
+
+    @property
+    def _row_docs(self):
+        if self._pending_documents_path is not None:
+            self._load_pending_documents()
+        return self._row_doc_list
+
+    def _load_pending_documents(self):
+        """save_snapshot で別ファイルに保存したドキュメント本体を読み込む"""
+        with self._lock:
+            path = self._pending_documents_path
+            if path is None:
+                return
+            with open(path, 'rb') as f:
+                row_docs = pickle.load(f)
+            self._row_doc_list = row_docs
+            self._repository = {data['id']: data for data in row_docs if data is not None}
+            self._pending_documents_path = None
+
+    def _ensure_capacity(self, required):
+        """列配列の容量が不足していれば倍々で拡張する"""
+        capacity = len(self._market_volume)
+        if required <= capacity:
+            return
+        while capacity < required:
+            capacity = max(capacity * 2, self.INITIAL_CAPACITY)
+
+        def grow(column):
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            return grown
+
+        self._market_volume = grow(self._market_volume)
+        self._date_ordinal = grow(self._date_ordinal)
+        self._alive = grow(self._alive)
+        self._codes = {field: grow(column) for field, column in self._codes.items()}
+
+    def _encode(self, field, value):
+        """カテゴリ値を整数コードに変換する (未登録の値は新しいコードを割り当てる)"""
+        dictionary = self._dictionaries[field]
+        code = dictionary.get(value)
+        if code is None:
+            code = dictionary[value] = len(self._dictionary_values[field])
+            self._dictionary_values[field].append(value)
+        return code
+
+    def add_write_listener(self, listener):
+        """
+        ドキュメント書き込み時に listener(旧ドキュメント, 新ドキュメント) を呼び出すよう登録する。
+        新規追加では旧ドキュメントが、削除では新ドキュメントが None になる。
+        """
+        self._write_listeners.append(listener)
+
+    def add_document(self, doc_id, data):
+        """ドキュメントを追加 (既存IDの場合は同じ行を上書きする)"""
+        with self._lock:
+            old_data = self.repository.get(doc_id)
+            row = self._row_of.get(doc_id)
+            if row is None:
+                self._ensure_capacity(self._size + 1)
+                row = self._row_of[doc_id] = self._size
+                self._row_docs.append(data)
+                self._size += 1
+            else:
+                self._row_docs[row] = data
+            self.repository[doc_id] = data
+            self._alive[row] = True
+            self._market_volume[row] = data['marketVolume']
+            self._date_ordinal[row] = date.fromisoformat(data['researchDate']).toordinal()
+            for field in self.CATEGORICAL_FIELDS:
+                self._codes[field][row] = self._encode(field, data.get(field))
+            for listener in self._write_listeners:
+                listener(old_data, data)
+
+    def add_documents(self, documents):
+        """
+        ドキュメントをまとめて追加する (一括シード・スナップショット復元用)。
+        新規IDは列配列へスライス単位で一括代入し、既存IDは add_document と同じく上書きする。
+        """
+        with self._lock:
+            # バッチ内で同じIDが重複した場合は、位置は最初の出現・内容は最後の出現を採用する
+            # (add_document を順に呼んだ場合と同じ結果)
+            new_docs_by_id = {}
+            for data in documents:
+                if data['id'] in self._row_of:
+                    self.add_document(data['id'], data)
+                else:
+                    new_docs_by_id[data['id']] = data
+            new_docs = list(new_docs_by_id.values())
+            if not new_docs:
+                return
+
+            start, end = self._size, self._size + len(new_docs)
+            self._ensure_capacity(end)
+            for row, data in enumerate(new_docs, start):
+                self._row_of[data['id']] = row
+                self.repository[data['id']] = data
+            self._row_docs.extend(new_docs)
+            self._size = end
+            self._alive[start:end] = True
+            self._market_volume[start:end] = [data['marketVolume'] for data in new_docs]
+            self._date_ordinal[start:end] = _parse_date_ordinals(new_docs)
+            for field in self.CATEGORICAL_FIELDS:
+                self._codes[field][start:end] = [self._encode(field, data.get(field)) for data in new_docs]
+            for data in new_docs:
+                for listener in self._write_listeners:
+                    listener(None, data)
+
+    def save_snapshot(self, directory):
+        """
+        列配列を .npy ファイル、辞書と行ごとのIDを meta.pickle、ドキュメント本体を documents.pickle として
+        ディレクトリに保存する。列ファイルは load_snapshot 時にメモリマップで読み込める。
+        """
+        os.makedirs(directory, exist_ok=True)
+        size = self._size
+        columns = {'market_volume': self._market_volume, 'date_ordinal': self._date_ordinal, 'alive': self._alive}
+        columns.update({f'codes_{field}': column for field, column in self._codes.items()})
+        for name, column in columns.items():
+            _write_atomically(os.path.join(directory, f'{name}.npy'), lambda f: np.save(f, column[:size]))
+        row_docs = self._row_docs
+        meta = {
+            'version': SNAPSHOT_VERSION,
+            'size': size,
+            'deleted_rows': self._deleted_rows,
+            'row_ids': [data['id'] if data is not None else None for data in row_docs],
+            'dictionary_values': self._dictionary_values,
+        }
+        _write_atomically(os.path.join(directory, 'documents.pickle'), lambda f: pickle.dump(row_docs, f, protocol=pickle.HIGHEST_PROTOCOL))
+        _write_atomically(os.path.join(directory, 'meta.pickle'), lambda f: pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL))
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] スナップショット保存完了 (列指向): {directory} ({len(self.repository)}件)")
+
+    @classmethod
+    def load_snapshot(cls, directory, mmap=True):
+        """
+        save_snapshot で保存したディレクトリから復元する。
+        mmap=True の場合、列配列はコピーオンライトのメモリマップとして開き、全体を読み込まずに起動する。
+        ドキュメント本体 (documents.pickle) は、結果の返却などで最初に参照した時点で読み込むため、
+        集計 (aggregate_market_volume) やフィルタ件数の計算だけなら列ファイルと行IDだけで済む。
+        """
+        with open(os.path.join(directory, 'meta.pickle'), 'rb') as f:
+            meta = pickle.load(f)
+        if meta.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"スナップショットのバージョンが一致しません: {meta.get('version')} (期待値: {SNAPSHOT_VERSION})")
+
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='c' if mmap else None)
+
+        simulator = cls()
+        simulator._size = meta['size']
+        simulator._deleted_rows = meta['deleted_rows']
+        simulator._dictionary_values = meta['dictionary_values']
+        simulator._dictionaries = {
+            field: {value: code for code, value in enumerate(values)}
+            for field, values in simulator._dictionary_values.items()
+        }
+        simulator._market_volume = load('market_volume')
+        simulator._date_ordinal = load('date_ordinal')
+        simulator._alive = load('alive')
+        simulator._codes = {field: load(f'codes_{field}') for field in cls.CATEGORICAL_FIELDS}
+        simulator._row_of = {doc_id: row for row, doc_id in enumerate(meta['row_ids']) if doc_id is not None}
+        simulator._pending_documents_path = os.path.join(directory, 'documents.pickle')
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] スナップショット復元完了 (列指向): {directory} ({len(simulator._row_of)}件)")
+        return simulator
+
+    def delete_document(self, doc_id):
+        """ドキュメントを削除する (行は無効化のみ)。存在しない場合は False を返す"""
+        with self._lock:
+            row = self._row_of.pop(doc_id, None)
+            if row is None:
+                return False
+            old_data = self.repository.pop(doc_id)
+            self._alive[row] = False
+            self._row_docs[row] = None
+            self._deleted_rows += 1
+            for listener in self._write_listeners:
+                listener(old_data, None)
+            return True
+
+    def _filter_mask(self, filters):
+        """フィルタ条件をブールマスクとして評価する (フィルタなしの場合は None)"""
+        mask = None
+        size = self._size
+        for field in INDEXED_EQUALITY_FIELDS:
+            if filters.get(field):
+                code = self._dictionaries[field].get(filters[field])
+                if code is None:
+                    return np.zeros(size, dtype=bool)
+                condition = self._codes[field][:size] == code
+                mask = condition if mask is None else mask & condition
+        if filters.get('period') and filters['period'] != 'all':
+            condition = self._date_ordinal[:size] >= _period_start_ordinal(filters['period'])
+            mask = condition if mask is None else mask & condition
+        return mask
+
+    def _matching_rows(self, filters):
+        mask = self._filter_mask(filters)
+        if self._deleted_rows:
+            alive = self._alive[:self._size]
+            mask = alive if mask is None else mask & alive
+        if mask is None:
+            return np.arange(self._size)
+        return np.flatnonzero(mask)
+
+    def iter_documents(self, filters):
+        """
+        フィルタに一致するドキュメントを行順に1件ずつ返すジェネレーター。
+        対象行はロック下で確定させ、返却中に削除された行は読み飛ばす。
+        """
+        with self._lock:
+            rows = self._matching_rows(filters).tolist()
+        row_docs = self._row_docs
+        for row in rows:
+            doc = row_docs[row]
+            if doc is not None:
+                yield doc
+
+    def _matching_documents(self, filters):
+        row_docs = self._row_docs
+        return [row_docs[row] for row in self._matching_rows(filters).tolist()]
+
+    def query_documents(self, filters):
+        """FirestoreSimulator.query_documents と同じ結果を、ブールマスク演算で返す"""
+        start_time = time.time()
+
+        results = self._matching_documents(filters)
+
+        query_time = (time.time() - start_time) * 1000 # ミリ秒単位
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] RPCシミュレーション完了 (列指向): {len(results)}件取得 (処理時間: {query_time:.2f}ms)")
+
+        return results
+
+    def aggregate_market_volume(self, filters, group_by=('dataSource', 'veroRisk')):
+        """
+        フィルタ後の行を group_by の組み合わせごとに集計する (件数と平均 marketVolume)。
+        group_by には辞書符号化済みのカテゴリ列のみ指定できる。
+        """
+        for field in group_by:
+            if field not in self.CATEGORICAL_FIELDS:
+                raise ValueError(f"集計キーに指定できない列です: {field}")
+        rows = self._matching_rows(filters)
+        dims = tuple(max(len(self._dictionary_values[field]), 1) for field in group_by)
+        keys = np.ravel_multi_index(tuple(self._codes[field][rows] for field in group_by), dims)
+        group_count = int(np.prod(dims))
+        counts = np.bincount(keys, minlength=group_count)
+        sums = np.bincount(keys, weights=self._market_volume[rows], minlength=group_count)
+
+        groups = {}
+        present = np.flatnonzero(counts)
+        for key, codes in zip(present.tolist(), zip(*np.unravel_index(present, dims))):
+            values = tuple(self._dictionary_values[field][code] for field, code in zip(group_by, codes))
+            groups[values] = (counts[key], sums[key])
+        return _format_aggregate_rows(group_by, groups)
+
+    def query_page(self, filters, sort, after_key, page_size):
+        """キーセットページング用に、カーソル (値, id) より後ろの page_size + 1 件を返す"""
+        return _keyset_page(self._matching_documents(filters), sort, after_key, page_size)
+
+class QueryResultCache:
+    """
+    get_filtered_repository_data のクエリ結果キャッシュ (LRU + TTL)。
+
+    キーは正規化したフィルタ条件 (期間は開始日の日付序数に変換) で、
+    書き込み通知を受けると、旧/新ドキュメントのどちらかが条件に一致するエントリだけを破棄します。
+    """
+    def __init__(self, max_entries=128, ttl_seconds=300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # {key: (登録時刻, 結果リスト)}
+        self._lock = threading.Lock()
+        # 書き込みのたびに進む世代番号。計算中に書き込みがあった結果は登録しない
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def attach(self, db_simulator):
+        """DBの書き込み通知を購読し、該当エントリを自動で無効化する"""
+        db_simulator.add_write_listener(self.on_write)
+        return self
+
+    def get_or_compute(self, filters, compute):
+        """キャッシュ済みの結果を返す。未登録または期限切れの場合は compute() の結果を登録して返す"""
+        key = _normalize_filters(filters)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+            generation = self._generation
+
+        results = compute()
+        with self._lock:
+            if generation != self._generation:
+                return list(results)
+            self._entries[key] = (now, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return list(results)
+
+    def on_write(self, old_doc, new_doc):
+        """書き込まれたドキュメント (更新前/更新後) が条件に一致するエントリを破棄する"""
+        with self._lock:
+            self._generation += 1
+            stale = [
+                key for key in self._entries
+                if any(doc is not None and _document_matches(key, doc) for doc in (old_doc, new_doc))
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def stats(self):
+        """ヒット率などの統計情報を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
+
+
+class DashboardAggregates:
+    """
+    ダッシュボードの集計ウィジェット用に、書き込みのたびに差分更新される集計テーブル。
+
+    - status / veroRisk / dataSource ごとの件数
+    - 日別 (researchDate) の件数と marketVolume 合計
+    いずれもバケット単位で O(1) 参照でき、集計時に生ドキュメントを走査しません。
+    """
+    COUNT_FIELDS = ('status', 'veroRisk', 'dataSource')
+
+    def __init__(self):
+        self.total = 0
+        self.counts = {field: {} for field in self.COUNT_FIELDS}  # {field: {値: 件数}}
+        self.daily = {}  # {日付序数: [件数, marketVolume合計]}
+        self._lock = threading.Lock()
+
+    def attach(self, db_simulator):
+        """既存ドキュメントで集計を初期化し、以降の書き込み通知を購読する"""
+        for doc in list(db_simulator.repository.values()):
+            self.on_write(None, doc)
+        db_simulator.add_write_listener(self.on_write)
+        return self
+
+    def _apply(self, doc, sign):
+        self.total += sign
+        for field in self.COUNT_FIELDS:
+            bucket = self.counts[field]
+            value = doc.get(field)
+            bucket[value] = bucket.get(value, 0) + sign
+            if bucket[value] == 0:
+                del bucket[value]
+        ordinal = date.fromisoformat(doc['researchDate']).toordinal()
+        day = self.daily.setdefault(ordinal, [0, 0])
+        day[0] += sign
+        day[1] += sign * doc['marketVolume']
+        if day[0] == 0:
+            del self.daily[ordinal]
+
+    def on_write(self, old_doc, new_doc):
+        """追加・更新・削除を、旧ドキュメントの減算と新ドキュメントの加算として反映する"""
+        with self._lock:
+            if old_doc is not None:
+                self._apply(old_doc, -1)
+            if new_doc is not None:
+                self._apply(new_doc, 1)
+
+    def count(self, field, value):
+        """指定フィールド・値の件数を返す"""
+        return self.counts[field].get(value, 0)
+
+    def daily_volume(self, days=90, today=None):
+        """直近 days 日分 (古い順) の日別件数と marketVolume 合計を返す"""
+        today_ordinal = (today or date.today()).toordinal()
+        rows = []
+        for ordinal in range(today_ordinal - days + 1, today_ordinal + 1):
+            count, volume = self.daily.get(ordinal, (0, 0))
+            rows.append({'date': date.fromordinal(ordinal).isoformat(), 'count': count, 'marketVolume': volume})
+        return rows
+
+    def summary(self, days=90):
+        """集計ウィジェット向けの全集計値を返す"""
+        with self._lock:
+            return {
+                'total': self.total,
+                **{field: dict(values) for field, values in self.counts.items()},
+                'dailyVolume': self.daily_volume(days),
+            }
+
+
+# 全文検索の対象フィールド
+FULL_TEXT_FIELDS = ('rawTitle', 'veroSafeTitle')
+# 英数字の単語 (型番の "ZZZ-007" や "9503.00" も1語として扱う) と、日本語 (かな・漢字) の連続部分
+_ALNUM_TOKEN = re.compile(r'[0-9a-z]+(?:[.\-][0-9a-z]+)*')
+_CJK_RUN = re.compile(r'[\u3041-\u30ff\u3400-\u9fff\uf900-\ufaff々〆ー]+')
+
+def tokenize_text(text):
+    """
+    検索用にテキストをトークンへ分割する。
+    NFKC正規化 (全角/半角の統一) と小文字化の後、英数字は単語単位、
+    日本語は文字bigram (1文字だけの場合はその文字) に分割する。
+    "zzz-007" のような区切り文字を含む英数字は、連結したままの語に加えて区切りごとの部分 ("zzz", "007") も返す。
+    """
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    tokens = []
+    for token in _ALNUM_TOKEN.findall(text):
+        tokens.append(token)
+        parts = re.split(r'[.\-]', token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class FullTextIndex:
+    """
+    rawTitle / veroSafeTitle の転置インデックス。書き込み通知で差分更新され、
+    クエリの全トークンを含むドキュメントを BM25 スコア順に返します。
+    日本語の1文字クエリ (「革」など) は bigram では引けないため、別途文字単位の転置インデックスで検索します。
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, fields=FULL_TEXT_FIELDS):
+        self.fields = fields
+        self.postings = {}  # {トークン: {doc_id: 出現回数}}
+        self.doc_lengths = {}  # {doc_id: トークン数}
+        self.documents = {}  # {doc_id: ドキュメント} (フィルタ判定と結果返却用)
+        self.char_postings = {}  # {日本語1文字: {doc_id: 出現回数}} (1文字クエリ用)
+        self._date_ordinals = {}  # {doc_id: researchDate の日付序数} (期間フィルタ判定用)
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def attach(self, db_simulator):
+        """既存ドキュメントを索引し、以降の書き込み通知を購読する"""
+        for doc in list(db_simulator.repository.values()):
+            self.on_write(None, doc)
+        db_simulator.add_write_listener(self.on_write)
+        return self
+
+    def _doc_tokens(self, doc):
+        tokens = []
+        for field in self.fields:
+            tokens.extend(tokenize_text(doc.get(field)))
+        return tokens
+
+    def _doc_chars(self, doc):
+        chars = []
+        for field in self.fields:
+            text = unicodedata.normalize('NFKC', doc.get(field) or '').lower()
+            for run in _CJK_RUN.findall(text):
+                chars.extend(run)
+        return chars
+
+    def _remove(self, doc):
+        doc_id = doc['id']
+        for token in set(self._doc_tokens(doc)):
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[token]
+        for char in set(self._doc_chars(doc)):
+            posting = self.char_postings.get(char)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.char_postings[char]
+        self._total_length -= self.doc_lengths.pop(doc_id, 0)
+        self.documents.pop(doc_id, None)
+        self._date_ordinals.pop(doc_id, None)
+
+    def _add(self, doc):
+        doc_id = doc['id']
+        tokens = self._doc_tokens(doc)
+        for token in tokens:
+            posting = self.postings.setdefault(token, {})
+            posting[doc_id] = posting.get(doc_id, 0) + 1
+        for char in self._doc_chars(doc):
+            posting = self.char_postings.setdefault(char, {})
+            posting[doc_id] = posting.get(doc_id, 0) + 1
+        self.doc_lengths[doc_id] = len(tokens)
+        self._total_length += len(tokens)
+        self.documents[doc_id] = doc
+        self._date_ordinals[doc_id] = date.fromisoformat(doc['researchDate']).toordinal()
+
+    def on_write(self, old_doc, new_doc):
+        """追加・更新・削除を転置インデックスへ反映する"""
+        with self._lock:
+            if old_doc is not None:
+                self._remove(old_doc)
+            if new_doc is not None:
+                self._add(new_doc)
+
+    def search(self, query, filters=None, limit=20):
+        """
+        クエリの全トークンを含み、filters (get_filtered_repository_data と同じ形式) にも一致する
+        ドキュメントを、(BM25スコア, ドキュメント) のリストとしてスコア降順で返す。
+        """
+        query_tokens = list(dict.fromkeys(tokenize_text(query)))
+        if not query_tokens:
+            return []
+        with self._lock:
+            postings = [
+                self.char_postings.get(token) if len(token) == 1 and _CJK_RUN.fullmatch(token) else self.postings.get(token)
+                for token in query_tokens
+            ]
+            if any(posting is None for posting in postings):
+                return []
+            # 出現件数の少ないトークンから積集合を取る
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+                if not candidates:
+                    return []
+
+            key = _normalize_filters(filters) if filters else None
+            doc_count = len(self.doc_lengths)
+            avg_length = self._total_length / doc_count if doc_count else 0.0
+            idf = [math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5)) for posting in postings]
+            scored = []
+            for doc_id in candidates:
+                if key is not None and not _document_matches(key, self.documents[doc_id], self._date_ordinals[doc_id]):
+                    continue
+                length_norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[doc_id] / avg_length)
+                score = 0.0
+                for posting, token_idf in zip(postings, idf):
+                    tf = posting[doc_id]
+                    score += token_idf * tf * (self.K1 + 1) / (tf + length_norm)
+                scored.append((score, doc_id))
+            top = heapq.nlargest(limit, scored)
+            return [(score, self.documents[doc_id]) for score, doc_id in top]
+
+
 # ==============================================================================
 # II. データのシードとモック生成
 # ==============================================================================
@@ -70,6 +1025,7 @@ class FirestoreSimulator:
 def generate_and_seed_data(db_simulator, count=500):
     """
     Research Repositoryにモックデータを生成し、DBシミュレーターに登録する関数。
+    ランダム値は random.choices でまとめて生成し、add_documents で一括登録する。
     """
     statuses = ['Promoted', 'Rejected', 'Pending']
     veroRisks = ['リスク高', 'リスク中', 'リスク低']
@@ -78,30 +1034,37 @@ def generate_and_seed_data(db_simulator, count=500):
     
     print(f"[{datetime.now().strftime('%H:%M:%S')}] {count}件のリサーチリポジトリデータを生成中...")
 
-    for i in range(1, count + 1):
-        status = random.choice(statuses)
-        veroRisk = random.choice(veroRisks)
-        marketVolume = random.randint(50, 550)
-        htsCode = random.choice(htsCodes)
-        
-        # 過去90日間の任意の日付を生成
-        researchDate = (datetime.now() - timedelta(days=random.randint(0, 90))).strftime('%Y-%m-%d')
+    # 過去90日間の日付文字列は91通りしかないため、先に作っておく
+    now = datetime.now()
+    research_dates = [(now - timedelta(days=days)).strftime('%Y-%m-%d') for days in range(0, 91)]
+
+    status_list = random.choices(statuses, k=count)
+    vero_risk_list = random.choices(veroRisks, k=count)
+    hts_code_list = random.choices(htsCodes, k=count)
+    date_list = random.choices(research_dates, k=count)
+    title_source_list = random.choices(sources, k=count)
+    data_source_list = random.choices(sources, k=count)
+    supplier_list = random.choices(['A', 'B', 'C'], k=count)
 
+    documents = []
+    for i in range(1, count + 1):
+        status = status_list[i - 1]
+        htsCode = hts_code_list[i - 1]
         doc_id = f"R{i:04d}"
-        data = {
+        documents.append({
             'id': doc_id,
-            'rawTitle': f"[Status:{status}] Item {i} for {random.choice(sources)}",
-            'researchDate': researchDate,
-            'dataSource': random.choice(sources),
-            'veroRisk': veroRisk,
+            'rawTitle': f"[Status:{status}] Item {i} for {title_source_list[i - 1]}",
+            'researchDate': date_list[i - 1],
+            'dataSource': data_source_list[i - 1],
+            'veroRisk': vero_risk_list[i - 1],
             'status': status,
-            'marketVolume': marketVolume,
+            'marketVolume': random.randint(50, 550),
             'htsCode': htsCode,
-            'geminiSupplier': f"Supplier {random.choice(['A', 'B', 'C'])} (Price: ¥{random.randint(1000, 5000)})",
+            'geminiSupplier': f"Supplier {supplier_list[i - 1]} (Price: ¥{random.randint(1000, 5000)})",
             'claudeHTSLog': f"HTS code {htsCode} was derived based on the 'parts' classification logic.",
             'veroSafeTitle': f"Collectible Goods - Non-branded Item {i}",
-        }
-        db_simulator.add_document(doc_id, data)
+        })
+    db_simulator.add_documents(documents)
         
     print(f"[{datetime.now().strftime('%H:%M:%S')}] データ生成とシード完了。")
 
@@ -110,13 +1073,50 @@ def generate_and_seed_data(db_simulator, count=500):
 # RPCシミュレーションの実行関数 (メインAPIエンドポイント相当)
 # ==============================================================================
 
-def get_filtered_repository_data(db_simulator, filters):
+def _project(doc, fields):
+    """ドキュメントから指定フィールドのみを取り出す (fields が None の場合は全フィールド)"""
+    if fields is None:
+        return doc
+    return {field: doc[field] for field in fields if field in doc}
+
+def _encode_cursor(sort, doc):
+    """次ページ取得用の不透明なカーソル文字列 (並び順, 値, id) を生成する"""
+    field, _ = SORT_OPTIONS[sort]
+    payload = json.dumps([sort, doc[field], doc['id']], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def _validate_sort(sort):
+    """並び順が SORT_OPTIONS に含まれない場合は ValueError"""
+    if sort not in SORT_OPTIONS:
+        raise ValueError(f"未対応の並び順です: {sort} (指定可能: {', '.join(SORT_OPTIONS)})")
+
+def _decode_cursor(cursor, sort):
+    """
+    カーソル文字列を (値, id) のキーに戻す。並び順が異なるカーソルや、
+    値・id の型が並び順と合わない (改ざんされた) カーソルはエラーとする
+    """
+    try:
+        cursor_sort, value, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"不正なカーソルです: {cursor}") from e
+    if cursor_sort != sort:
+        raise ValueError(f"カーソルの並び順 ({cursor_sort}) がリクエストの並び順 ({sort}) と一致しません")
+    field, _ = SORT_OPTIONS[sort]
+    if (not isinstance(value, SORT_VALUE_TYPES[field]) or isinstance(value, bool)
+            or not isinstance(doc_id, str)):
+        raise ValueError(f"不正なカーソルです: {cursor}")
+    return (value, doc_id)
+
+def get_filtered_repository_data(db_simulator, filters, sort=None, fields=None, cache=None):
     """
     フロントエンドからのリクエストを受け付け、DBへのクエリを実行し、結果を返す関数。
     
     Args:
         db_simulator (FirestoreSimulator): データベース接続インスタンス
         filters (dict): フロントエンドから渡されるフィルタ条件
+        sort (str): 並び順 (SORT_OPTIONS のキー)。None の場合は登録順
+        fields (tuple): 返却するフィールド。None の場合は全フィールド
+        cache (QueryResultCache): 指定した場合、同じフィルタ条件の結果をキャッシュから返す
         
     Returns:
         list: フィルタリングされたドキュメントのリスト
@@ -125,10 +1125,174 @@ def get_filtered_repository_data(db_simulator, filters):
     
     # 実際には、ここで認証チェックや入力検証が行われます。
     
-    filtered_data = db_simulator.query_documents(filters)
+    if cache is not None:
+        filtered_data = cache.get_or_compute(filters, lambda: db_simulator.query_documents(filters))
+    else:
+        filtered_data = db_simulator.query_documents(filters)
+
+    if sort is not None:
+        _validate_sort(sort)
+        field, descending = SORT_OPTIONS[sort]
+        filtered_data = sorted(filtered_data, key=lambda doc: (doc[field], doc['id']), reverse=descending)
+    if fields is not None:
+        filtered_data = [_project(doc, fields) for doc in filtered_data]
     
     return filtered_data
 
+def get_filtered_repository_page(db_simulator, filters, page_size=50, cursor=None,
+                                 sort='researchDate_desc', fields=SUMMARY_FIELDS):
+    """
+    get_filtered_repository_data のページング版。キーセット (並び替え値 + id) のカーソルで
+    次ページを取得するため、オフセットを使わず深いページでも読み飛ばしが発生しない。
+    
+    Args:
+        db_simulator (FirestoreSimulator): データベース接続インスタンス
+        filters (dict): get_filtered_repository_data と同じフィルタ条件
+        page_size (int): 1ページの件数
+        cursor (str): 前ページの nextCursor。None の場合は先頭ページ
+        sort (str): 並び順 (SORT_OPTIONS のキー)
+        fields (tuple): 返却するフィールド。None の場合は全フィールド
+        
+    Returns:
+        dict: {'items': ドキュメントのリスト, 'nextCursor': 次ページのカーソル (最終ページは None)}
+    """
+    _validate_sort(sort)
+    if page_size < 1:
+        raise ValueError(f"page_size は1以上を指定してください: {page_size}")
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] RPC呼び出し (ページ): フィルタ条件 {filters} / 並び順 {sort} / {page_size}件")
+
+    after_key = _decode_cursor(cursor, sort) if cursor else None
+    page = db_simulator.query_page(filters, sort, after_key, page_size)
+
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = _encode_cursor(sort, page[-1])
+    
+    return {'items': [_project(doc, fields) for doc in page], 'nextCursor': next_cursor}
+
+def iter_filtered_repository_data(db_simulator, filters, fields=None):
+    """
+    get_filtered_repository_data のジェネレーター版。結果リストを作らずに、
+    フィルタに一致したドキュメントを1件ずつ (必要なら射影して) 返す。
+    """
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] RPC呼び出し (ストリーム): フィルタ条件 {filters}")
+    for doc in db_simulator.iter_documents(filters):
+        yield _project(doc, fields)
+
+def encode_ndjson(rows, rows_per_chunk=500):
+    """ドキュメント列を NDJSON (1行1ドキュメント) のバイト列チャンクとして逐次エンコードする"""
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(row, ensure_ascii=False))
+        if len(buffer) >= rows_per_chunk:
+            yield ('\n'.join(buffer) + '\n').encode('utf-8')
+            buffer = []
+    if buffer:
+        yield ('\n'.join(buffer) + '\n').encode('utf-8')
+
+def encode_json_array(rows, rows_per_chunk=500):
+    """ドキュメント列を1つの JSON 配列として、チャンク単位で逐次エンコードする"""
+    yield b'['
+    buffer = []
+    first = True
+    for row in rows:
+        buffer.append(json.dumps(row, ensure_ascii=False))
+        if len(buffer) >= rows_per_chunk:
+            yield (('' if first else ',') + ','.join(buffer)).encode('utf-8')
+            first = False
+            buffer = []
+    if buffer:
+        yield (('' if first else ',') + ','.join(buffer)).encode('utf-8')
+    yield b']'
+
+def make_stream_handler(db_simulator):
+    """
+    ローカル検証用のHTTPハンドラーを生成する (本番のRPCエンドポイントの代替)。
+    GET /research?period=30d&status=Promoted&format=ndjson&fields=id,rawTitle のように呼び出し、
+    結果を Transfer-Encoding: chunked で逐次送信する。
+    """
+    class RepositoryStreamHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            filters = {key: params.get(key, '') for key in ('period',) + INDEXED_EQUALITY_FIELDS}
+            fields = tuple(params['fields'].split(',')) if params.get('fields') else None
+            # 不正なフィルタはヘッダー送信前に検出し、200 を返した後で失敗しないようにする。
+            # 先頭1件もここで取り出し、対象ID一覧のスナップショットを確定させておく
+            try:
+                _normalize_filters(filters)
+                rows = iter_filtered_repository_data(db_simulator, filters, fields)
+                first_row = next(rows, None)
+            except ValueError as e:
+                # ステータス行は latin-1 のため、詳細はレスポンス本文側に入れる
+                self.send_error(400, 'Invalid query', f'不正なフィルタ条件です: {e}')
+                return
+            if first_row is not None:
+                rows = itertools.chain((first_row,), rows)
+            if params.get('format') == 'json':
+                content_type, chunks = 'application/json', encode_json_array(rows)
+            else:
+                content_type, chunks = 'application/x-ndjson', encode_ndjson(rows)
+
+            self.send_response(200)
+            self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(f'{len(chunk):X}\r\n'.encode('ascii') + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+
+    return RepositoryStreamHandler
+
+def serve_repository_stream(db_simulator, host='127.0.0.1', port=8765):
+    """ストリーミング返却のローカルHTTPサーバーを起動する (Ctrl+Cで終了)"""
+    server = ThreadingHTTPServer((host, port), make_stream_handler(db_simulator))
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] ストリーミングRPCサーバー起動: http://{host}:{port}/research")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def search_repository(text_index, query, filters=None, limit=20, fields=SUMMARY_FIELDS):
+    """
+    タイトルの全文検索RPC。既存のフィルタ条件と組み合わせ、関連度順に返す。
+    
+    Args:
+        text_index (FullTextIndex): 対象リポジトリに attach 済みの全文検索インデックス
+        query (str): 検索語 (日本語・英数字混在可)
+        filters (dict): get_filtered_repository_data と同じフィルタ条件
+        limit (int): 最大件数
+        fields (tuple): 返却するフィールド。None の場合は全フィールド
+        
+    Returns:
+        list: 'searchScore' を付与したドキュメントのリスト (スコア降順)
+    """
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] RPC呼び出し (全文検索): '{query}' / フィルタ条件 {filters}")
+    return [
+        {**_project(doc, fields), 'searchScore': round(score, 4)}
+        for score, doc in text_index.search(query, filters, limit)
+    ]
+
+def get_repository_aggregates(db_simulator, filters, group_by=('dataSource', 'veroRisk')):
+    """
+    ダッシュボードの集計ウィジェット向けに、group_by ごとの件数と平均 marketVolume を返す関数。
+    (従来はフロントエンド側で全件を受け取って集計していた処理)
+    
+    Args:
+        db_simulator (FirestoreSimulator | ColumnarFirestoreSimulator): データベース接続インスタンス
+        filters (dict): get_filtered_repository_data と同じフィルタ条件
+        group_by (tuple): 集計キーとするフィールド
+        
+    Returns:
+        list: {group_byの各フィールド, 'count', 'avgMarketVolume'} の辞書のリスト
+    """
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] RPC呼び出し (集計): フィルタ条件 {filters} / 集計キー {group_by}")
+    return db_simulator.aggregate_market_volume(filters, group_by)
+
 # ==============================================================================
 # 実行例 (VPS上のPythonスクリプト実行シミュレーション)
 # ==============================================================================
@@ -174,4 +1338,64 @@ if __name__ == '__main__':
     data_s3 = get_filtered_repository_data(db_instance, scenario_3_filters)
     print(f"  -> シナリオ3結果件数 (全件): {len(data_s3)} 件")
     
+    # シナリオ3-2: 一覧画面向けに要約フィールドのみを50件ずつページング取得
+    print("\n[シナリオ3-2] 全期間のリサーチデータを新しい順に50件ずつ要求...")
+    page_1 = get_filtered_repository_page(db_instance, scenario_3_filters, page_size=50)
+    page_2 = get_filtered_repository_page(db_instance, scenario_3_filters, page_size=50, cursor=page_1['nextCursor'])
+    print(f"  -> 1ページ目: {len(page_1['items'])} 件 ({page_1['items'][0]['researchDate']} 〜), 2ページ目: {len(page_2['items'])} 件")
+
+    # シナリオ3-3: 同じフィルタ条件の繰り返し呼び出しをキャッシュから返す
+    print("\n[シナリオ3-3] シナリオ1の条件を3回要求 (2回目以降はキャッシュ) し、途中で該当ドキュメントを更新...")
+    query_cache = QueryResultCache(max_entries=64, ttl_seconds=300).attach(db_instance)
+    for _ in range(3):
+        get_filtered_repository_data(db_instance, scenario_1_filters, cache=query_cache)
+    updated_doc = dict(data_s1[0], marketVolume=999)
+    db_instance.add_document(updated_doc['id'], updated_doc)
+    get_filtered_repository_data(db_instance, scenario_1_filters, cache=query_cache)
+    print(f"  -> キャッシュ統計: {query_cache.stats()}")
+
+    # シナリオ3-4: 全件をNDJSONで逐次エンコード (結果リストを作らずに送信できる)
+    print("\n[シナリオ3-4] 全期間の全リサーチデータをNDJSONでストリーミング...")
+    streamed_bytes = sum(len(chunk) for chunk in encode_ndjson(iter_filtered_repository_data(db_instance, scenario_3_filters)))
+    print(f"  -> ストリーミング送信量: {streamed_bytes:,} バイト")
+
+    # シナリオ3-5: 差分更新される集計テーブルからサマリーを取得 (生ドキュメントは走査しない)
+    print("\n[シナリオ3-5] ダッシュボードのサマリー集計を取得 (更新・削除を反映)...")
+    dashboard_aggregates = DashboardAggregates().attach(db_instance)
+    db_instance.delete_document(data_s1[-1]['id'])
+    summary = dashboard_aggregates.summary(days=90)
+    print(f"  -> 総件数: {summary['total']} 件 / ステータス別: {summary['status']}")
+    print(f"  -> 直近日の件数: {summary['dailyVolume'][-1]}")
+
+    # シナリオ3-6: スナップショットの保存と復元 (VPS再起動時に再シードせずに復旧)
+    print("\n[シナリオ3-6] リポジトリとインデックスのスナップショットを保存・復元...")
+    snapshot_path = os.path.join(tempfile.gettempdir(), 'research_repository.snapshot')
+    db_instance.save_snapshot(snapshot_path)
+    restored_instance = FirestoreSimulator.load_snapshot(snapshot_path)
+    restored_s1 = get_filtered_repository_data(restored_instance, scenario_1_filters)
+    print(f"  -> 復元後のシナリオ1結果件数: {len(restored_s1)} 件")
+
+    # シナリオ3-7: タイトルの全文検索 (日本語はbigram、既存フィルタと併用)
+    print("\n[シナリオ3-7] タイトル全文検索...")
+    text_index = FullTextIndex().attach(db_instance)
+    db_instance.add_document('R9001', dict(data_s1[0], id='R9001', rawTitle='限定版フィギュア ZZZ-007 未開封', veroSafeTitle='Limited Figure ZZZ-007'))
+    for query, query_filters in [('フィギュア', None), ('ｚｚｚ-007', None), ('Item 42', {'period': 'all'}), ('Collectible', {'period': '30d', 'status': 'Promoted'})]:
+        hits = search_repository(text_index, query, query_filters, limit=3, fields=('id', 'rawTitle'))
+        print(f"  -> '{query}': {[(hit['id'], hit['searchScore']) for hit in hits]}")
+
+    # シナリオ4: ソース × リスク別の件数と平均マーケットボリューム (サーバー側集計)
+    print("\n[シナリオ4] 直近30日間のソース×リスク別集計を要求...")
+    aggregates = get_repository_aggregates(db_instance, {'period': '30d'})
+    for row in aggregates[:3]:
+        print(f"  -> {row}")
+
+    # シナリオ5: 列指向バックエンドで同じクエリを実行 (NumPyがある環境のみ)
+    if np is not None:
+        columnar_instance = ColumnarFirestoreSimulator()
+        for doc_id, data in db_instance.repository.items():
+            columnar_instance.add_document(doc_id, data)
+        print("\n[シナリオ5] 列指向バックエンドでシナリオ1を再実行...")
+        data_s5 = get_filtered_repository_data(columnar_instance, scenario_1_filters)
+        print(f"  -> シナリオ5結果件数: {len(data_s5)} 件 (シナリオ1と一致: {data_s5 == data_s1})")
+    
     print("\n--- RPCシミュレーション終了 ---")
@@ -1,8 +1,29 @@
 import time
 import random
+import io
+import os
+import re
 import json
+import queue
+import signal
+import sqlite3
+import tempfile
+import threading
+import unicodedata
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+try:
+    import numpy as np
+except ImportError:  # 一括スコア計算 (ScoreCalculator.calculate_final_ui_batch) 使用時のみ必須
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:  # 画像ファイルからの知覚ハッシュ計算 (perceptual_hash) 使用時のみ必須
+    Image = None
+
 # ==============================================================================
 # 外部ツール: Google Search APIのシミュレーション (必須)
 # 実際の環境ではこの関数がGoogleのAPIを呼び出します
@@ -31,6 +52,446 @@ def google_search_ec_sites(product_name, is_image_search=False):
     
     return candidate_price, supplier_url
 
+class RateLimiter:
+    """
+    外部API (Google Search / Gemini) の呼び出し回数を制限するトークンバケット。
+    複数スレッドから同時に acquire() を呼び出しても、平均 rate_per_sec 回/秒を超えない。
+    """
+    
+    def __init__(self, rate_per_sec, burst=1):
+        """
+        Args:
+            rate_per_sec (float): 1秒あたりの最大呼び出し回数 (APIクォータ)。
+            burst (int): 連続して即時に許可する最大回数。
+        """
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """トークンを1つ取得する。トークンがなければ補充されるまで待機する"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate_per_sec)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate_per_sec
+            time.sleep(wait_seconds)
+
+def normalize_search_query(product_name):
+    """
+    検索キャッシュのキー用に商品名を正規化する (全角/半角の統一・小文字化・空白の圧縮)。
+    """
+    return " ".join(unicodedata.normalize("NFKC", product_name).lower().split())
+
+
+class SearchResultCache:
+    """
+    google_search_ec_sites の結果を SQLite ファイルに保存する検索キャッシュ。
+    
+    - キーは (検索モード, 正規化した商品名)。同じ型番の商品を再検索しない。
+    - ttl_seconds を過ぎた結果は使わない (価格・在庫の変動に追随するため)。
+    - max_entries を超えた場合、最後に参照された日時が古いものから削除する (LRU)。
+    - 同じキーの検索が同時に要求された場合、実行中の1回の結果を共有する (リクエストの合流)。
+    プロセスを再起動してもキャッシュは残る。
+    """
+    
+    def __init__(self, path, ttl_seconds=24 * 3600, max_entries=10000):
+        """
+        Args:
+            path (str): SQLiteファイルのパス。
+            ttl_seconds (float): キャッシュの有効期間 (秒)。
+            max_entries (int): 保持する最大件数。
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._in_flight = {}  # {key: Future}
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                "key TEXT PRIMARY KEY, candidate_price INTEGER NOT NULL, supplier_url TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS search_cache_last_access ON search_cache (last_access)")
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+    
+    @staticmethod
+    def make_key(product_name, is_image_search=False):
+        """キャッシュキー ('text:' または 'image:' + 正規化した商品名)"""
+        mode = "image" if is_image_search else "text"
+        return f"{mode}:{normalize_search_query(product_name)}"
+    
+    def get(self, key):
+        """
+        有効期間内のキャッシュを返す。なければ None (期限切れのものは削除する)。
+        
+        Returns:
+            tuple: (candidate_price, supplier_url) または None。
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT candidate_price, supplier_url, created_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.ttl_seconds:
+                conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+        return row[0], row[1]
+    
+    def set(self, key, result):
+        """検索結果を保存し、max_entries を超えた分を参照の古い順に削除する"""
+        now = time.time()
+        candidate_price, supplier_url = result
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, candidate_price, supplier_url, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, candidate_price, supplier_url, now, now),
+            )
+            conn.execute(
+                "DELETE FROM search_cache WHERE key IN ("
+                "SELECT key FROM search_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+    
+    def get_or_search(self, product_name, is_image_search=False, search_func=google_search_ec_sites):
+        """
+        キャッシュがあれば返し、なければ search_func で検索して保存する。
+        同じキーの検索が実行中であれば、新たに検索せずその結果を待つ。
+        
+        Returns:
+            tuple: (candidate_price, supplier_url)
+        """
+        key = self.make_key(product_name, is_image_search)
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached
+        
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._in_flight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not is_owner:
+            return future.result()
+        
+        try:
+            # 直前に他のスレッドの検索が完了していればその結果を使う
+            result = self.get(key)
+            if result is None:
+                result = search_func(product_name, is_image_search=is_image_search)
+                self.set(key, result)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+    
+    def stats(self):
+        """ヒット数・ミス数 (実際の検索回数)・合流数・保存件数"""
+        with closing(self._connect()) as conn:
+            size = conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "entries": size}
+
+# ==============================================================================
+# 商品名の正規化と重複集約 (同一商品のAI解析を1回にまとめる)
+# ==============================================================================
+
+# 型番とみなすトークン: 英数字 (区切り '-', '/', '.' を含む) で、英字と数字の両方を含むもの
+MODEL_NUMBER_PATTERN = re.compile(r"[A-Z0-9]+(?:[-/.][A-Z0-9]+)*")
+# 容量・サイズなどの数量表記 (型番とみなさない)
+QUANTITY_PATTERN = re.compile(r"[0-9.]+(?:GB|TB|MB|MAH|MM|CM|ML|KG|G|L|W|V|K|P|INCH|CT|PCS|個|枚|本)")
+# トークン集合キー用のトークン: 英数字の連続、またはかな・カナ・漢字の連続
+NAME_TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[゠-ヿ一-鿿々]+")
+# 商品の同一性に関係しない出品タイトルの定型句
+NAME_NOISE_WORDS = frozenset(["新品", "未使用", "未開封", "中古", "美品", "送料無料", "正規品", "国内正規品", "本物", "即日発送"])
+# ひらがな -> カタカナ の変換表 (表記ゆれ吸収用)
+HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(ord("ぁ"), ord("ゖ") + 1)}
+
+
+def extract_model_numbers(product_name):
+    """
+    商品名から型番を抽出する (全角/半角を統一し、区切り記号を除いた大文字表記)。
+    例: 'アンティーク腕時計 ＸＹＺ－１９５０' -> ['XYZ1950']
+    
+    Returns:
+        list: 出現順の型番 (重複なし)。
+    """
+    text = unicodedata.normalize("NFKC", product_name).upper()
+    model_numbers = []
+    for token in MODEL_NUMBER_PATTERN.findall(text):
+        compact = re.sub(r"[-/.]", "", token)
+        if QUANTITY_PATTERN.fullmatch(token):
+            continue
+        if len(compact) >= 4 and re.search(r"[A-Z]", compact) and re.search(r"[0-9]", compact):
+            if compact not in model_numbers:
+                model_numbers.append(compact)
+    return model_numbers
+
+
+def product_group_key(product_name, item_id=None):
+    """
+    同一商品とみなす商品をまとめるためのキーを返す。
+    型番があれば型番と残りの語、なければ正規化したトークン集合 (語順・全角/半角・大小文字・ひらがな/カタカナの違いを無視) をキーとする。
+    型番が同じでも「交換用バッテリー」「本体」のように残りの語が異なる商品は別のキーになる。
+    型番以外の日本語は分かち書きの違い (「限定版フィギュア」と「フィギュア 限定版」) を吸収するため文字単位で比較する。
+    トークンが1つも残らない商品名 (ハングルや絵文字のみ、ノイズ語のみなど) は他の商品とまとめず、
+    item_id (省略時は正規化した商品名そのもの) をキーとする。
+
+    Args:
+        product_name (str): 商品名
+        item_id (str): アイテムID。トークンが残らない場合のキーに使う
+    """
+    model_numbers = extract_model_numbers(product_name)
+    text = unicodedata.normalize("NFKC", product_name).lower().translate(HIRAGANA_TO_KATAKANA)
+    tokens = set(NAME_TOKEN_PATTERN.findall(text)) - NAME_NOISE_WORDS
+    if model_numbers:
+        # 型番の一部 ("zzz-007" の "zzz", "007" など) を除いた残りの語
+        rest = set()
+        for token in tokens:
+            if token[0].isascii():
+                if not any(token.upper() in model_number for model_number in model_numbers):
+                    rest.add(token)
+            else:
+                rest.update(token)
+        key = "model:" + ",".join(sorted(model_numbers))
+        return key + "|" + "".join(sorted(rest)) if rest else key
+    if tokens:
+        return "tokens:" + " ".join(sorted(tokens))
+    if item_id is not None:
+        return f"item:{item_id}"
+    return "name:" + " ".join(text.split())
+
+
+def group_queued_items(items):
+    """
+    AI解析対象のアイテムを product_group_key で集約する。
+    
+    Returns:
+        dict: {グループキー: [アイテム, ...]} (グループ・アイテムとも元の順序を保つ)。
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(product_group_key(item['productName'], item['id']), []).append(item)
+    return groups
+
+# ==============================================================================
+# 画像の知覚ハッシュ (pHash) と類似画像索引 (外部の画像検索を呼ぶ前にローカルで照合)
+# ==============================================================================
+
+PHASH_IMAGE_SIZE = 32  # DCT前に縮小する画像サイズ
+PHASH_LOW_FREQUENCY_SIZE = 8  # ハッシュに使う低周波成分 (8x8 = 64ビット)
+
+
+def _load_grayscale_pixels(image):
+    """
+    画像を PHASH_IMAGE_SIZE 四方のグレースケール画素 (float64 の2次元配列) に変換する。
+    ファイルパス・バイト列・PIL画像は Pillow で読み込み、配列 (高さ x 幅 [x チャンネル]) はそのまま縮小する。
+    """
+    if isinstance(image, (str, bytes, os.PathLike)) or (Image is not None and isinstance(image, Image.Image)):
+        if Image is None:
+            raise ImportError("画像ファイルの読み込みには Pillow が必要です (pip install Pillow)")
+        if isinstance(image, bytes):
+            image = io.BytesIO(image)
+        if not isinstance(image, Image.Image):
+            image = Image.open(image)
+        resized = image.convert("L").resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.LANCZOS)
+        return np.asarray(resized, dtype=np.float64)
+    
+    pixels = np.asarray(image, dtype=np.float64)
+    if pixels.ndim == 3:
+        if pixels.shape[2] >= 3:
+            pixels = pixels[..., :3] @ np.array([0.299, 0.587, 0.114])  # 輝度に変換
+        else:
+            pixels = pixels[..., 0]  # グレースケール (+アルファ) はそのまま輝度として使う
+    height, width = pixels.shape
+    row_starts = np.arange(PHASH_IMAGE_SIZE) * height // PHASH_IMAGE_SIZE
+    column_starts = np.arange(PHASH_IMAGE_SIZE) * width // PHASH_IMAGE_SIZE
+    if height < PHASH_IMAGE_SIZE or width < PHASH_IMAGE_SIZE:
+        return pixels[np.ix_(row_starts, column_starts)]  # 小さい画像は最近傍で拡大
+    # 面積平均で縮小
+    sums = np.add.reduceat(np.add.reduceat(pixels, row_starts, axis=0), column_starts, axis=1)
+    counts = np.outer(np.diff(np.append(row_starts, height)), np.diff(np.append(column_starts, width)))
+    return sums / counts
+
+
+def _dct_matrix(size):
+    """DCT-II の変換行列 (正規化なし。ハッシュは大小比較のみのため係数のスケールは影響しない)"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    return np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+
+
+def perceptual_hash(image):
+    """
+    画像の知覚ハッシュ (pHash, 64ビット整数) を計算する。
+    縮小したグレースケール画像を2次元DCTし、低周波 8x8 成分 (直流成分を除く中央値との大小) をビット化する。
+    再圧縮・リサイズ・明るさの変化ではハッシュがほとんど変わらないため、
+    ハミング距離が小さい画像は同一商品の画像とみなせる。
+    
+    Args:
+        image: ファイルパス / バイト列 / PIL画像 (Pillow が必要)、または画素の配列。
+    
+    Returns:
+        int: 64ビットのハッシュ。
+    """
+    if np is None:
+        raise ImportError("perceptual_hash には NumPy が必要です (pip install numpy)")
+    pixels = _load_grayscale_pixels(image)
+    dct = _dct_matrix(PHASH_IMAGE_SIZE)
+    low_frequency = (dct @ pixels @ dct.T)[:PHASH_LOW_FREQUENCY_SIZE, :PHASH_LOW_FREQUENCY_SIZE].flatten()
+    bits = low_frequency > np.median(low_frequency[1:])
+    image_hash = 0
+    for bit in bits.tolist():
+        image_hash = (image_hash << 1) | bit
+    return image_hash
+
+
+def hamming_distance(hash_a, hash_b):
+    """2つのハッシュの異なるビット数"""
+    return bin(hash_a ^ hash_b).count("1")
+
+
+class BKTree:
+    """
+    ハミング距離で近傍検索を行う BK木。
+    各ノードの子を「親との距離」で分類しておき、三角不等式により
+    |子の距離 - 検索キーとの距離| > 許容距離 の枝を探索せずに済ませる。
+    """
+    
+    def __init__(self, distance_func=hamming_distance):
+        self.distance_func = distance_func
+        self._root = None  # [キー, [値, ...], {距離: 子ノード}]
+        self._size = 0
+    
+    def __len__(self):
+        return self._size
+    
+    def add(self, key, value):
+        """キーと値を追加する (同じキーには値を追加で保持する)"""
+        self._size += 1
+        if self._root is None:
+            self._root = [key, [value], {}]
+            return
+        node = self._root
+        while True:
+            distance = self.distance_func(key, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [value], {}]
+                return
+            node = child
+    
+    def search(self, key, max_distance):
+        """
+        key から max_distance 以内のキーを持つ値を返す。
+        
+        Returns:
+            list: [(距離, キー, 値), ...] (距離の近い順)。
+        """
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node_key, values, children = stack.pop()
+            distance = self.distance_func(key, node_key)
+            if distance <= max_distance:
+                matches.extend((distance, node_key, value) for value in values)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class ImageHashIndex:
+    """
+    仕入れ先を特定済みの商品画像の pHash 索引。
+    新しい商品の画像ハッシュから max_distance 以内の特定済み商品を探し、見つかればその結果を再利用する。
+    path を指定すると SQLite に保存し、次回起動時に読み込む。
+    """
+    
+    def __init__(self, path=None, max_distance=6):
+        """
+        Args:
+            path (str): 保存先の SQLite ファイル (None の場合はメモリ上のみ)。
+            max_distance (int): 同一商品とみなすハミング距離の上限 (64ビット中)。
+        """
+        self.path = path
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        if path:
+            with closing(sqlite3.connect(path, timeout=30)) as conn, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS image_hash_index ("
+                    "image_hash TEXT NOT NULL, product_id TEXT NOT NULL, result TEXT NOT NULL, "
+                    "PRIMARY KEY (image_hash, product_id))"
+                )
+                for image_hash, product_id, result in conn.execute(
+                    "SELECT image_hash, product_id, result FROM image_hash_index"
+                ):
+                    self._tree.add(int(image_hash, 16), (product_id, json.loads(result)))
+    
+    def __len__(self):
+        return len(self._tree)
+    
+    def lookup(self, image_hash):
+        """
+        最も近い特定済み商品を返す。
+        
+        Returns:
+            tuple: (ハミング距離, 商品ID, 解析結果) または None。
+        """
+        with self._lock:
+            matches = self._tree.search(image_hash, self.max_distance)
+            if not matches:
+                self.misses += 1
+                return None
+            self.hits += 1
+        distance, _, (product_id, result) = matches[0]
+        return distance, product_id, dict(result)
+    
+    def add(self, image_hash, product_id, result):
+        """特定済み商品の画像ハッシュと解析結果を登録する"""
+        with self._lock:
+            self._tree.add(image_hash, (product_id, dict(result)))
+        if self.path:
+            with closing(sqlite3.connect(self.path, timeout=30)) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO image_hash_index (image_hash, product_id, result) VALUES (?, ?, ?)",
+                    (f"{image_hash:016x}", product_id, json.dumps(result, ensure_ascii=False)),
+                )
+
 # ==============================================================================
 # I. スコア計算ロジック ($U_i = P + S$)
 # ==============================================================================
@@ -40,9 +501,10 @@ class ScoreCalculator:
     リサーチ結果とAI特定価格に基づき、最終的なUiスコアを計算する。
     """
     
-    def __init__(self, avg_domestic_shipping=800, max_ui_score=100):
+    def __init__(self, avg_domestic_shipping=800, max_ui_score=100, fee_multiplier=0.85):
         self.avg_domestic_shipping = avg_domestic_shipping # 指示書 II. 推定国内送料
         self.MAX_SCORE = max_ui_score
+        self.fee_multiplier = fee_multiplier # eBay手数料控除後の受取率
     
     def calculate_profitability(self, candidate_price, sold_price_avg):
         """
@@ -60,7 +522,7 @@ class ScoreCalculator:
         
         # 推定利益額 (P1)
         # eBay手数料や国際送料はここでは固定値として無視し、シンプルな利益額を算出
-        estimated_profit = sold_price_avg * 0.85 - total_cost 
+        estimated_profit = sold_price_avg * self.fee_multiplier - total_cost 
         
         # 推定利益率 (P2)
         estimated_profit_rate = (estimated_profit / sold_price_avg) if sold_price_avg > 0 else 0
@@ -99,8 +561,11 @@ class ScoreCalculator:
     def calculate_final_ui(self, item):
         """
         最終Uiスコアを計算し、AI解析後のデータとして返却する。
+        価格または信頼度が未設定・0・NaN の場合は AI解析前として扱う (calculate_final_ui_batch と同じ)。
         """
-        if not item.get('aiCandidatePrice') or not item.get('confidenceScore'):
+        candidate_price, confidence_score = item.get('aiCandidatePrice'), item.get('confidenceScore')
+        # NaN は自身と等しくならないため、ここで除外される
+        if not candidate_price or not confidence_score or candidate_price != candidate_price or confidence_score != confidence_score:
             return item['tempUiScore'] # AI解析前の暫定スコアを返す
         
         # SOLD価格の平均をシミュレーションデータから取得（ここでは固定値）
@@ -113,6 +578,71 @@ class ScoreCalculator:
         final_score = P + S
         
         return round(min(final_score, self.MAX_SCORE), 1)
+    
+    def calculate_final_ui_batch(self, candidate_prices, sold_counts, temp_ui_scores, confidence_scores):
+        """
+        calculate_final_ui の列指向・一括版 (NumPy)。送料や手数料率を変更した際の全件再スコアリング用。
+        各引数は同じ長さの配列で、AI解析前 (価格または信頼度が 0 / NaN) の行は暫定スコアをそのまま返す。
+        演算の順序は calculate_profitability / calculate_scarcity と同じにしてあり、
+        最後の小数1桁への丸めは Python の round() で行うため、結果は calculate_final_ui と完全に一致する。
+        
+        Args:
+            candidate_prices (array-like): AIが特定した仮原価 (aiCandidatePrice)。
+            sold_counts (array-like): SOLD数 (soldCount)。
+            temp_ui_scores (array-like): 暫定Uiスコア (tempUiScore)。
+            confidence_scores (array-like): 特定信頼度 (confidenceScore)。
+        
+        Returns:
+            numpy.ndarray: 最終Uiスコア。
+        """
+        if np is None:
+            raise ImportError("calculate_final_ui_batch には NumPy が必要です (pip install numpy)")
+        candidate_prices = np.asarray(candidate_prices, dtype=np.float64)
+        sold_counts = np.asarray(sold_counts, dtype=np.float64)
+        temp_ui_scores = np.asarray(temp_ui_scores, dtype=np.float64)
+        confidence_scores = np.asarray(confidence_scores, dtype=np.float64)
+        has_ai_result = (np.nan_to_num(candidate_prices) != 0) & (np.nan_to_num(confidence_scores) != 0)
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # 利益性 (P)
+            sold_price_avg = sold_counts * 1500 + 10000
+            total_cost = candidate_prices + self.avg_domestic_shipping
+            estimated_profit = sold_price_avg * self.fee_multiplier - total_cost
+            estimated_profit_rate = np.where(sold_price_avg > 0, estimated_profit / sold_price_avg, 0.0)
+            P_score = np.where(
+                estimated_profit < 500,
+                0.0,
+                np.minimum(50, estimated_profit_rate * 100) + np.minimum(50, estimated_profit / 1000),
+            )
+            P = np.minimum(P_score, self.MAX_SCORE) / 2
+            
+            # 希少性 (S)
+            S_score = (temp_ui_scores * 0.5) * (confidence_scores ** 2)
+            S = np.minimum(S_score, self.MAX_SCORE) / 2
+            
+            final_scores = np.minimum(P + S, self.MAX_SCORE)
+        
+        rounded = np.array([round(score, 1) for score in final_scores.tolist()], dtype=np.float64)
+        return np.where(has_ai_result, rounded, temp_ui_scores)
+    
+    def calculate_final_ui_items(self, items):
+        """
+        アイテム (dict) のリストから列を組み立てて calculate_final_ui_batch を実行する。
+        
+        Returns:
+            list: 各アイテムの最終Uiスコア (float)。
+        """
+        columns = {
+            'aiCandidatePrice': [], 'soldCount': [], 'tempUiScore': [], 'confidenceScore': [],
+        }
+        for item in items:
+            columns['aiCandidatePrice'].append(item.get('aiCandidatePrice') or 0)
+            columns['soldCount'].append(item.get('soldCount') or 0)
+            columns['tempUiScore'].append(item['tempUiScore'])
+            columns['confidenceScore'].append(item.get('confidenceScore') or 0)
+        return self.calculate_final_ui_batch(
+            columns['aiCandidatePrice'], columns['soldCount'], columns['tempUiScore'], columns['confidenceScore']
+        ).tolist()
 
 # ==============================================================================
 # II. AI解析機能の改良 (仕入れ先特定モジュール)
@@ -123,28 +653,75 @@ class AISupplierFinder:
     仕入れ先候補の探索と価格特定を行うモジュール。
     """
     
-    def __init__(self):
+    def __init__(self, rate_limiter=None, search_cache=None, image_index=None):
+        """
+        Args:
+            rate_limiter (RateLimiter): 指定した場合、外部検索の呼び出し前にトークンを取得する。
+            search_cache (SearchResultCache): 指定した場合、検索結果をキャッシュし、同じ商品の再検索を省く。
+            image_index (ImageHashIndex): 指定した場合、商品画像を特定済み商品の画像と照合し、
+                一致すれば外部検索を行わずにその結果を使う。
+        """
         # 探索ロジックの優先順位: 商品名・型番 -> 画像解析 -> DB照合 (ここではGoogle Searchに抽象化)
-        pass
+        self.rate_limiter = rate_limiter
+        self.search_cache = search_cache
+        self.image_index = image_index
+    
+    def _search(self, product_name, is_image_search=False):
+        """外部検索を実行する (レート制限はキャッシュミスで実際に検索する場合のみ適用)"""
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        return google_search_ec_sites(product_name, is_image_search=is_image_search)
+    
+    def _cached_search(self, product_name, is_image_search=False):
+        """検索結果キャッシュがあればキャッシュ経由で検索する"""
+        if self.search_cache:
+            return self.search_cache.get_or_search(product_name, is_image_search, self._search)
+        return self._search(product_name, is_image_search=is_image_search)
     
-    def identify_supplier(self, product_id, product_name):
+    def identify_supplier(self, product_id, product_name, product_image=None):
         """
         AIが仕入れ先候補を特定するコアロジック。
         
         Args:
             product_id (str): 商品ID (eBay IDなど)
             product_name (str): 検索に使用する商品名/型番
+            product_image: 商品画像 (ファイルパス / バイト列 / PIL画像 / 画素の配列)。省略可。
             
         Returns:
             dict: 必須取得データを含む辞書
         """
         print(f"\n--- AI解析開始: {product_id} ({product_name}) ---")
         
+        # 0. 画像の知覚ハッシュで特定済み商品を照合 (一致すれば外部検索を行わない)
+        image_hash = None
+        if product_image is not None and self.image_index is not None:
+            try:
+                image_hash = perceptual_hash(product_image)
+            except Exception as e:
+                # 画像を読み込めない場合 (Pillow未導入・壊れたファイル・未対応の形式など) は照合を省略し、通常の検索を続ける
+                print(f"[IMAGE] {product_id} の画像ハッシュを計算できないため、画像照合を省略します: {e!r}")
+            match = self.image_index.lookup(image_hash) if image_hash is not None else None
+            if match:
+                distance, matched_product_id, matched_result = match
+                result = {
+                    **matched_result,
+                    'inventoryCheckTime': datetime.now().isoformat(),
+                    'imageMatchProductId': matched_product_id,
+                    'imageMatchDistance': distance,
+                }
+                print(f"--- 画像一致: {matched_product_id} (ハミング距離 {distance}) の解析結果を再利用 "
+                      f"(価格 ¥{result['aiCandidatePrice']}, 外部検索なし) ---")
+                return result
+        
         # 1. 商品名・型番での検索 (Google Search API使用)
-        candidate_price, supplier_url = google_search_ec_sites(product_name, is_image_search=False)
+        candidate_price, supplier_url = self._cached_search(product_name, is_image_search=False)
         
-        # 2. 画像解析による検索 (ここでは信頼度を上げる要素としてシミュレート)
+        # 2. 画像解析による検索 (画像がある場合、より安い候補が見つかればそちらを採用)
         # 実際には画像データをBase64でAPIに渡し、画像検索を行う
+        if product_image is not None:
+            image_price, image_url = self._cached_search(product_name, is_image_search=True)
+            if image_price < candidate_price:
+                candidate_price, supplier_url = image_price, image_url
         
         # 3. 特定信頼度スコアの計算
         # 検索結果の質、画像一致度などを元に算出（ここではランダム生成）
@@ -166,6 +743,12 @@ class AISupplierFinder:
             'aiCostStatus': True,
         }
         
+        # 6. 画像ハッシュ索引に登録し、同じ画像の商品は次回から外部検索なしで特定する
+        if image_hash is not None:
+            self.image_index.add(image_hash, product_id, {
+                key: value for key, value in result.items() if key != 'inventoryCheckTime'
+            })
+        
         print(f"--- AI解析完了: 価格 ¥{candidate_price}, 信頼度 {confidence_score*100:.1f}% ---")
         return result
 
@@ -175,15 +758,33 @@ class AISupplierFinder:
 
 class BatchProcessor:
     """
-    リサーチ結果DBからAI解析対象を選別し、順次処理を行うバッチ処理クラス。
+    リサーチ結果DBからAI解析対象を選別し、処理を行うバッチ処理クラス。
     データ重複防止と管理フラグのロジックを含む。
+    仕入れ先特定 (外部API待ちが支配的) はスレッドプールで並列に実行し、
+    APIクォータは RateLimiter で守る。スコア計算とDB更新はメインスレッドで行う。
+    同一商品 (product_group_key が同じ) のアイテムは1回の解析結果を共有する。
     """
     
-    def __init__(self, db_simulator):
+    def __init__(self, db_simulator, batch_size=50, max_workers=8, requests_per_second=5.0, search_cache=None,
+                 group_by_product=True, image_index=None):
+        """
+        Args:
+            db_simulator (DBSimulator): Firestore DBのシミュレーションインスタンス。
+            batch_size (int): 一度に処理する件数。
+            max_workers (int): 仕入れ先特定を並列に実行するスレッド数。
+            requests_per_second (float): 外部検索APIの呼び出し上限 (回/秒)。None の場合は制限しない。
+            search_cache (SearchResultCache): 検索結果キャッシュ (省略時はキャッシュしない)。
+            group_by_product (bool): True の場合、同一商品のアイテムをまとめて1回だけ解析する。
+            image_index (ImageHashIndex): 商品画像 (productImage) の類似画像索引 (省略時は画像照合を行わない)。
+        """
         self.db = db_simulator # Firestore DBのシミュレーションインスタンス
-        self.ai_finder = AISupplierFinder()
+        self.rate_limiter = RateLimiter(requests_per_second, burst=max_workers) if requests_per_second else None
+        self.ai_finder = AISupplierFinder(rate_limiter=self.rate_limiter, search_cache=search_cache,
+                                          image_index=image_index)
         self.score_calc = ScoreCalculator()
-        self.BATCH_SIZE = 5 # 一度に処理する件数 (指示書 I. 1. バッチ処理の設計)
+        self.BATCH_SIZE = batch_size # 一度に処理する件数 (指示書 I. 1. バッチ処理の設計)
+        self.max_workers = max_workers
+        self.group_by_product = group_by_product
     
     def _fetch_queued_items(self):
         """
@@ -201,39 +802,439 @@ class BatchProcessor:
     def run_ai_job(self):
         """
         AI仕入れ先特定モジュールを実行し、スコアリングまで行うメインのジョブ。
+        
+        Returns:
+            int: AI_COMPLETED に更新した件数。
         """
         items_to_process = self._fetch_queued_items()
         
         if not items_to_process:
             print("[JOB] 処理すべきAIキューがありません。ジョブを終了します。")
-            return
-            
-        print(f"[JOB] AI解析ジョブを開始します。処理件数: {len(items_to_process)}")
+            return 0
         
-        for item in items_to_process:
-            product_id = item['id']
-            product_name = item['productName']
-            
-            # 1. AI仕入れ先特定モジュールの実行
-            ai_results = self.ai_finder.identify_supplier(product_id, product_name)
-            
-            # 2. 最終スコアの計算
-            # AIの結果を一時的に商品データにマージしてスコア計算に渡す
-            item.update(ai_results) 
-            final_ui_score = self.score_calc.calculate_final_ui(item)
-            
-            # 3. DBへの蓄積と管理フラグの更新
-            update_data = {
-                **ai_results, # 候補価格、URL、信頼度スコアなどが含まれる
-                'finalUiScore': final_ui_score,
-                'researchStatus': 'AI_COMPLETED', # 状態を完了に更新
-                # last_research_date はAI_QUEUEDに送られた時に更新済みだが、再更新しても良い
+        return self._process_items(items_to_process)
+    
+    def _process_items(self, items_to_process, lease_owner=None):
+        """
+        アイテムの仕入れ先特定・スコア計算・DB更新を行う。
+        
+        Args:
+            items_to_process (list): 処理対象のアイテム。
+            lease_owner (str): リース付きで取得したアイテムの場合、リースの所有者ID
+                (所有者が変わっていたアイテムは書き込まない)。
+        
+        Returns:
+            int: AI_COMPLETED に更新した件数。
+        """
+        print(f"[JOB] AI解析ジョブを開始します。処理件数: {len(items_to_process)} (並列数: {self.max_workers})")
+        
+        # 同一商品をまとめ、グループの先頭アイテムで解析する
+        if self.group_by_product:
+            groups = list(group_queued_items(items_to_process).values())
+            print(f"[JOB] 同一商品を集約: {len(items_to_process)} 件 -> {len(groups)} 件のAI解析")
+        else:
+            groups = [[item] for item in items_to_process]
+        
+        completed_count = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # 1. AI仕入れ先特定モジュールの実行 (並列)
+            futures = {
+                executor.submit(
+                    self.ai_finder.identify_supplier, group[0]['id'], group[0]['productName'], group[0].get('productImage')
+                ): group
+                for group in groups
             }
             
-            self.db.update_item_status(product_id, update_data)
-            print(f"[DB] {product_id} のAI解析が完了し、DBを更新しました。最終Ui: {final_ui_score:.1f}")
+            # 完了した順にスコア計算・DB更新を行う (解析結果はグループ内の全アイテムに反映)
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    ai_results = future.result()
+                except Exception as e:
+                    # 失敗したアイテムは AI_QUEUED のまま (リース付きの場合は期限切れ後に AI_QUEUED へ戻り) 再処理される
+                    print(f"[JOB] {', '.join(item['id'] for item in group)} のAI解析に失敗しました: {e}")
+                    continue
+                for item in group:
+                    if self._complete_item(item, dict(ai_results), lease_owner):
+                        completed_count += 1
         
         print("\n[JOB] AI解析バッチジョブが完了しました。")
+        return completed_count
+    
+    def rescore_completed_items(self):
+        """
+        AI_COMPLETED の全アイテムの最終Uiスコアを、現在の ScoreCalculator の設定で一括再計算する
+        (推定国内送料・手数料率を変更した後に使用)。
+        
+        Returns:
+            int: 最終Uiスコアが変わった件数。
+        """
+        completed_items = [item for item in self.db.get_all_data() if item['researchStatus'] == 'AI_COMPLETED']
+        changed_count = 0
+        for item, final_ui_score in zip(completed_items, self.score_calc.calculate_final_ui_items(completed_items)):
+            if item.get('finalUiScore') != final_ui_score:
+                self.db.update_item_status(item['id'], {'finalUiScore': final_ui_score})
+                changed_count += 1
+        print(f"[JOB] AI_COMPLETED {len(completed_items)} 件を再スコアリングしました (変更: {changed_count} 件)。")
+        return changed_count
+    
+    def run_ai_pipeline(self, **pipeline_options):
+        """
+        AI_QUEUED が空になるまで、ステージ分割したパイプライン (SourcingPipeline) で処理する。
+        
+        Returns:
+            int: AI_COMPLETED に更新した件数。
+        """
+        return SourcingPipeline(self, **pipeline_options).run()
+    
+    @staticmethod
+    def _build_update_data(ai_results, final_ui_score):
+        """DBへ書き込む更新内容 (AI解析結果・最終Uiスコア・管理フラグ)"""
+        return {
+            **ai_results, # 候補価格、URL、信頼度スコアなどが含まれる
+            'finalUiScore': final_ui_score,
+            'researchStatus': 'AI_COMPLETED', # 状態を完了に更新
+            # last_research_date はAI_QUEUEDに送られた時に更新済みだが、再更新しても良い
+        }
+    
+    def _complete_item(self, item, ai_results, lease_owner=None):
+        """
+        AI解析結果から最終スコアを計算し、DBを更新する。
+        
+        Returns:
+            bool: DBを更新した場合 True (リースを失っていた場合は False)。
+        """
+        product_id = item['id']
+        # 2. 最終スコアの計算
+        # AIの結果を商品データのコピーにマージしてスコア計算に渡す
+        # (リースを失っていた場合に、他のワーカーが所有するレコードを書き換えないため)
+        final_ui_score = self.score_calc.calculate_final_ui({**item, **ai_results})
+        
+        # 3. DBへの蓄積と管理フラグの更新
+        update_data = self._build_update_data(ai_results, final_ui_score)
+        
+        if lease_owner:
+            if not self.db.update_leased_items({product_id: update_data}, lease_owner):
+                print(f"[DB] {product_id} はリースの期限が切れ、他のワーカーに渡ったため書き込みませんでした。")
+                return False
+        else:
+            self.db.update_item_status(product_id, update_data)
+        print(f"[DB] {product_id} のAI解析が完了し、DBを更新しました。最終Ui: {final_ui_score:.1f}")
+        return True
+
+
+class SourcingDaemon:
+    """
+    AI解析ジョブを常駐プロセスとして実行するデーモン (Cronで毎回起動する代わりに使用)。
+    
+    - 新しい AI_QUEUED の追加を通知 (DBSimulator.wait_for_queued) で待ち、通知がなくてもポーリングする。
+      キューが空の間はポーリング間隔を backoff_factor 倍ずつ max_poll_interval まで延ばし、
+      処理対象が見つかれば min_poll_interval に戻す。
+    - アイテムはリース付きで取得する (AI_PROCESSING)。プロセスが途中で落ちてもリースの期限が切れれば
+      AI_QUEUED に戻り、他のワーカー (または再起動後の自分) が再処理する。
+    - stop() (または SIGINT / SIGTERM) を受けると新しいアイテムの取得をやめ、処理中のバッチを完了してから終了する。
+    """
+    
+    def __init__(self, processor, worker_id=None, lease_seconds=300, min_poll_interval=1.0,
+                 max_poll_interval=60.0, backoff_factor=2.0):
+        """
+        Args:
+            processor (BatchProcessor): 解析・スコア計算・DB書き込みを行うプロセッサー。
+            worker_id (str): リースの所有者ID (省略時はプロセスIDから生成)。
+            lease_seconds (float): リースの期間 (秒)。1バッチの処理時間より十分長くすること。
+            min_poll_interval (float): ポーリング間隔の最小値 (秒)。
+            max_poll_interval (float): ポーリング間隔の最大値 (秒)。
+            backoff_factor (float): キューが空だった場合にポーリング間隔を延ばす倍率。
+        """
+        self.processor = processor
+        self.db = processor.db
+        self.worker_id = worker_id or f"worker-{os.getpid()}-{id(self):x}"
+        self.lease_seconds = lease_seconds
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff_factor = backoff_factor
+        self.poll_interval = min_poll_interval
+        self.processed_count = 0
+        self._stop_event = threading.Event()
+    
+    def stop(self, *_):
+        """終了を要求する (処理中のバッチは完了させる)。シグナルハンドラーとしても使用できる"""
+        if not self._stop_event.is_set():
+            print(f"[DAEMON] {self.worker_id}: 終了要求を受け付けました。処理中のアイテムを完了してから終了します。")
+        self._stop_event.set()
+        self.db.notify_queued()  # 待機中のポーリングを起こす
+    
+    def run_once(self):
+        """
+        期限切れリースの再キュー -> リース付き取得 -> 解析 を1回行う。
+        
+        Returns:
+            int: AI_COMPLETED に更新した件数。
+        """
+        requeued_count = self.db.requeue_expired_leases()
+        if requeued_count:
+            print(f"[DAEMON] リース期限切れの {requeued_count} 件を AI_QUEUED に戻しました。")
+        items = self.db.claim_queued_items(self.processor.BATCH_SIZE, self.worker_id, self.lease_seconds)
+        if not items:
+            return 0
+        print(f"[DAEMON] {self.worker_id}: {len(items)} 件をリース付きで取得しました (期限 {self.lease_seconds} 秒)。")
+        completed_count = self.processor._process_items(items, lease_owner=self.worker_id)
+        self.processed_count += completed_count
+        return completed_count
+    
+    def run_forever(self, install_signal_handlers=True):
+        """
+        stop() が呼ばれるまで処理を続ける。
+        
+        Args:
+            install_signal_handlers (bool): True かつメインスレッドの場合、SIGINT / SIGTERM で stop() する。
+        
+        Returns:
+            int: このデーモンが AI_COMPLETED に更新した件数。
+        """
+        if install_signal_handlers and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+        print(f"[DAEMON] {self.worker_id}: 常駐処理を開始します。")
+        
+        while not self._stop_event.is_set():
+            if self.run_once():
+                self.poll_interval = self.min_poll_interval
+                continue
+            # キューが空: 通知またはポーリング間隔の経過まで待機し、間隔を延ばす
+            if self.db.wait_for_queued(self.poll_interval):
+                self.poll_interval = self.min_poll_interval
+            else:
+                self.poll_interval = min(self.poll_interval * self.backoff_factor, self.max_poll_interval)
+        
+        print(f"[DAEMON] {self.worker_id}: 終了しました。処理件数: {self.processed_count}")
+        return self.processed_count
+
+
+# パイプラインの各ステージに終了を伝える番兵
+_PIPELINE_DONE = object()
+
+
+class _PipelineStopped(Exception):
+    """他のステージの失敗によりパイプラインが停止したことを、待機中のステージに伝える"""
+
+
+class SourcingPipeline:
+    """
+    AI解析ジョブを 取得 -> 仕入れ先特定 -> スコア計算 -> DB書き込み の4ステージに分け、
+    上限付きキューでつないで並行に実行するパイプライン。
+    
+    - 取得: AI_QUEUED を BATCH_SIZE 件ずつ取得し、同一商品をグループにまとめて次へ渡す。
+    - 仕入れ先特定: 外部API待ちが支配的なため max_workers 本のスレッドで並列に実行する。
+    - スコア計算: キューに溜まっている結果をまとめて一括計算する (NumPy があれば calculate_final_ui_items)。
+    - DB書き込み: 更新をまとめて update_items で書き込む。
+    キューには上限があるため、後段が遅い場合は前段が待機し (バックプレッシャー)、メモリは一定に保たれる。
+    DB書き込みが遅くても、キューに空きがある限り仕入れ先特定のAPI呼び出しは止まらない。
+    いずれかのステージで例外が発生した場合は全ステージを停止し、キューを破棄した上で run() が例外を送出する。
+    """
+    # キューの put/get で停止要求を確認する間隔 (秒)
+    QUEUE_POLL_INTERVAL = 0.1
+    
+    def __init__(self, processor, queue_size=64, score_batch_size=32, write_batch_size=32):
+        """
+        Args:
+            processor (BatchProcessor): DB・仕入れ先特定・スコア計算・バッチサイズ・並列数の設定元。
+            queue_size (int): ステージ間キューの上限件数。
+            score_batch_size (int): 一度にスコア計算するグループ数の上限。
+            write_batch_size (int): 一度にDBへ書き込む件数の上限。
+        """
+        self.processor = processor
+        self.score_batch_size = score_batch_size
+        self.write_batch_size = write_batch_size
+        self._identify_queue = queue.Queue(maxsize=queue_size)
+        self._score_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self._active_identifiers = processor.max_workers
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._errors = []
+        self.stats = {
+            'fetched': 0, 'identify_calls': 0, 'identify_failed': 0,
+            'scored': 0, 'score_batches': 0, 'written': 0, 'write_batches': 0,
+        }
+    
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+    
+    def _put(self, target, entry):
+        """停止要求を確認しながら、キューに空きができるまで待って entry を入れる"""
+        while True:
+            if self._stop_event.is_set():
+                raise _PipelineStopped()
+            try:
+                target.put(entry, timeout=self.QUEUE_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+    
+    def _get(self, source):
+        """停止要求を確認しながら、キューから1件取り出す"""
+        while True:
+            if self._stop_event.is_set():
+                raise _PipelineStopped()
+            try:
+                return source.get(timeout=self.QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+    
+    def _drain_queues(self):
+        """停止時に全キューの未処理要素を破棄する (待機中の put を解放し、参照を手放す)"""
+        for pending in (self._identify_queue, self._score_queue, self._write_queue):
+            while True:
+                try:
+                    pending.get_nowait()
+                except queue.Empty:
+                    break
+    
+    def _run_stage(self, stage):
+        """ステージを実行し、例外が発生した場合は記録して全ステージに停止を伝える"""
+        try:
+            stage()
+        except _PipelineStopped:
+            pass
+        except BaseException as e:
+            with self._lock:
+                self._errors.append(e)
+            print(f"[PIPELINE] {threading.current_thread().name} でエラーが発生したため停止します: {e!r}")
+            self._stop_event.set()
+            self._drain_queues()
+    
+    @staticmethod
+    def _take_batch(source, first, max_size):
+        """first に続けて、待たずに取得できる要素を max_size 件までまとめる (番兵に達したら True を返す)"""
+        batch = [first]
+        while len(batch) < max_size:
+            try:
+                entry = source.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _PIPELINE_DONE:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+    
+    def _fetch_stage(self):
+        """AI_QUEUED を取得し、同一商品ごとのグループを仕入れ先特定キューへ送る"""
+        claimed_ids = set()
+        try:
+            while True:
+                items = [
+                    item for item in self.processor.db.get_all_data()
+                    if item['researchStatus'] == 'AI_QUEUED' and item['id'] not in claimed_ids
+                ][:self.processor.BATCH_SIZE]
+                if not items:
+                    break
+                claimed_ids.update(item['id'] for item in items)
+                self._count('fetched', len(items))
+                if self.processor.group_by_product:
+                    groups = group_queued_items(items).values()
+                else:
+                    groups = [[item] for item in items]
+                for group in groups:
+                    self._put(self._identify_queue, group)
+        finally:
+            if not self._stop_event.is_set():
+                for _ in range(self.processor.max_workers):
+                    self._put(self._identify_queue, _PIPELINE_DONE)
+    
+    def _identify_stage(self):
+        """グループの先頭アイテムで仕入れ先を特定し、結果をスコア計算キューへ送る"""
+        try:
+            while True:
+                group = self._get(self._identify_queue)
+                if group is _PIPELINE_DONE:
+                    break
+                self._count('identify_calls')
+                try:
+                    ai_results = self.processor.ai_finder.identify_supplier(
+                        group[0]['id'], group[0]['productName'], group[0].get('productImage')
+                    )
+                except Exception as e:
+                    # 失敗したアイテムは AI_QUEUED のまま残し、次回のジョブで再処理する
+                    self._count('identify_failed')
+                    print(f"[PIPELINE] {', '.join(item['id'] for item in group)} のAI解析に失敗しました: {e}")
+                    continue
+                self._put(self._score_queue, (group, ai_results))
+        finally:
+            with self._lock:
+                self._active_identifiers -= 1
+                is_last = self._active_identifiers == 0
+            if is_last and not self._stop_event.is_set():
+                self._put(self._score_queue, _PIPELINE_DONE)
+    
+    def _score_stage(self):
+        """溜まった解析結果をまとめてスコア計算し、更新内容をDB書き込みキューへ送る"""
+        score_calc = self.processor.score_calc
+        try:
+            done = False
+            while not done:
+                entry = self._get(self._score_queue)
+                if entry is _PIPELINE_DONE:
+                    break
+                batch, done = self._take_batch(self._score_queue, entry, self.score_batch_size)
+                items, results = [], []
+                for group, ai_results in batch:
+                    for item in group:
+                        # DB上のアイテムはロック外で書き換えず、解析結果をマージしたコピーでスコアを計算する
+                        item_results = dict(ai_results)
+                        items.append({**item, **item_results})
+                        results.append(item_results)
+                if np is not None:
+                    final_ui_scores = score_calc.calculate_final_ui_items(items)
+                else:
+                    final_ui_scores = [score_calc.calculate_final_ui(item) for item in items]
+                self._count('scored', len(items))
+                self._count('score_batches')
+                for item, item_results, final_ui_score in zip(items, results, final_ui_scores):
+                    self._put(
+                        self._write_queue,
+                        (item['id'], self.processor._build_update_data(item_results, final_ui_score)),
+                    )
+        finally:
+            if not self._stop_event.is_set():
+                self._put(self._write_queue, _PIPELINE_DONE)
+    
+    def _write_stage(self):
+        """更新内容をまとめてDBへ書き込む"""
+        done = False
+        while not done:
+            entry = self._get(self._write_queue)
+            if entry is _PIPELINE_DONE:
+                break
+            batch, done = self._take_batch(self._write_queue, entry, self.write_batch_size)
+            self.processor.db.update_items(dict(batch))
+            self._count('written', len(batch))
+            self._count('write_batches')
+    
+    def run(self):
+        """
+        全ステージを起動し、AI_QUEUED が空になるまで処理する。
+        
+        Returns:
+            int: AI_COMPLETED に更新した件数。
+        
+        Raises:
+            Exception: いずれかのステージで発生した最初の例外 (全ステージの停止後に送出する)。
+        """
+        stages = [('pipeline-fetch', self._fetch_stage)]
+        stages += [(f'pipeline-identify-{i}', self._identify_stage) for i in range(self.processor.max_workers)]
+        stages += [('pipeline-score', self._score_stage), ('pipeline-write', self._write_stage)]
+        threads = [threading.Thread(target=self._run_stage, args=(stage,), name=name) for name, stage in stages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            print(f"[PIPELINE] 中断: {self.stats}")
+            raise self._errors[0]
+        print(f"[PIPELINE] 完了: {self.stats}")
+        return self.stats['written']
 
 
 # ==============================================================================
@@ -246,8 +1247,15 @@ class DBSimulator:
     Firestore DBの CRUD 操作と管理フラグをシミュレートするインメモリクラス。
     """
     
-    def __init__(self):
+    def __init__(self, write_latency=0.0):
+        """
+        Args:
+            write_latency (float): 書き込み1回あたりの遅延 (秒)。Firestoreへの往復をシミュレートする。
+        """
         self._db = {}
+        self.write_latency = write_latency
+        self._lock = threading.RLock()
+        self._queued_event = threading.Event()  # AI_QUEUED の追加通知
         self.seed_mock_data()
         
     def seed_mock_data(self):
@@ -265,16 +1273,112 @@ class DBSimulator:
             self._db[item['id']] = item
         print(f"[DB] 初期モックデータを {len(self._db)} 件投入しました。")
 
+    def add_item(self, item):
+        """アイテムを追加 (同じIDがあれば上書き)"""
+        with self._lock:
+            self._db[item['id']] = item
+        if item.get('researchStatus') == 'AI_QUEUED':
+            self.notify_queued()
+
     def get_all_data(self):
         """全てのデータをリストとして取得"""
-        return list(self._db.values())
+        with self._lock:
+            return list(self._db.values())
 
     def update_item_status(self, item_id, data_to_update):
         """特定のアイテムのステータスを更新"""
-        if item_id in self._db:
-            self._db[item_id].update(data_to_update)
-            return True
-        return False
+        return self.update_items({item_id: data_to_update}) == 1
+
+    def update_items(self, updates):
+        """
+        複数アイテムをまとめて更新する (Firestoreのバッチ書き込みに相当し、往復は1回)。
+        
+        Args:
+            updates (dict): {アイテムID: 更新内容}
+        
+        Returns:
+            int: 更新した件数。
+        """
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        updated_count = 0
+        with self._lock:
+            for item_id, data_to_update in updates.items():
+                if item_id in self._db:
+                    self._db[item_id].update(data_to_update)
+                    updated_count += 1
+        return updated_count
+        
+    def claim_queued_items(self, limit, owner, lease_seconds):
+        """
+        AI_QUEUED のアイテムを最大 limit 件、リース付きで取得する (AI_PROCESSING に更新)。
+        取得と状態更新はロック内で行うため、複数のワーカーが同じアイテムを取得することはない。
+        (本番の Firestore ではトランザクションで同じ操作を行う)
+        
+        Returns:
+            list: 取得したアイテムのコピー (DB上のレコードは update_leased_items でのみ更新する)。
+        """
+        expires_at = time.time() + lease_seconds
+        with self._lock:
+            claimed = [item for item in self._db.values() if item['researchStatus'] == 'AI_QUEUED'][:limit]
+            for item in claimed:
+                item.update({'researchStatus': 'AI_PROCESSING', 'leaseOwner': owner, 'leaseExpiresAt': expires_at})
+            if not any(item['researchStatus'] == 'AI_QUEUED' for item in self._db.values()):
+                self._queued_event.clear()
+            return [dict(item) for item in claimed]
+
+    def requeue_expired_leases(self, now=None):
+        """
+        リースの期限が切れた AI_PROCESSING のアイテム (処理中にワーカーが停止したもの) を AI_QUEUED に戻す。
+        
+        Returns:
+            int: AI_QUEUED に戻した件数。
+        """
+        now = time.time() if now is None else now
+        requeued_count = 0
+        with self._lock:
+            for item in self._db.values():
+                if item['researchStatus'] == 'AI_PROCESSING' and item.get('leaseExpiresAt', 0) <= now:
+                    item.update({'researchStatus': 'AI_QUEUED', 'leaseOwner': None, 'leaseExpiresAt': None})
+                    requeued_count += 1
+        if requeued_count:
+            self.notify_queued()
+        return requeued_count
+
+    def update_leased_items(self, updates, owner):
+        """
+        owner がリースを保持しているアイテムのみ更新し、リースを解放する。
+        
+        Returns:
+            int: 更新した件数。
+        """
+        if self.write_latency:
+            time.sleep(self.write_latency)
+        updated_count = 0
+        with self._lock:
+            for item_id, data_to_update in updates.items():
+                item = self._db.get(item_id)
+                if item is None or item['researchStatus'] != 'AI_PROCESSING' or item.get('leaseOwner') != owner:
+                    continue
+                item.update(data_to_update)
+                item.update({'leaseOwner': None, 'leaseExpiresAt': None})
+                updated_count += 1
+        return updated_count
+
+    def notify_queued(self):
+        """AI_QUEUED が追加されたことを待機中のデーモンに通知する"""
+        self._queued_event.set()
+
+    def wait_for_queued(self, timeout):
+        """
+        AI_QUEUED の追加通知を最大 timeout 秒待つ。
+        
+        Returns:
+            bool: 通知があった場合 True。
+        """
+        notified = self._queued_event.wait(timeout)
+        self._queued_event.clear()
+        return notified
         
     def print_db_status(self):
         """現在のDBの状態を出力"""
@@ -323,3 +1427,150 @@ if __name__ == "__main__":
         if completed_item.get('finalUiScore') and completed_item.get('confidenceScore'):
             print(f"\n[検証] 最終Uiスコアは {completed_item['finalUiScore']:.1f} です。")
             print(f"[検証] 特定信頼度 {completed_item['confidenceScore']:.2f} が反映されています。")
+
+    # --- 5. 大量のAIキューを並列で処理 ---
+    print("\n>>> AI_QUEUED を40件追加し、10並列・10回/秒のレート制限で処理します")
+    for i in range(40):
+        db.add_item({
+            'id': f'EB2{i:03d}', 'productName': f'トレーディングカード BOX-{i:03d}', 'soldCount': random.randint(1, 30),
+            'currentCompetitors': random.randint(1, 10), 'tempUiScore': round(random.uniform(40, 95), 1),
+            'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-06',
+        })
+    parallel_processor = BatchProcessor(db, batch_size=50, max_workers=10, requests_per_second=10)
+    start_time = time.time()
+    completed_count = parallel_processor.run_ai_job()
+    elapsed = time.time() - start_time
+    print(f"\n[検証] {completed_count} 件を {elapsed:.1f} 秒で処理しました (逐次処理では約 {completed_count} 秒)。")
+
+    # --- 6. 検索結果キャッシュ: 同じ型番の商品は1回だけ検索する ---
+    print("\n>>> 同じ型番の商品 (表記ゆれあり) を30件追加し、検索結果キャッシュを使って処理します")
+    model_names = ['ポケモンカード 151 BOX', 'ﾎﾟｹﾓﾝｶｰﾄﾞ 151 box', 'SEIKO SBDC101', 'ｓｅｉｋｏ  sbdc101', 'Nikon F3']
+    for i in range(30):
+        db.add_item({
+            'id': f'EB3{i:03d}', 'productName': model_names[i % len(model_names)], 'soldCount': random.randint(1, 30),
+            'currentCompetitors': random.randint(1, 10), 'tempUiScore': round(random.uniform(40, 95), 1),
+            'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-07',
+        })
+    cache_path = os.path.join(tempfile.mkdtemp(), 'search_cache.sqlite3')
+    search_cache = SearchResultCache(cache_path, ttl_seconds=3600, max_entries=1000)
+    # 商品の集約を行うと重複がキャッシュに届く前にまとめられるため、ここではキャッシュ単体の効果を見るために無効にする
+    cached_processor = BatchProcessor(db, batch_size=50, max_workers=10, requests_per_second=10, search_cache=search_cache,
+                                      group_by_product=False)
+    cached_processor.run_ai_job()
+    print(f"\n[検証] 検索キャッシュ: {search_cache.stats()} (30件中、実際の検索はユニークな型番数のみ)")
+
+    # --- 7. 商品名の正規化と集約: 表記ゆれのある同一商品は1回だけ解析する ---
+    print("\n>>> 表記ゆれのある同一商品を追加し、集約してAI解析します")
+    variant_names = [
+        '限定版フィギュア ZZZ-007', '【新品】限定版フィギュア ＺＺＺ－００７', 'ZZZ007 フィギュア 限定版',
+        'ぽけもんカード 拡張パック', 'ポケモンカード 拡張パック 未開封', 'ﾎﾟｹﾓﾝｶｰﾄﾞ 拡張パック',
+    ]
+    for i, name in enumerate(variant_names):
+        print(f"  {name!r:<40} -> {product_group_key(name)}")
+        db.add_item({
+            'id': f'EB4{i:03d}', 'productName': name, 'soldCount': random.randint(1, 30),
+            'currentCompetitors': random.randint(1, 10), 'tempUiScore': round(random.uniform(40, 95), 1),
+            'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-08',
+        })
+    BatchProcessor(db, batch_size=50, max_workers=10, requests_per_second=10).run_ai_job()
+
+    # --- 8. 送料・手数料率の変更後、AI_COMPLETED 全件を一括で再スコアリング ---
+    print("\n>>> 推定国内送料を 800 -> 1200 円に変更し、AI_COMPLETED を一括再スコアリングします")
+    processor.score_calc.avg_domestic_shipping = 1200
+    if np is not None:
+        processor.rescore_completed_items()
+        
+        # 一括計算 (calculate_final_ui_batch) と1件ずつの計算 (calculate_final_ui) の結果が完全に一致することを確認
+        # (AI解析前を表す 0 / None / NaN の行を含む)
+        parity_rng = random.Random(0)
+        parity_items = [
+            {
+                'aiCandidatePrice': parity_rng.choice([0, None, float('nan'), parity_rng.randint(100, 40000)]),
+                'confidenceScore': parity_rng.choice([0, None, float('nan'), round(parity_rng.uniform(0.5, 1.0), 2)]),
+                'soldCount': parity_rng.randint(0, 60),
+                'tempUiScore': round(parity_rng.uniform(0, 100), 1),
+            }
+            for _ in range(5000)
+        ]
+        batch_scores = processor.score_calc.calculate_final_ui_items(parity_items)
+        mismatches = sum(
+            1 for item, batch_score in zip(parity_items, batch_scores)
+            if processor.score_calc.calculate_final_ui(item) != batch_score
+        )
+        print(f"[検証] 一括スコア計算と1件ずつの計算の不一致: {mismatches} / {len(parity_items)} 件")
+
+    # --- 9. ステージ分割パイプライン: 書き込みが遅くても仕入れ先特定は止まらない ---
+    print("\n>>> AI_QUEUED を60件追加し、DB書き込み1回あたり0.3秒の遅延を入れてパイプラインで処理します")
+    for i in range(60):
+        db.add_item({
+            'id': f'EB5{i:03d}', 'productName': f'ヴィンテージ時計 MODEL-{i:04d}', 'soldCount': random.randint(1, 30),
+            'currentCompetitors': random.randint(1, 10), 'tempUiScore': round(random.uniform(40, 95), 1),
+            'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-09',
+        })
+    db.write_latency = 0.3
+    start_time = time.time()
+    written_count = BatchProcessor(db, batch_size=20, max_workers=10, requests_per_second=20).run_ai_pipeline()
+    print(f"[検証] パイプライン: {written_count} 件を {time.time() - start_time:.1f} 秒で処理しました "
+          f"(逐次書き込みでは書き込み待ちだけで約 {written_count * 0.3:.0f} 秒)。")
+    db.write_latency = 0.0
+
+    # --- 10. 常駐デーモン: 通知/適応ポーリング・リースによる再キュー・グレースフルシャットダウン ---
+    print("\n>>> 常駐デーモンを起動し、処理中に停止したワーカーのアイテムと新規アイテムを処理します")
+    crashed_items = [
+        {'id': f'EB6{i:03d}', 'productName': f'アンティークカメラ LENS-{i:03d}', 'soldCount': 5, 'currentCompetitors': 2,
+         'tempUiScore': 70.0, 'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-10'}
+        for i in range(3)
+    ]
+    for item in crashed_items:
+        db.add_item(item)
+    # 別のワーカーがリース (1秒) を取得した直後に停止したと仮定する
+    db.claim_queued_items(limit=3, owner='crashed-worker', lease_seconds=1.0)
+    daemon = SourcingDaemon(BatchProcessor(db, batch_size=20, max_workers=10, requests_per_second=20),
+                            worker_id='daemon-1', min_poll_interval=0.2, max_poll_interval=2.0)
+    daemon_thread = threading.Thread(target=daemon.run_forever, kwargs={'install_signal_handlers': False})
+    daemon_thread.start()
+    time.sleep(2.5)
+    for i in range(5):
+        db.add_item({
+            'id': f'EB7{i:03d}', 'productName': f'限定スニーカー SNK-{i:03d}', 'soldCount': 12, 'currentCompetitors': 4,
+            'tempUiScore': 82.0, 'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-10',
+        })
+    time.sleep(0.1)
+    daemon.stop()
+    daemon_thread.join()
+    remaining = [item['id'] for item in db.get_all_data() if item['researchStatus'] in ('AI_QUEUED', 'AI_PROCESSING')]
+    print(f"[検証] デーモン処理件数: {daemon.processed_count}, 未処理/処理中のアイテム: {remaining}")
+
+    # --- 11. 画像の知覚ハッシュ照合: 同じ画像の商品は外部検索なしで特定する ---
+    if np is not None:
+        print("\n>>> 商品画像付きのアイテムを処理します (2回目以降の同一画像は pHash 索引で特定)")
+        
+        def make_product_image(seed, noise_seed=None, brightness=0.0):
+            """シミュレーション用の商品画像 (64x64 グレースケール)。noise_seed を変えると再撮影・再圧縮相当のノイズを加える"""
+            pattern = np.kron(np.random.RandomState(seed).uniform(0, 255, (8, 8)), np.ones((8, 8)))
+            if noise_seed is not None:
+                pattern = pattern + np.random.RandomState(noise_seed).normal(0, 6, pattern.shape)
+            return np.clip(pattern + brightness, 0, 255)
+        
+        image_index = ImageHashIndex(os.path.join(tempfile.mkdtemp(), 'image_hash_index.sqlite3'), max_distance=6)
+        image_processor = BatchProcessor(db, batch_size=50, max_workers=4, requests_per_second=10,
+                                         image_index=image_index, group_by_product=False)
+        db.add_item({
+            'id': 'EB8000', 'productName': 'ブリキ玩具 ロボット', 'soldCount': 9, 'currentCompetitors': 2,
+            'tempUiScore': 85.0, 'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-11',
+            'productImage': make_product_image(1),
+        })
+        image_processor.run_ai_job()
+        # 同じ商品を別の出品者が別タイトル・再撮影画像で出品したケースと、別商品
+        db.add_item({
+            'id': 'EB8001', 'productName': '昭和レトロ 当時物 ロボット', 'soldCount': 4, 'currentCompetitors': 3,
+            'tempUiScore': 80.0, 'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-11',
+            'productImage': make_product_image(1, noise_seed=7, brightness=12),
+        })
+        db.add_item({
+            'id': 'EB8002', 'productName': 'ブリキ玩具 自動車', 'soldCount': 6, 'currentCompetitors': 1,
+            'tempUiScore': 75.0, 'researchStatus': 'AI_QUEUED', 'aiCostStatus': False, 'lastResearchDate': '2025-11-11',
+            'productImage': make_product_image(2),
+        })
+        image_processor.run_ai_job()
+        print(f"[検証] pHash索引: 登録 {len(image_index)} 件, 一致 {image_index.hits} 件, 不一致 {image_index.misses} 件")